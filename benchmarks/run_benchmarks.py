@@ -0,0 +1,269 @@
+"""
+End-to-end benchmark of the template pipeline on synthetic Brick hierarchies.
+
+For every hierarchy size this times each stage on its own and the pipeline as a
+whole:
+
+    hierarchy     process_class_hierarchy on a synthetic Brick-like ontology
+    s223_info     get_s223_info, offline from a seeded snapshot cache
+    autocomplete  process_brick_templates against a local StubLLMServer
+    templates     process_directory on the autocompleted YAML
+
+Results are written as JSON so runs can be compared between commits.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --sizes 100 1000 10000 --latency 0.02 --error-rate 0.05
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/previous.json
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import openai
+import yaml
+
+from template_builder import (
+    CompletionEngine,
+    S223_URL,
+    StubLLMServer,
+    get_instrumentation,
+    get_s223_info,
+    import_snapshot,
+    process_brick_templates,
+    process_class_hierarchy,
+    process_directory,
+    set_client,
+    set_completion_cache,
+    strip_namespace,
+)
+from template_builder.create_yaml_brick import ClassIndex
+from benchmarks.synthetic import brick_like_graph, s223_like_graph
+
+STAGES = ("hierarchy", "s223_info", "autocomplete", "templates")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_responder(prop_df, media_df, asp_df, ek_df, qk_df):
+    """
+    Stub answers drawn from the vocabularies, chosen deterministically per class
+    so every run (and every retry) produces the same output.
+    """
+    vocabularies = {
+        "s223_properties": list(prop_df["s223_class"].values),
+        "quantitykinds": list(qk_df["quantitykinds"].values) + list(ek_df["s223_class"].values),
+        "media": list(media_df["s223_class"].values) + ["None"],
+        "aspects": list(asp_df["s223_class"].values) or ["None"],
+    }
+
+    def responder(messages):
+        prompt = str(messages[-1].get("content", ""))
+        match = re.search(r"brick_class: (\S+)", prompt)
+        seed = int(hashlib.sha256((match.group(1) if match else prompt).encode("utf-8")).hexdigest(), 16)
+        for tag, values in vocabularies.items():
+            if f"<{tag}>" in prompt and values:
+                return str(values[seed % len(values)])
+        return "None"
+
+    return responder
+
+
+def yaml_files(directory):
+    found = []
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            if file.endswith(".yml"):
+                found.append(os.path.join(root, file))
+    return sorted(found)
+
+
+def limit_classes(template_files, max_classes):
+    """Leading template files holding at most `max_classes` classes (at least one file)."""
+    selected, classes = [], 0
+    for template_file in template_files:
+        with open(template_file, "r") as f:
+            count = len(yaml.safe_load(f) or {})
+        if selected and max_classes is not None and classes + count > max_classes:
+            break
+        selected.append(template_file)
+        classes += count
+    return selected, classes
+
+
+@contextlib.contextmanager
+def timed(stages, name):
+    start = time.perf_counter()
+    stages[name] = {}
+    yield stages[name]
+    stages[name]["seconds"] = round(time.perf_counter() - start, 4)
+
+
+def run_size(size, args, workdir):
+    """Run every stage for one hierarchy size inside `workdir` and return its results."""
+    os.chdir(workdir)
+    get_instrumentation().reset()
+    stages = {}
+    pipeline_start = time.perf_counter()
+
+    graph, root = brick_like_graph(size, depth=args.depth, fanout=args.fanout, seed=args.seed)
+
+    with timed(stages, "hierarchy") as stage:
+        os.makedirs("brick_yaml", exist_ok=True)
+        index_start = time.perf_counter()
+        class_index = ClassIndex(graph)
+        stage["index_seconds"] = round(time.perf_counter() - index_start, 4)
+        processed = process_class_hierarchy(root, graph, "brick_yaml", class_index=class_index)
+        stage["classes"] = len(processed)
+        stage["files"] = len(yaml_files("brick_yaml"))
+
+    with timed(stages, "s223_info") as stage:
+        info = get_s223_info(offline=True, cache_dir=args.cache_dir)
+        stage["vocabulary_sizes"] = {
+            name: len(df) for name, df in zip(("properties", "media", "aspects", "eks", "quantitykinds"), info[5:])
+        }
+
+    template_files, classes = limit_classes(yaml_files("brick_yaml"), args.llm_classes)
+    server = StubLLMServer(
+        responder=make_responder(*info[5:]), latency=args.latency, error_rate=args.error_rate,
+        error_status=args.error_status, seed=args.seed,
+    )
+    with server, timed(stages, "autocomplete") as stage:
+        set_client(openai.OpenAI(api_key="stub", base_url=server.base_url))
+        with CompletionEngine(max_workers=args.workers, max_retries=args.max_retries,
+                              backoff_base=args.backoff_base, backoff_max=args.backoff_max) as engine:
+            process_brick_templates(template_files, "brick_yaml_autocomplete", *info, engine=engine)
+        stage.update(files=len(template_files), classes=classes, requests=server.requests, injected_errors=server.errors)
+
+    with timed(stages, "templates") as stage:
+        summary = process_directory(os.path.join("brick_yaml_autocomplete", "brick_yaml"), "s223_templates",
+                                    incremental=False, workers=args.render_workers, dedup=args.dedup)
+        stage.update(files=summary["rebuilt"], errors=len(summary["errors"]))
+        if args.dedup:
+            stage.update(compression_ratio=summary["dedup"]["compression_ratio"])
+
+    return {
+        "size": size,
+        "depth": args.depth,
+        "fanout": args.fanout,
+        "root": strip_namespace(root),
+        "stages": stages,
+        "pipeline_seconds": round(time.perf_counter() - pipeline_start, 4),
+        "counters": get_instrumentation().report()["counters"],
+    }
+
+
+def compare(results, previous_path):
+    """Print per-stage time ratios against an earlier results file."""
+    with open(previous_path, "r") as f:
+        previous = {run["size"]: run for run in json.load(f)["runs"]}
+    for run in results["runs"]:
+        before = previous.get(run["size"])
+        if before is None:
+            continue
+        for stage in STAGES + ("pipeline",):
+            now = run["pipeline_seconds"] if stage == "pipeline" else run["stages"][stage]["seconds"]
+            then = before["pipeline_seconds"] if stage == "pipeline" else before["stages"][stage]["seconds"]
+            ratio = now / then if then else float("inf")
+            print(f"size {run['size']:>6} {stage:<13} {then:>9.3f}s -> {now:>9.3f}s  x{ratio:.2f}", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="Number of synthetic classes per run")
+    parser.add_argument("--depth", type=int, default=6, help="Maximum hierarchy depth")
+    parser.add_argument("--fanout", type=int, default=8, help="Children per class before the hierarchy widens")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--s223-ttl", help="Real 223p.ttl to benchmark get_s223_info against instead of a synthetic vocabulary")
+    parser.add_argument("--s223-per-root", type=int, default=20, help="Members per root of the synthetic 223P vocabulary")
+    parser.add_argument("--latency", type=float, default=0.01, help="Stub LLM latency per request in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub requests failing")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent completion requests")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--backoff-base", type=float, default=0.05)
+    parser.add_argument("--backoff-max", type=float, default=1.0)
+    parser.add_argument("--llm-classes", type=int, default=1000,
+                        help="Cap on the classes sent through the autocomplete stage (0 for no cap)")
+    parser.add_argument("--render-workers", type=int, default=1, help="Worker processes for process_directory")
+    parser.add_argument("--dedup", action="store_true", help="Share identical template bodies through base templates")
+    parser.add_argument("--output", help="Results file; defaults to benchmarks/results/<commit>-<timestamp>.json")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's INFO log messages; by default only warnings")
+    args = parser.parse_args(argv)
+    args.llm_classes = args.llm_classes or None
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    commit = git_commit()
+    started = datetime.now(timezone.utc)
+    output = os.path.abspath(args.output or os.path.join(
+        RESULTS_DIR, f"{commit or 'unknown'}-{started.strftime('%Y%m%dT%H%M%SZ')}.json"))
+    cwd = os.getcwd()
+    # completions must come from the stub, never from an earlier run's cache
+    set_completion_cache(None)
+
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="template_builder_bench_") as tmp:
+        args.cache_dir = os.path.join(tmp, "ontologies")
+        s223_path = args.s223_ttl and os.path.abspath(args.s223_ttl)
+        if s223_path is None:
+            s223_path = os.path.join(tmp, "223p.ttl")
+            s223_like_graph(per_root=args.s223_per_root, seed=args.seed).serialize(s223_path, format="turtle")
+        import_snapshot(S223_URL, s223_path, cache_dir=args.cache_dir)
+
+        for size in args.sizes:
+            workdir = os.path.join(tmp, f"size_{size}")
+            os.makedirs(workdir)
+            print(f"Benchmarking {size} classes...", file=sys.stderr)
+            try:
+                run = run_size(size, args, workdir)
+            finally:
+                os.chdir(cwd)
+            runs.append(run)
+            print("  " + ", ".join(f"{stage} {run['stages'][stage]['seconds']:.3f}s" for stage in STAGES)
+                  + f", pipeline {run['pipeline_seconds']:.3f}s", file=sys.stderr)
+
+    results = {
+        "commit": commit,
+        "started": started.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {k: v for k, v in vars(args).items() if k not in ("cache_dir", "output", "compare", "verbose")},
+        "runs": runs,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+    if args.compare:
+        compare(results, args.compare)
+    return results
+
+
+if __name__ == "__main__":
+    main()
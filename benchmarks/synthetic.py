@@ -0,0 +1,102 @@
+"""
+Synthetic Brick-like and 223P-like ontologies for benchmarking the pipeline.
+"""
+
+import random
+from collections import deque
+
+from rdflib import Graph, Literal
+
+from template_builder.namespaces import BRICK, OWL, RDF, RDFS, SKOS, S223
+
+MEDIA = ["Air", "Water", "Steam", "Refrigerant", "Natural_Gas", "Oil"]
+QUANTITIES = ["Temperature", "Pressure", "Flow", "Humidity", "Power", "Energy", "Speed", "Position"]
+QUALIFIERS = ["Supply", "Return", "Outside", "Mixed", "Exhaust", "Zone", "Discharge", "Entering", "Leaving"]
+KINDS = ["Sensor", "Setpoint", "Command", "Status", "Alarm"]
+
+
+def _class_name(rnd, index):
+    parts = [rnd.choice(QUALIFIERS), rnd.choice(MEDIA), rnd.choice(QUANTITIES), rnd.choice(KINDS)]
+    return f"{'_'.join(parts)}_{index}"
+
+
+def brick_like_graph(size, depth=6, fanout=8, redundant_edges=0.1, deprecated=0.02, seed=0, root="Point"):
+    """
+    Build a Brick-like class hierarchy of `size` classes under brick:<root>.
+
+    Classes are added breadth first with up to `fanout` children per class and at
+    most `depth` levels; once every class above the depth limit is full, existing
+    classes get more children. A fraction of classes also get a redundant
+    rdfs:subClassOf edge to their grandparent (exercising the transitive reduction)
+    and a fraction are marked owl:deprecated.
+
+    Returns:
+        tuple: (graph, prefixed root class name)
+    """
+    rnd = random.Random(seed)
+    g = Graph()
+    g.bind("brick", BRICK)
+    root_uri = BRICK[root]
+    g.add((root_uri, RDF.type, OWL.Class))
+    g.add((root_uri, SKOS.definition, Literal(f"The root {root} class")))
+    parents = {root_uri: None}
+    levels = {root_uri: 0}
+    queue = deque([root_uri])
+    count = 0
+    while count < size:
+        if not queue:
+            # depth limit reached everywhere: widen the existing levels
+            queue = deque(c for c in parents if levels[c] < depth - 1)
+        parent = queue.popleft()
+        for _ in range(fanout):
+            if count >= size:
+                break
+            count += 1
+            child = BRICK[_class_name(rnd, count)]
+            parents[child] = parent
+            levels[child] = levels[parent] + 1
+            g.add((child, RDF.type, OWL.Class))
+            g.add((child, RDFS.subClassOf, parent))
+            g.add((child, SKOS.definition, Literal(f"Synthetic class {count} measuring something")))
+            if parents[parent] is not None and rnd.random() < redundant_edges:
+                g.add((child, RDFS.subClassOf, parents[parent]))
+            if rnd.random() < deprecated:
+                g.add((child, OWL.deprecated, Literal(True)))
+            if levels[child] < depth - 1:
+                queue.append(child)
+    return g, f"brick:{root}"
+
+
+def s223_like_graph(per_root=20, seed=0):
+    """
+    Build a small 223P-like vocabulary with the roots get_s223_info queries
+    (properties, substances, aspects and other enumeration kinds).
+    """
+    rnd = random.Random(seed)
+    g = Graph()
+    g.bind("s223", S223)
+    roots = {
+        "Property": "Property",
+        "EnumerationKind-Substance": "Medium",
+        "EnumerationKind-Aspect": "Aspect",
+        "EnumerationKind-Binary": "Binary",
+        "EnumerationKind-Occupancy": "Occupancy",
+        "EnumerationKind-Role": "Role",
+        "EnumerationKind-Numerical": "Numerical",
+    }
+    g.add((S223["EnumerationKind"], RDFS.comment, Literal("Root of the enumeration kinds")))
+    for root, stem in roots.items():
+        root_uri = S223[root]
+        g.add((root_uri, RDFS.comment, Literal(f"The {root} root")))
+        if root.startswith("EnumerationKind-"):
+            g.add((root_uri, RDFS.subClassOf, S223["EnumerationKind"]))
+        members = [root_uri]
+        for i in range(per_root):
+            name = S223[f"{stem}-{rnd.choice(MEDIA + QUANTITIES).replace('_', '')}{i}"]
+            g.add((name, RDFS.subClassOf, rnd.choice(members)))
+            g.add((name, RDFS.comment, Literal(f"Synthetic {stem} member {i}")))
+            members.append(name)
+    for name in ("Fluid-Air", "Fluid-Water"):
+        g.add((S223[name], RDFS.subClassOf, S223["EnumerationKind-Substance"]))
+        g.add((S223[name], RDFS.comment, Literal(f"The {name} medium")))
+    return g
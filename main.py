@@ -1,44 +1,95 @@
 #%%
 import os 
+import argparse
+import logging
+import multiprocessing
 from rdflib import Graph
 import yaml 
 from template_builder import (
-    process_brick_template, 
+    process_brick_templates,
+    CompletionEngine,
+    CompletionCache,
+    CompletionJournal,
+    set_completion_cache,
     get_s223_info, 
     strip_namespace, 
     process_class_hierarchy,
+    process_class_hierarchies,
     process_directory,
-    process_yaml_file
+    process_yaml_file,
+    load_ontology,
+    BRICK_URL,
+    stage,
+    write_report,
 )
+# DEBUG also logs every class and file; INFO keeps large runs quiet
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger("main")
+# 'cprofile' or 'sampling' profiles every stage below; the profiles go into the run report
+PROFILE = None
+REPORT = "run_report"
+# Worker processes for the class hierarchy stage. Under the spawn and forkserver start
+# methods (macOS, Windows) workers re-import this script, which would re-run every
+# cell, so it only runs in parallel where processes are forked.
+WORKERS = None if multiprocessing.get_start_method() == "fork" else 1
+
+# --resume continues an interrupted autocomplete run from its journal
+# --all-roots builds the whole Brick tree instead of the Temperature_Sensor subtree;
+# every class goes through the autocomplete stage (4 LLM calls each)
+parser = argparse.ArgumentParser()
+parser.add_argument("--resume", action="store_true", help="Resume the autocomplete stage from its journal")
+parser.add_argument("--all-roots", action="store_true", help="Build Point, Equipment, Location and Collection")
+args, _ = parser.parse_known_args()
 #%%
-g = Graph()
-g.parse("https://brickschema.org/schema/1.4.3/Brick.ttl", format = "ttl")
-start_parent = "brick:Temperature_Sensor"
-start_parent_clean = strip_namespace(start_parent)
+# Set to a content sha256 (see list_snapshots) to pin an ontology version.
+# TEMPLATE_BUILDER_OFFLINE=1 runs from the local snapshot cache only.
+BRICK_PIN = None
+S223_PIN = None
+
+with stage("load_brick", profile=PROFILE):
+    g = load_ontology(BRICK_URL, pin=BRICK_PIN)
+# Root classes built in one run; a class reachable from several roots is written once
+root_classes = ["brick:Temperature_Sensor"]
+if args.all_roots:
+    root_classes = ["brick:Point", "brick:Equipment", "brick:Location", "brick:Collection"]
 
 # Ensure templates directory exists
 templates_dir = "brick_yaml"
 os.makedirs(templates_dir, exist_ok=True)
-print(f"Created directory: {templates_dir}")
+logger.info("Created directory: %s", templates_dir)
 
-# Start processing from the root parent class
-processed_classes = process_class_hierarchy(start_parent, g, templates_dir)
+# Plan the combined hierarchy, then write it in balanced shards (see WORKERS)
+with stage("class_hierarchy", profile=PROFILE):
+    processed_classes = process_class_hierarchies(root_classes, g, templates_dir, workers=WORKERS)
 
 # Print overall summary
-print(f"\nOverall Summary:")
-print(f"Processed {len(processed_classes)} unique classes in the hierarchy")
+logger.info("Processed %d unique classes in the hierarchy", len(processed_classes))
 # %%
 
-s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds, prop_df, media_df, asp_df, ek_df, qk_df = get_s223_info()
+with stage("s223_info", profile=PROFILE):
+    s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds, prop_df, media_df, asp_df, ek_df, qk_df = get_s223_info(pin=S223_PIN)
 
 template_dir = "brick_yaml"
 new_dir = "brick_yaml_autocomplete"
+template_files = []
 for root, dirs, files in os.walk(template_dir):
     for file in files:
         if file.endswith(".yml"):
-            template_file = os.path.join(root, file)
-            process_brick_template(template_file, new_dir, s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds, prop_df, media_df, asp_df, ek_df, qk_df)
-            print(f"Template file: {template_file}")
+            template_files.append(os.path.join(root, file))
+            logger.debug("Template file: %s", os.path.join(root, file))
+
+# Completions are cached on disk, so re-runs only pay for new or changed prompts.
+# CompletionCache(replay=True) fails on any miss instead of calling the API (e.g. in CI).
+set_completion_cache(CompletionCache())
+
+# Prompts for all classes run concurrently; output order stays deterministic
+# Every completed class and field is journaled; an interrupted run can be resumed with --resume.
+# The journal is removed once every file has been written.
+journal = CompletionJournal(os.path.join(new_dir, ".autocomplete_journal.jsonl"), resume=args.resume)
+with stage("autocomplete", profile=PROFILE), journal, CompletionEngine(max_workers=8, requests_per_second=5) as engine:
+    process_brick_templates(template_files, new_dir, s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds, prop_df, media_df, asp_df, ek_df, qk_df, engine=engine, journal=journal)
+journal.finish()
 
 # %%
 input_dir = os.path.join('brick_yaml_reviewed', 'brick_yaml')
@@ -46,8 +97,13 @@ output_dir = 's223_templates'
 os.makedirs(output_dir, exist_ok=True)
 
 # Process all YAML files in the input directory
-process_directory(input_dir, output_dir)
+with stage("templates", profile=PROFILE):
+    process_directory(input_dir, output_dir)
+
+logger.info("Templates generated in %s", output_dir)
 
-print(f"Templates generated in {output_dir}")
+# Timers, counters and profiles of the whole run
+write_report(REPORT)
+logger.info("Run report written to %s.json and %s.txt", REPORT, REPORT)
 
 # %%
@@ -2,13 +2,27 @@
 Brick 223 Templates package for creating and managing ASHRAE 223 templates from Brick schema.
 """
 
-from .ai_complete_yaml import process_brick_template, validate_result
-from .create_yaml_brick import process_class_hierarchy, strip_namespace
+from .ai_complete_yaml import process_brick_template, process_brick_templates, validate_result
+from .batch_complete_yaml import process_brick_templates_batched
+from .candidate_retrieval import CandidateRetriever
+from .preclassify import PreClassifier, learn_lexicon
+from .hierarchy_complete import process_brick_tree
+from .vocabulary import VocabularyIndex, vocabulary_index
+from .create_yaml_brick import process_class_hierarchy, process_class_hierarchies, strip_namespace
 from .utils import * 
 from .namespaces import *
-from .get_completion import get_completion
+from .get_completion import get_completion, set_client, set_completion_cache
+from .completion_cache import CompletionCache, CacheMiss
+from .journal import CompletionJournal
+from .completion_engine import CompletionEngine, TokenBucket
+from .stub_llm_server import StubLLMServer
 from .get_s223_data import get_s223_info
 from .create_223_templates import process_yaml_file, process_directory
+from .template_library import process_directory_to_library, directory_to_library, library_to_directory, read_library, lookup_templates
+from .template_registry import TemplateRegistry
+from .convert_model import ModelConverter, convert_model
+from .ontology_cache import load_ontology, import_snapshot, list_snapshots, BRICK_URL, S223_URL
+from .instrumentation import Instrumentation, get_instrumentation, stage, write_report
 
 
 def hello() -> str:
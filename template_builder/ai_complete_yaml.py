@@ -4,12 +4,19 @@ from rdflib import Graph
 from .utils import * 
 from .namespaces import * 
 from .get_completion import get_completion
+from .preclassify import mark_sources
+from .vocabulary import vocabulary_index
+from .instrumentation import stage, count
+from . import yaml_io
 import yaml
 import os
+import logging
 import pandas as pd
 import csv
 from io import StringIO
 
+logger = logging.getLogger(__name__)
+
 def validate_result(result, df, column_name='s223_class'):
     """
     Validate if a result is in the provided dataframe.
@@ -22,31 +29,18 @@ def validate_result(result, df, column_name='s223_class'):
     Returns:
         bool: True if the result is in the dataframe, False otherwise
     """
-    result = result.strip()
-    return (result in df[column_name].values)
+    return result in vocabulary_index(df, column_name)
+
+FIELDS = ('s223_class', 'qk_ek', 'medium', 'aspects')
 
-def process_brick_template(template_file, new_dir, s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds, prop_df, media_df, asp_df, ek_df, qk_df):
+def load_brick_template(template_file):
     """
-    Process a Brick template file, running prompts on each brick class and definition
-    and updating the YAML file with the results.
-    
-    Args:
-        template_file (str): Path to the template YAML file
+    Load a Brick template file as a list of (brick_class, definition_data, text_definition).
     """
-    print(f"Processing template file: {template_file}")
-
-    
-    # Load the brick template
-    with open(template_file, "r") as f:
-        brick_dict = yaml.safe_load(f)
-    
-    # Process each brick class and definition
-    system_prompt = """"""
-    updated_brick_dict = {}
-    
-    for brick_class, definition_data in brick_dict.items():
-        print(f"Processing brick_class: {brick_class}")
-        
+    with stage('yaml_read'):
+        brick_entries = list(yaml_io.iter_entities(template_file))
+    entries = []
+    for brick_class, definition_data in brick_entries:
         # Extract the definition text
         if isinstance(definition_data, dict):
             # Keep the original structure
@@ -56,9 +50,18 @@ def process_brick_template(template_file, new_dir, s223_properties, s223_media,
             # If it's just a string, create a dictionary
             text_definition = definition_data
             updated_definition_data = {'brick_definition': text_definition}
-        
-        # Prompt 1: Determine s223_class
-        prompt1 = f"""
+        entries.append((brick_class, updated_definition_data, text_definition))
+    return entries
+
+def build_prompts(brick_class, text_definition, s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds):
+    """
+    Build the four independent prompts for a brick class, keyed by field.
+
+    Returns:
+        dict: Prompts keyed by 's223_class', 'qk_ek', 'medium' and 'aspects'
+    """
+    # Prompt 1: Determine s223_class
+    prompt1 = f"""
         Determine what s223_class the brick_class should be, based on its name and definition.
         the possible s223 classes are <s223_properties>{s223_properties}</s223_properties> 
 
@@ -67,19 +70,8 @@ def process_brick_template(template_file, new_dir, s223_properties, s223_media,
         brick_class: {brick_class}
         definition: {text_definition}
         """
-        s223_class_result = get_completion(prompt1, system_prompt)
-        s223_class_result = s223_class_result.strip()
-        print(f"s223_class: {s223_class_result}")
-        
-        # Validate s223_class result
-        is_valid_s223_class = validate_result(s223_class_result, prop_df)
-        print(f"Is valid s223_class: {is_valid_s223_class}")
-        
-        updated_definition_data['s223_class'] = s223_class_result
-        updated_definition_data['s223_class_valid'] = is_valid_s223_class
-        
-        # Prompt 2: Determine quantitykind or enumerationkind
-        prompt2 = f"""
+    # Prompt 2: Determine quantitykind or enumerationkind
+    prompt2 = f"""
         Determine what quantitykind or enumerationkind the brick_class should be, based on its name and definition.
         the possible quantitykinds are <quantitykinds>{quantitykinds}</quantitykinds> 
         the possible enumerationkinds are <s223_eks>{s223_eks}</s223_eks>
@@ -88,29 +80,8 @@ def process_brick_template(template_file, new_dir, s223_properties, s223_media,
         brick_class: {brick_class}
         definition: {text_definition}
         """
-        qk_ek_result = get_completion(prompt2, system_prompt)
-        qk_ek_result = qk_ek_result.strip()
-        print(f"quantitykind/enumerationkind: {qk_ek_result}")
-        
-        # Check if result is in quantitykind or enumerationkind list
-        is_quantitykind = qk_ek_result in qk_df['quantitykinds'].values
-        is_enumerationkind = validate_result(qk_ek_result, ek_df)
-        
-        qk_ek_type = "None"
-        if is_quantitykind:
-            updated_definition_data['quantitykind'] = qk_ek_result
-            updated_definition_data['quantitykind_valid'] = True
-        elif is_enumerationkind:
-            updated_definition_data['enumerationkind'] = qk_ek_result
-            updated_definition_data['enumerationkind_valid'] = True
-        else:
-            print(f"Warning: {qk_ek_result} not found in quantitykind or enumerationkind lists")
-            updated_definition_data['quantitykind_valid'] = False
-            updated_definition_data['enumerationkind_valid'] = False
-            updated_definition_data['quantitykind'] = qk_ek_result
-        
-        # Prompt 3: Determine medium
-        prompt3 = f"""
+    # Prompt 3: Determine medium
+    prompt3 = f"""
         Determine what medium the brick_class should be associated with, based on its name and definition.
         the possible media are <media>{s223_media}</media> 
         Only return the medium. Do not return any other information.
@@ -120,23 +91,8 @@ def process_brick_template(template_file, new_dir, s223_properties, s223_media,
         brick_class: {brick_class}
         definition: {text_definition}
         """
-        medium_result = get_completion(prompt3, system_prompt)
-        medium_result = medium_result.strip()
-        print(f"medium: {medium_result}")
-        
-        # Validate medium result
-        if medium_result.lower() == "none":
-            is_valid_medium = True
-            print("No medium specified")
-        else:
-            is_valid_medium = validate_result(medium_result, media_df)
-            print(f"Is valid medium: {is_valid_medium}")
-        
-        updated_definition_data['medium'] = medium_result
-        updated_definition_data['medium_valid'] = is_valid_medium
-        
-        # Prompt 4: Determine aspects
-        prompt4 = f"""
+    # Prompt 4: Determine aspects
+    prompt4 = f"""
         Determine what aspects the brick_class should be associated with, based on its name and definition.
         The possible aspects are <aspects>{s223_aspects}</aspects> 
         If there are no directly applicable aspects, return None.
@@ -145,29 +101,223 @@ def process_brick_template(template_file, new_dir, s223_properties, s223_media,
         brick_class: {brick_class}
         definition: {text_definition}
         """
-        aspects_result = get_completion(prompt4, system_prompt)
-        aspects_result = aspects_result.strip()
-        print(f"aspects: {aspects_result}")
+    return dict(zip(FIELDS, (prompt1, prompt2, prompt3, prompt4)))
+
+def _record_repair(updated_definition_data, key, original, repaired, confidence):
+    # keep what the model said next to the repaired value so reviewers can check it
+    logger.info("Repaired %s: %r -> %r (confidence %.2f)", key, original, repaired, confidence)
+    count('repairs')
+    updated_definition_data[f'{key}_repaired_from'] = original
+    updated_definition_data[f'{key}_confidence'] = round(float(confidence), 3)
+
+def apply_results(updated_definition_data, results, prop_df, media_df, asp_df, ek_df, qk_df, repair=True):
+    """
+    Validate the raw completions for one brick class and record them in its definition data.
+
+    Args:
+        updated_definition_data (dict): The class entry to update in place
+        results (dict): Raw completion text keyed by field (see FIELDS); missing fields are skipped
+        repair (bool): Replace near-miss answers with their closest vocabulary term when the
+            similarity is above the index's repair threshold
+    """
+    if 's223_class' in results:
+        s223_class_result = results['s223_class'].strip()
+        logger.debug("s223_class: %s", s223_class_result)
+        
+        # Validate s223_class result
+        value, is_valid_s223_class, confidence, repaired = vocabulary_index(prop_df, 's223_class').validate(s223_class_result)
+        if repaired and not repair:
+            value, is_valid_s223_class = s223_class_result, False
+        logger.debug("Is valid s223_class: %s", is_valid_s223_class)
         
-        # Validate aspects result
+        updated_definition_data['s223_class'] = value
+        updated_definition_data['s223_class_valid'] = is_valid_s223_class
+        if repair and repaired:
+            _record_repair(updated_definition_data, 's223_class', s223_class_result, value, confidence)
+    
+    if 'qk_ek' in results:
+        qk_ek_result = results['qk_ek'].strip()
+        logger.debug("quantitykind/enumerationkind: %s", qk_ek_result)
+        
+        # Check if result is in quantitykind or enumerationkind list
+        qk_value, is_quantitykind, qk_confidence, qk_repaired = vocabulary_index(qk_df, 'quantitykinds').validate(qk_ek_result)
+        ek_value, is_enumerationkind, ek_confidence, ek_repaired = vocabulary_index(ek_df, 's223_class').validate(qk_ek_result)
+        if is_quantitykind and is_enumerationkind:
+            # prefer an exact match, then the closer repair
+            if qk_repaired and (not ek_repaired or ek_confidence > qk_confidence):
+                is_quantitykind = False
+            else:
+                is_enumerationkind = False
+        if not repair:
+            is_quantitykind = is_quantitykind and not qk_repaired
+            is_enumerationkind = is_enumerationkind and not ek_repaired
+        
+        if is_quantitykind:
+            updated_definition_data['quantitykind'] = qk_value
+            updated_definition_data['quantitykind_valid'] = True
+            if qk_repaired:
+                _record_repair(updated_definition_data, 'quantitykind', qk_ek_result, qk_value, qk_confidence)
+        elif is_enumerationkind:
+            updated_definition_data['enumerationkind'] = ek_value
+            updated_definition_data['enumerationkind_valid'] = True
+            if ek_repaired:
+                _record_repair(updated_definition_data, 'enumerationkind', qk_ek_result, ek_value, ek_confidence)
+        else:
+            logger.warning("%s not found in quantitykind or enumerationkind lists", qk_ek_result)
+            updated_definition_data['quantitykind_valid'] = False
+            updated_definition_data['enumerationkind_valid'] = False
+            updated_definition_data['quantitykind'] = qk_ek_result
+    
+    if 'medium' in results:
+        medium_result = results['medium'].strip()
+        logger.debug("medium: %s", medium_result)
+        
+        # Validate medium result
+        if medium_result.lower() == "none":
+            medium_value, is_valid_medium, medium_confidence, medium_repaired = medium_result, True, None, False
+            logger.debug("No medium specified")
+        else:
+            medium_value, is_valid_medium, medium_confidence, medium_repaired = vocabulary_index(media_df, 's223_class').validate(medium_result)
+            if medium_repaired and not repair:
+                medium_repaired, is_valid_medium = False, False
+            logger.debug("Is valid medium: %s", is_valid_medium)
+        
+        updated_definition_data['medium'] = medium_value if medium_repaired else medium_result
+        updated_definition_data['medium_valid'] = is_valid_medium
+        if medium_repaired:
+            _record_repair(updated_definition_data, 'medium', medium_result, medium_value, medium_confidence)
+    
+    if 'aspects' in results:
+        aspects_result = results['aspects'].strip()
+        logger.debug("aspects: %s", aspects_result)
+        
+        # Validate all aspects in one batch
+        aspects = aspects_result.split(",")
+        checked = vocabulary_index(asp_df, 's223_class').validate_many(aspects)
         is_valid_aspects = True
-        for aspect in aspects_result.split(","):
-            print(f"Validating aspect: {aspect}")
-            is_valid_aspect = validate_result(aspect, asp_df)
+        values = []
+        confidences = []
+        for aspect, (value, is_valid_aspect, confidence, repaired) in zip(aspects, checked):
+            if repaired and not repair:
+                value, is_valid_aspect = aspect.strip(), False
+            elif repaired:
+                confidences.append(confidence)
             if is_valid_aspect == False:
-                print(f"Warning: {aspect} not found in aspect list")
-            else:
-                print(f"Is valid aspect: {is_valid_aspects}")
+                logger.warning("%s not found in aspect list", aspect)
+            values.append(value)
             is_valid_aspects = is_valid_aspects and is_valid_aspect
+        logger.debug("Is valid aspects: %s", is_valid_aspects)
         
-        updated_definition_data['aspects'] = aspects_result
+        updated_definition_data['aspects'] = ", ".join(values) if confidences else aspects_result
         updated_definition_data['aspects_valid'] = is_valid_aspects
-        
-        # Add the updated definition to the dictionary
-        updated_brick_dict[brick_class] = updated_definition_data
+        if confidences:
+            _record_repair(updated_definition_data, 'aspects', aspects_result, ", ".join(values), min(confidences))
+    return updated_definition_data
+
+def write_brick_template(template_file, new_dir, updated_brick_dict):
+    # Write the updated dictionary to the same relative path under new_dir
+    output_path = os.path.join(new_dir, template_file)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # written atomically, so an interrupted run never leaves a partial YAML
+    with stage('yaml_write'):
+        yaml_io.dump(output_path, updated_brick_dict)
+    count('files_written')
+    
+    logger.debug("Updated %s with s223 mappings", template_file)
+
+def process_brick_template(template_file, new_dir, s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds, prop_df, media_df, asp_df, ek_df, qk_df, engine=None, retriever=None, preclassifier=None, journal=None):
+    """
+    Process a Brick template file, running prompts on each brick class and definition
+    and updating the YAML file with the results.
     
-    # Write the updated dictionary back to the YAML file
-    with open(os.path.join(new_dir, template_file), "w") as f:
-        yaml.dump(updated_brick_dict, f, default_flow_style=False, sort_keys=False)
+    Args:
+        template_file (str): Path to the template YAML file
+        engine (CompletionEngine): Optional engine used to run the prompts concurrently.
+            If None, the prompts run one after another through get_completion.
+        retriever (CandidateRetriever): Optional retriever narrowing the vocabularies in each prompt
+        preclassifier (PreClassifier): Optional rule engine deciding fields without the LLM
+        journal (CompletionJournal): Optional checkpoint journal, see process_brick_templates
+    """
+    process_brick_templates([template_file], new_dir, s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds, prop_df, media_df, asp_df, ek_df, qk_df, engine=engine, retriever=retriever, preclassifier=preclassifier, journal=journal)
+
+def process_brick_templates(template_files, new_dir, s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds, prop_df, media_df, asp_df, ek_df, qk_df, engine=None, retriever=None, preclassifier=None, journal=None):
+    """
+    Process several Brick template files. With an engine, every prompt of every class
+    in every file is scheduled up front and runs concurrently; results are applied and
+    written in file and class order, so the output is the same as a sequential run.
     
-    print(f"Updated {template_file} with s223 mappings")
+    Args:
+        template_files (list): Paths to the template YAML files
+        engine (CompletionEngine): Optional engine; if None prompts run sequentially
+        retriever (CandidateRetriever): Optional retriever narrowing the vocabularies in each prompt
+        preclassifier (PreClassifier): Optional rule engine; fields it decides are not sent to the LLM
+            and are marked with their source
+        journal (CompletionJournal): Optional checkpoint journal. Every completed field is recorded
+            as soon as it returns and every written file is marked done; with a resumed journal,
+            done files whose YAML exists are skipped and journaled fields (of done files too) are not
+            prompted again.
+    """
+    system_prompt = """"""
+
+    def recorder(template_file, brick_class, field):
+        def record(future):
+            if not future.cancelled() and future.exception() is None:
+                journal.record(template_file, brick_class, field, future.result())
+        return record
+
+    def schedule(template_file):
+        # load a file and start its prompts; with an engine they run in the background
+        if journal is not None and journal.is_done(template_file) and os.path.exists(os.path.join(new_dir, template_file)):
+            logger.info("Skipping %s, already completed", template_file)
+            return None
+        jobs = []
+        for brick_class, updated_definition_data, text_definition in load_brick_template(template_file):
+            if retriever is not None:
+                vocab = retriever.vocabularies([(brick_class, text_definition)])
+            else:
+                vocab = (s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds)
+            prompts = build_prompts(brick_class, text_definition, *vocab)
+            decided = preclassifier.classify(brick_class) if preclassifier is not None else {}
+            journaled = journal.results(template_file, brick_class) if journal is not None else {}
+            prompts = {field: prompt for field, prompt in prompts.items() if field not in decided and field not in journaled}
+            if engine is not None:
+                prompts = {field: engine.submit(prompt, system_prompt) for field, prompt in prompts.items()}
+                if journal is not None:
+                    for field, future in prompts.items():
+                        future.add_done_callback(recorder(template_file, brick_class, field))
+            jobs.append((brick_class, updated_definition_data, decided, journaled, prompts))
+        return jobs
+
+    def collect(template_file, brick_class, decided, journaled, pending):
+        results = dict(journaled)
+        if engine is not None:
+            results.update({field: future.result() for field, future in pending.items()})
+        else:
+            for field, prompt in pending.items():
+                results[field] = get_completion(prompt, system_prompt)
+                if journal is not None:
+                    journal.record(template_file, brick_class, field, results[field])
+        results.update(decided)
+        # keep the field order of a fully prompted entry
+        return {field: results[field] for field in FIELDS if field in results}
+
+    if engine is not None:
+        # schedule every prompt of every file before waiting on any of them
+        scheduled = [(template_file, schedule(template_file)) for template_file in template_files]
+    else:
+        scheduled = ((template_file, schedule(template_file)) for template_file in template_files)
+
+    for template_file, jobs in scheduled:
+        if jobs is None:
+            continue
+        logger.info("Processing template file: %s", template_file)
+        updated_brick_dict = {}
+        for brick_class, updated_definition_data, decided, journaled, pending in jobs:
+            logger.debug("Processing brick_class: %s", brick_class)
+            apply_results(updated_definition_data, collect(template_file, brick_class, decided, journaled, pending), prop_df, media_df, asp_df, ek_df, qk_df)
+            mark_sources(updated_definition_data, decided)
+            # Add the updated definition to the dictionary
+            updated_brick_dict[brick_class] = updated_definition_data
+        write_brick_template(template_file, new_dir, updated_brick_dict)
+        if journal is not None:
+            journal.mark_done(template_file)
@@ -0,0 +1,232 @@
+"""
+Batched autocomplete: one structured (JSON) completion per YAML file, or per
+chunk of classes, instead of four prompts per class.
+
+Entries that are missing or malformed in a response are split into smaller
+chunks and retried; a class that still fails on its own falls back to the
+four per-field prompts of ai_complete_yaml.
+"""
+
+import json
+import logging
+import re
+
+from .ai_complete_yaml import (
+    FIELDS, load_brick_template, build_prompts, apply_results, write_brick_template
+)
+from .get_completion import get_completion
+from .preclassify import mark_sources
+
+logger = logging.getLogger(__name__)
+
+# JSON field names in the response, mapped to the result keys used by apply_results
+RESPONSE_FIELDS = {
+    's223_class': 's223_class',
+    'quantitykind_or_enumerationkind': 'qk_ek',
+    'medium': 'medium',
+    'aspects': 'aspects',
+}
+
+# per result key: what to ask for, and the vocabularies the answer is chosen from
+FIELD_INSTRUCTIONS = {
+    's223_class': "- s223_class: one of the possible s223 classes",
+    'qk_ek': "- quantitykind_or_enumerationkind: one of the possible quantitykinds or enumerationkinds",
+    'medium': "- medium: one of the possible media, or None if there is no sensible medium",
+    'aspects': "- aspects: a comma separated list of the possible aspects, or None if there are no directly applicable aspects",
+}
+FIELD_VOCABULARIES = {
+    's223_class': ("the possible s223 classes are <s223_properties>{s223_properties}</s223_properties>",),
+    'qk_ek': ("the possible quantitykinds are <quantitykinds>{quantitykinds}</quantitykinds>",
+              "the possible enumerationkinds are <s223_eks>{s223_eks}</s223_eks>"),
+    'medium': ("the possible media are <media>{s223_media}</media>",),
+    'aspects': ("the possible aspects are <aspects>{s223_aspects}</aspects>",),
+}
+RESPONSE_KEYS = {key: field for field, key in RESPONSE_FIELDS.items()}
+
+def build_batch_prompt(classes, s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds, decided=None):
+    """
+    Build one prompt asking for the fields of every class as JSON.
+
+    Args:
+        classes (list): (brick_class, text_definition) pairs
+        decided (dict): brick_class -> result keys already decided (e.g. by the
+            PreClassifier); those fields are not asked for. Without decided fields
+            every class is asked for all four.
+    """
+    decided = decided or {}
+    wanted = {brick_class: [key for key in FIELDS if key not in decided.get(brick_class, ())] for brick_class, _ in classes}
+    asked = [key for key in FIELDS if any(key in keys for keys in wanted.values())]
+    partial = any(len(keys) < len(FIELDS) for keys in wanted.values())
+    lines = []
+    for brick_class, text_definition in classes:
+        lines.append(f"- brick_class: {brick_class}\n  definition: {text_definition}")
+        if partial:
+            lines.append(f"  fields: {', '.join(RESPONSE_KEYS[key] for key in wanted[brick_class])}")
+    class_lines = "\n".join(lines)
+    vocabularies = dict(s223_properties=s223_properties, s223_media=s223_media, s223_aspects=s223_aspects,
+                        s223_eks=s223_eks, quantitykinds=quantitykinds)
+    instructions = "\n        ".join(FIELD_INSTRUCTIONS[key] for key in asked)
+    vocabulary_lines = "\n        ".join(line.format(**vocabularies) for key in asked for line in FIELD_VOCABULARIES[key])
+    if partial:
+        keys_text = "keys listed under its fields"
+    else:
+        keys_text = "keys " + ", ".join(f'"{RESPONSE_KEYS[key]}"' for key in FIELDS[:-1]) + f' and "{RESPONSE_KEYS[FIELDS[-1]]}"'
+    return f"""
+        For each brick_class below, determine, based on its name and definition:
+        {instructions}
+
+        {vocabulary_lines}
+
+        Return only a JSON object keyed by brick_class, where each value is an object with the
+        {keys_text}.
+        Do not return any other information.
+
+        <classes>
+{class_lines}
+        </classes>
+        """
+
+def _extract_json(text):
+    # models like to wrap JSON in code fences or add a sentence around it
+    text = re.sub(r"^```(?:json)?|```$", "", text.strip(), flags=re.MULTILINE).strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        raise ValueError("No JSON object in response")
+    return json.loads(text[start:end + 1])
+
+def _as_text(value):
+    if value is None:
+        return "None"
+    if isinstance(value, list):
+        return ", ".join(str(v) for v in value) if value else "None"
+    if isinstance(value, str):
+        return value
+    raise ValueError(f"Unexpected value {value!r}")
+
+def parse_batch_response(text, brick_classes, decided=None):
+    """
+    Parse a batched response into per-class results keyed like FIELDS.
+
+    Args:
+        decided (dict): brick_class -> result keys that were not asked for; they
+            are neither required nor taken from the response
+
+    Returns:
+        dict: brick_class -> results, only for classes whose entry is complete
+    """
+    decided = decided or {}
+    try:
+        data = _extract_json(text)
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    parsed = {}
+    for brick_class in brick_classes:
+        entry = data.get(brick_class)
+        if not isinstance(entry, dict):
+            continue
+        try:
+            parsed[brick_class] = {key: _as_text(entry[field]) for field, key in RESPONSE_FIELDS.items()
+                                   if key not in decided.get(brick_class, ())}
+        except (KeyError, ValueError):
+            continue
+    return parsed
+
+def _chunks(items, size):
+    if not size:
+        return [items] if items else []
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def process_brick_templates_batched(template_files, new_dir, s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds, prop_df, media_df, asp_df, ek_df, qk_df, engine=None, chunk_size=None, retriever=None, preclassifier=None):
+    """
+    Process Brick template files with one JSON completion per file or per chunk of classes.
+
+    Args:
+        template_files (list): Paths to the template YAML files
+        engine (CompletionEngine): Optional engine to run the requests of a round concurrently
+        chunk_size (int): Maximum number of classes per request; None sends each file in one request
+        retriever (CandidateRetriever): Optional retriever narrowing the vocabularies of each request
+        preclassifier (PreClassifier): Optional rule engine; the fields it decides are not asked
+            for, and classes it fully decides are not sent at all
+    """
+    system_prompt = """"""
+    full_vocab = (s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds)
+
+    def vocab(classes):
+        if retriever is None:
+            return full_vocab
+        return retriever.vocabularies(classes)
+    files = [(template_file, load_brick_template(template_file)) for template_file in template_files]
+    definitions = {}
+    decided = {}
+    resolved = {}
+    pending = []
+    for file_index, (template_file, entries) in enumerate(files):
+        keys = []
+        for brick_class, _, text_definition in entries:
+            key = (file_index, brick_class)
+            definitions[key] = text_definition
+            decided[key] = preclassifier.classify(brick_class) if preclassifier is not None else {}
+            if len(decided[key]) == len(RESPONSE_FIELDS):
+                resolved[key] = {}
+            else:
+                keys.append(key)
+        pending.extend(_chunks(keys, chunk_size))
+
+    def run_all(prompts):
+        if engine is not None:
+            return engine.map(prompts, system_prompt)
+        return [get_completion(prompt, system_prompt) for prompt in prompts]
+
+    fallback = []
+    requests = 0
+    while pending:
+        prompts = []
+        for chunk in pending:
+            classes = [(key[1], definitions[key]) for key in chunk]
+            prompts.append(build_batch_prompt(classes, *vocab(classes), decided={key[1]: decided[key] for key in chunk}))
+        responses = run_all(prompts)
+        requests += len(prompts)
+        retry = []
+        for chunk, response in zip(pending, responses):
+            parsed = parse_batch_response(response, [key[1] for key in chunk], {key[1]: decided[key] for key in chunk})
+            failed = []
+            for key in chunk:
+                if key[1] in parsed:
+                    resolved[key] = parsed[key[1]]
+                else:
+                    failed.append(key)
+            if not failed:
+                continue
+            if len(chunk) == 1:
+                fallback.extend(failed)
+            else:
+                # split the failures so one bad entry does not sink the others again
+                retry.extend(_chunks(failed, max(1, (len(failed) + 1) // 2)))
+        pending = retry
+
+    if fallback:
+        logger.info("Falling back to per-field prompts for %d classes", len(fallback))
+        prompts = {key: build_prompts(key[1], definitions[key], *vocab([(key[1], definitions[key])])) for key in fallback}
+        prompts = {key: {field: prompt for field, prompt in field_prompts.items() if field not in decided[key]} for key, field_prompts in prompts.items()}
+        flat = [(key, field, prompt) for key, field_prompts in prompts.items() for field, prompt in field_prompts.items()]
+        responses = run_all([prompt for _, _, prompt in flat])
+        requests += len(flat)
+        for (key, field, _), response in zip(flat, responses):
+            resolved.setdefault(key, {})[field] = response
+
+    for file_index, (template_file, entries) in enumerate(files):
+        logger.info("Processing template file: %s", template_file)
+        updated_brick_dict = {}
+        for brick_class, updated_definition_data, _ in entries:
+            logger.debug("Processing brick_class: %s", brick_class)
+            key = (file_index, brick_class)
+            results = dict(resolved[key])
+            results.update(decided[key])
+            apply_results(updated_definition_data, {field: results[field] for field in FIELDS if field in results}, prop_df, media_df, asp_df, ek_df, qk_df)
+            mark_sources(updated_definition_data, decided[key])
+            updated_brick_dict[brick_class] = updated_definition_data
+        write_brick_template(template_file, new_dir, updated_brick_dict)
+    logger.info("Completed %d classes with %d requests", len(definitions), requests)
+    return requests
@@ -0,0 +1,140 @@
+"""
+Local retrieval stage that narrows the s223 vocabularies embedded in the
+autocomplete prompts to the candidates most relevant to a Brick class.
+
+Each vocabulary (properties, media, aspects, enumerationkinds, quantitykinds)
+gets a small TF-IDF index over its names and definitions. For a Brick class
+name and definition only the top-k rows per vocabulary are kept; when the best
+match scores below a threshold the full vocabulary is used instead.
+"""
+
+import math
+import re
+from collections import Counter
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "which", "with", "s223", "sensor",
+    "measures", "measure", "enumerationkind", "none",
+}
+
+
+def tokenize(text):
+    """Lowercase word tokens, splitting CamelCase, snake_case, hyphens and prefixes."""
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", str(text))
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOPWORDS]
+
+
+def estimate_tokens(text):
+    # rough heuristic of ~4 characters per token, good enough for relative savings
+    return len(text) // 4
+
+
+class TfidfIndex:
+    """Minimal TF-IDF index with cosine scoring over a list of documents."""
+
+    def __init__(self, documents):
+        tokenized = [tokenize(document) for document in documents]
+        document_frequency = Counter(token for tokens in tokenized for token in set(tokens))
+        count = len(documents)
+        self.idf = {token: math.log((1 + count) / (1 + df)) + 1 for token, df in document_frequency.items()}
+        self.vectors = [self._vector(tokens) for tokens in tokenized]
+
+    def _vector(self, tokens):
+        counts = Counter(tokens)
+        vector = {token: tf * self.idf.get(token, 0.0) for token, tf in counts.items()}
+        norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+        return {token: value / norm for token, value in vector.items()}
+
+    def scores(self, query):
+        query_vector = self._vector(tokenize(query))
+        return [
+            sum(weight * vector.get(token, 0.0) for token, weight in query_vector.items())
+            for vector in self.vectors
+        ]
+
+
+class CandidateRetriever:
+    """
+    Args:
+        prop_df, media_df, asp_df, ek_df, qk_df (DataFrame): Vocabularies from get_s223_info
+        top_k (int): Candidates kept per vocabulary and class
+        min_score (float): Below this best score the full vocabulary is used
+    """
+
+    def __init__(self, prop_df, media_df, asp_df, ek_df, qk_df, top_k=8, min_score=0.1):
+        self.top_k = top_k
+        self.min_score = min_score
+        # order matches the vocabulary arguments of build_prompts
+        self.frames = {
+            's223_properties': prop_df,
+            's223_media': media_df,
+            's223_aspects': asp_df,
+            's223_eks': ek_df,
+            'quantitykinds': qk_df,
+        }
+        self.indexes = {
+            name: TfidfIndex([" ".join(str(value) for value in row) for row in df.itertuples(index=False)])
+            for name, df in self.frames.items()
+        }
+        self.full_csv = {name: df.to_csv(index=False) for name, df in self.frames.items()}
+        self.full_tokens = 0
+        self.filtered_tokens = 0
+        self.fallbacks = Counter()
+        self.lookups = 0
+
+    def select(self, brick_class, text_definition):
+        """
+        Row positions of the candidates per vocabulary, or None where the full list is used.
+        """
+        query = f"{brick_class} {text_definition}"
+        selected = {}
+        for name, index in self.indexes.items():
+            scores = index.scores(query)
+            if not scores or max(scores) < self.min_score:
+                selected[name] = None
+                continue
+            ranked = sorted(range(len(scores)), key=lambda i: (-scores[i], i))
+            selected[name] = set(ranked[:self.top_k])
+        return selected
+
+    def vocabularies(self, classes):
+        """
+        Filtered vocabulary CSV strings for one or more classes, in build_prompts order
+        (s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds).
+
+        Args:
+            classes (list): (brick_class, text_definition) pairs; candidates are unioned
+        """
+        union = {name: set() for name in self.frames}
+        for brick_class, text_definition in classes:
+            for name, rows in self.select(brick_class, text_definition).items():
+                if union[name] is None:
+                    continue
+                if rows is None:
+                    union[name] = None
+                    self.fallbacks[name] += 1
+                else:
+                    union[name] |= rows
+        self.lookups += 1
+        result = []
+        for name, df in self.frames.items():
+            if union[name] is None:
+                csv = self.full_csv[name]
+            else:
+                csv = df.iloc[sorted(union[name])].to_csv(index=False)
+            self.full_tokens += estimate_tokens(self.full_csv[name])
+            self.filtered_tokens += estimate_tokens(csv)
+            result.append(csv)
+        return tuple(result)
+
+    def report(self):
+        saved = self.full_tokens - self.filtered_tokens
+        return {
+            'lookups': self.lookups,
+            'vocabulary_tokens_full': self.full_tokens,
+            'vocabulary_tokens_filtered': self.filtered_tokens,
+            'vocabulary_tokens_saved': saved,
+            'saved_ratio': saved / self.full_tokens if self.full_tokens else 0.0,
+            'fallbacks': dict(self.fallbacks),
+        }
@@ -0,0 +1,183 @@
+"""
+Persistent, content-addressed cache for chat completions.
+
+Entries are keyed on the sha256 of (model, messages, temperature) and stored
+as one JSON file each under the cache directory. The cache supports age and
+size based eviction, keeps hit/miss counters, and has a read-only replay mode
+that raises CacheMiss instead of calling the API, for reproducible offline runs.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "TEMPLATE_BUILDER_COMPLETION_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "brick_223_templates", "completions"),
+)
+
+
+class CacheMiss(KeyError):
+    """Raised in replay mode when a completion is not in the cache."""
+
+
+def completion_key(model, messages, temperature):
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    Args:
+        directory (str): Where entries are stored
+        max_entries (int): Evict least recently used entries beyond this count
+        max_bytes (int): Evict least recently used entries beyond this total size
+        max_age (float): Entries older than this many seconds are treated as misses and evicted
+        replay (bool): Read-only mode; misses raise CacheMiss and nothing is written
+    """
+
+    def __init__(self, directory=None, max_entries=None, max_bytes=None, max_age=None, replay=False):
+        self.directory = directory or DEFAULT_CACHE_DIR
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._entries, self._bytes = self._scan()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _scan(self):
+        entries = 0
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith(".json"):
+                    entries += 1
+                    total += os.path.getsize(os.path.join(root, file))
+        return entries, total
+
+    def _expired(self, path):
+        return self.max_age is not None and time.time() - os.path.getmtime(path) > self.max_age
+
+    def get(self, model, messages, temperature):
+        """Return the cached completion text, or None on a miss (CacheMiss in replay mode)."""
+        key = completion_key(model, messages, temperature)
+        path = self._path(key)
+        content = None
+        try:
+            if not self._expired(path):
+                with open(path, "r") as f:
+                    content = json.load(f)["content"]
+                if not self.replay:
+                    # mtime doubles as the last-used time for LRU eviction
+                    os.utime(path)
+            elif not self.replay:
+                self._remove_expired(path)
+        except (OSError, ValueError, KeyError):
+            content = None
+        with self._lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if content is None and self.replay:
+            raise CacheMiss(f"No cached completion for key {key} (replay mode)")
+        return content
+
+    def _remove_expired(self, path):
+        size = os.path.getsize(path)
+        os.remove(path)
+        with self._lock:
+            self._entries -= 1
+            self._bytes -= size
+            self.evictions += 1
+
+    def put(self, model, messages, temperature, content):
+        if self.replay:
+            return
+        key = completion_key(model, messages, temperature)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        existed = os.path.exists(path)
+        old_size = os.path.getsize(path) if existed else 0
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "model": model,
+                "messages": messages,
+                "temperature": temperature,
+                "content": content,
+                "created": time.time(),
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.writes += 1
+            self._entries += 0 if existed else 1
+            self._bytes += os.path.getsize(path) - old_size
+            over = (self.max_entries is not None and self._entries > self.max_entries) or \
+                (self.max_bytes is not None and self._bytes > self.max_bytes)
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Remove expired entries, then least recently used ones until within the limits."""
+        with self._lock:
+            files = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith(".json"):
+                        path = os.path.join(root, name)
+                        stat = os.stat(path)
+                        files.append((stat.st_mtime, stat.st_size, path))
+            files.sort()
+            entries = len(files)
+            total = sum(size for _, size, _ in files)
+            now = time.time()
+            for mtime, size, path in files:
+                expired = self.max_age is not None and now - mtime > self.max_age
+                over = (self.max_entries is not None and entries > self.max_entries) or \
+                    (self.max_bytes is not None and total > self.max_bytes)
+                if not (expired or over):
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                entries -= 1
+                total -= size
+                self.evictions += 1
+            self._entries, self._bytes = entries, total
+
+    def clear(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".json"):
+                    os.remove(os.path.join(root, name))
+        with self._lock:
+            self._entries, self._bytes = 0, 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "entries": self._entries,
+                "bytes": self._bytes,
+            }
@@ -0,0 +1,150 @@
+"""
+Concurrent completion engine for the autocomplete stage.
+
+Runs many chat completions on a thread pool with a concurrency limit,
+token-bucket rate limiting, retries with jittered exponential backoff on
+429/5xx/connection errors and a per-request timeout. Results are always
+returned in submission order so the generated YAML stays deterministic.
+"""
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from .completion_cache import CacheMiss
+from .get_completion import cached_completion, get_completion
+from .instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` requests per second on average,
+    with bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_retryable(exc):
+    """True for rate limits (429), server errors (5xx), timeouts and dropped connections."""
+    if isinstance(exc, CacheMiss):
+        return False
+    if isinstance(exc, (openai.APIConnectionError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def _retry_after(exc):
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CompletionEngine:
+    """
+    Thread-pool based completion engine.
+
+    Args:
+        complete (callable): Function called as complete(prompt, system_prompt, timeout=...).
+            Defaults to get_completion with the client's own retries disabled.
+        max_workers (int): Maximum number of requests in flight
+        requests_per_second (float): Token-bucket rate limit, None for no limit
+        burst (int): Token-bucket capacity, defaults to requests_per_second
+        max_retries (int): Retries per request on retryable errors
+        timeout (float): Per-request timeout in seconds
+        backoff_base (float): Base delay of the exponential backoff in seconds
+        backoff_max (float): Upper bound of a single backoff delay in seconds
+    """
+
+    def __init__(self, complete=None, max_workers=8, requests_per_second=None, burst=None,
+                 max_retries=5, timeout=120.0, backoff_base=1.0, backoff_max=60.0):
+        self._complete = complete or self._default_complete
+        # only the default completer goes through the completion cache
+        self._uses_cache = complete is None
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(requests_per_second, burst) if requests_per_second else None
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="completion")
+
+    @staticmethod
+    def _default_complete(prompt, system_prompt=None, timeout=None):
+        # complete() has already looked the prompt up in the completion cache
+        return get_completion(prompt, system_prompt, timeout=timeout, max_retries=0, lookup=False)
+
+    def _backoff(self, attempt, exc):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def complete(self, prompt, system_prompt=None):
+        """Run one completion in the calling thread with rate limiting and retries."""
+        if self._uses_cache:
+            # cache hits do not wait for a rate-limit token
+            cached = cached_completion(prompt, system_prompt)
+            if cached is not None:
+                return cached
+        attempt = 0
+        while True:
+            if self.bucket is not None:
+                self.bucket.acquire()
+            try:
+                return self._complete(prompt, system_prompt, timeout=self.timeout)
+            except Exception as exc:
+                if attempt >= self.max_retries or not is_retryable(exc):
+                    raise
+                delay = self._backoff(attempt, exc)
+                logger.warning("Retrying completion after %s (attempt %d, waiting %.1fs)", type(exc).__name__, attempt + 1, delay)
+                count('llm_retries')
+                time.sleep(delay)
+                attempt += 1
+
+    def submit(self, prompt, system_prompt=None):
+        """Schedule a completion and return a Future for its text."""
+        return self._executor.submit(self.complete, prompt, system_prompt)
+
+    def map(self, prompts, system_prompt=None):
+        """Run all prompts concurrently and return their results in input order."""
+        futures = [self.submit(prompt, system_prompt) for prompt in prompts]
+        return [future.result() for future in futures]
+
+    def close(self, cancel=False):
+        # cancel=True drops queued requests, e.g. after Ctrl-C; running ones still finish
+        self._executor.shutdown(wait=True, cancel_futures=cancel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close(cancel=exc_info[0] is not None)
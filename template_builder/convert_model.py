@@ -0,0 +1,240 @@
+"""
+Bulk conversion of Brick building models to 223P using the generated templates.
+
+The s223_templates/ library is loaded once through a TemplateRegistry. Every
+entity of the model is mapped to the template of its most specific Brick class
+that has one, falling back to the nearest ancestor, and the template is
+instantiated with the entity as `P:name`. Output is produced in batches, with
+one addN call (or one block of N-Triples lines) per batch.
+
+Models in N-Triples can be converted without loading them into a graph: only the
+rdf:type triples and the relations that are carried over are kept while the file
+is streamed, and the output can be streamed to an N-Triples file the same way.
+"""
+
+import logging
+import os
+
+from rdflib import Graph, URIRef
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+
+from .instrumentation import stage, count
+from .namespaces import BRICK, HPF, PARAM, RDF, RDFS, S223, bind_prefixes
+from .template_registry import TemplateRegistry
+from .utils import UriAllocator, add_brick_inverse_relations, create_uri_name_from_uris
+
+logger = logging.getLogger(__name__)
+
+# Brick relations carried over to the 223P model, by their 223P counterpart
+RELATION_MAP = {
+    BRICK.hasPoint: S223.hasProperty,
+    BRICK.hasPart: S223.contains,
+}
+# relations read from the model; the inverses are turned around by add_brick_inverse_relations
+RELATION_INPUTS = (BRICK.hasPoint, BRICK.isPointOf, BRICK.hasPart, BRICK.isPartOf)
+
+# looked up once; namespace attribute access is slow in the per-triple path
+_TYPE = RDF.type
+_BRICK = str(BRICK)
+_RELATION_INPUTS = frozenset(RELATION_INPUTS)
+# lines mentioning none of these predicates are dropped before they are parsed
+_WANTED = [f"<{predicate}>".encode('utf-8') for predicate in (_TYPE,) + RELATION_INPUTS]
+
+
+class _ModelSink:
+    # keeps only the triples the conversion needs while an N-Triples file is parsed
+    def __init__(self):
+        self.types = {}
+        self.relations = []
+
+    def triple(self, s, p, o):
+        if p == _TYPE:
+            if isinstance(o, URIRef) and o.startswith(_BRICK):
+                self.types.setdefault(s, []).append(o)
+        elif p in _RELATION_INPUTS:
+            self.relations.append((s, p, o))
+
+
+def read_model(source):
+    """
+    Read the Brick types and the carried-over relations of a model.
+
+    Args:
+        source: rdflib.Graph, or the path of an N-Triples file (.nt), which is
+            streamed. Other formats are parsed into a graph first.
+
+    Returns:
+        tuple: ({entity: [Brick classes]}, Graph of relations)
+    """
+    sink = _ModelSink()
+    if isinstance(source, Graph):
+        for s, _, o in source.triples((None, _TYPE, None)):
+            sink.triple(s, _TYPE, o)
+        for predicate in RELATION_INPUTS:
+            sink.relations.extend(source.triples((None, predicate, None)))
+    elif os.path.splitext(source)[1] != '.nt':
+        graph = Graph()
+        graph.parse(source)
+        return read_model(graph)
+    else:
+        parser = W3CNTriplesParser(sink)
+        with open(source, 'rb') as f:
+            while True:
+                lines = f.readlines(1 << 20)
+                if not lines:
+                    break
+                parser.parsestring(b"".join(line for line in lines if any(w in line for w in _WANTED)))
+    relations = Graph()
+    relations.addN((s, p, o, relations) for s, p, o in sink.relations)
+    return sink.types, relations
+
+
+class _NTriplesWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w')
+
+    def addN(self, quads):
+        self.file.writelines(f"{s.n3()} {p.n3()} {o.n3()} .\n" for s, p, o, _ in quads)
+
+    def close(self):
+        self.file.close()
+
+
+class ModelConverter:
+    """
+    Converts Brick models to 223P with the templates of an s223_templates/ tree.
+
+    Args:
+        templates: Template directory or a TemplateRegistry
+        brick_graph (rdflib.Graph): Brick ontology, used to find ancestors of
+            classes that are not in the template tree
+        namespace: Namespace for nodes minted for template parameters other than name
+        batch_size (int): Entities instantiated per batch
+    """
+
+    def __init__(self, templates, brick_graph=None, namespace=HPF, batch_size=5000):
+        if isinstance(templates, TemplateRegistry):
+            self.registry = templates
+        else:
+            self.registry = TemplateRegistry(templates, graph=brick_graph)
+        self.namespace = namespace
+        self.batch_size = batch_size
+        self._resolved = {}
+        self._compiled = {}
+        # every entry is read now, each file once; bodies are parsed when first used
+        with stage('load_templates'):
+            self.registry.get_many(self.registry.classes())
+
+    def resolve(self, brick_class):
+        """
+        The template class of a Brick class and its distance (0 when the class has
+        its own template, n for its n-th nearest ancestor), or (None, None).
+        """
+        if brick_class not in self._resolved:
+            name = str(brick_class)[len(BRICK):] if str(brick_class).startswith(BRICK) else str(brick_class)
+            resolved = (None, None)
+            for distance, candidate in enumerate([name] + self.registry.ancestors(name)):
+                if candidate in self.registry:
+                    resolved = (candidate, distance)
+                    break
+            self._resolved[brick_class] = resolved
+        return self._resolved[brick_class]
+
+    def most_specific(self, brick_classes):
+        """The template class of an entity with several Brick types: the nearest match wins."""
+        matches = [self.resolve(brick_class) for brick_class in brick_classes]
+        matches = [(distance, name) for name, distance in matches if name is not None]
+        return min(matches)[1] if matches else None
+
+    def compiled(self, template_class):
+        """The triples of a template (dependencies merged) and the parameters other than name."""
+        if template_class not in self._compiled:
+            graph = self.registry.graph(template_class)
+            triples = list(graph) if graph is not None else []
+            parameters = sorted({term for triple in triples for term in triple
+                                 if isinstance(term, URIRef) and term.startswith(PARAM) and term != PARAM.name})
+            self._compiled[template_class] = (triples, parameters)
+        return self._compiled[template_class]
+
+    def _instantiate(self, entity, template_class, names, quads, output):
+        triples, parameters = self.compiled(template_class)
+        binding = {PARAM.name: entity}
+        for parameter in parameters:
+            # other parameters get their own node, named after the entity and the parameter
+            node = create_uri_name_from_uris(names.graph, self.namespace, [entity, parameter[len(PARAM):]],
+                                             allocator=names)
+            binding[parameter] = node
+            quads.append((node, RDFS.label, names.graph.value(node, RDFS.label), output))
+        quads.extend((binding.get(s, s), p, binding.get(o, o), output) for s, p, o in triples)
+
+    def convert(self, source, output=None):
+        """
+        Convert a Brick model.
+
+        Args:
+            source: rdflib.Graph, or the path of the model (N-Triples files are streamed)
+            output: Graph to add to, the path of an N-Triples file to write, or None
+                for a new graph
+
+        Returns:
+            tuple: (output Graph, or the output path, stats dict with the counts of
+                converted and unmapped entities, triples written and unmapped classes)
+        """
+        with stage('read_model'):
+            types, relations = read_model(source)
+            # models may state either direction of a relation; complete them on the small relation graph
+            add_brick_inverse_relations(relations)
+
+        writer = None
+        if output is None:
+            output = Graph()
+        if isinstance(output, Graph):
+            bind_prefixes(output)
+            # minted names are unique in the output; everything is added through the allocator's index
+            names = sink = UriAllocator(output)
+        else:
+            writer = sink = _NTriplesWriter(output)
+            # the written triples are not kept; minted names and labels only
+            names = UriAllocator(Graph())
+        # nor may they take the name of an entity of the model
+        names.exclude(types)
+        names.exclude(relations.all_nodes())
+
+        stats = {'entities': len(types), 'converted': 0, 'unmapped': 0, 'triples': 0, 'unmapped_classes': {}}
+        converted = set()
+        entities = list(types.items())
+        try:
+            with stage('instantiate'):
+                for start in range(0, len(entities), self.batch_size):
+                    quads = []
+                    for entity, brick_classes in entities[start:start + self.batch_size]:
+                        template_class = self.most_specific(brick_classes)
+                        if template_class is None:
+                            stats['unmapped'] += 1
+                            for brick_class in brick_classes:
+                                key = str(brick_class)[len(BRICK):]
+                                stats['unmapped_classes'][key] = stats['unmapped_classes'].get(key, 0) + 1
+                            continue
+                        self._instantiate(entity, template_class, names, quads, output if writer is None else None)
+                        converted.add(entity)
+                    sink.addN(quads)
+                    stats['triples'] += len(quads)
+                quads = [(s, RELATION_MAP[p], o, output if writer is None else None)
+                         for brick_relation in RELATION_MAP
+                         for s, p, o in relations.triples((None, brick_relation, None))
+                         if o in converted]
+                sink.addN(quads)
+                stats['triples'] += len(quads)
+        finally:
+            if writer is not None:
+                writer.close()
+        stats['converted'] = len(converted)
+        count('converted_entities', stats['converted'])
+        logger.info("Converted %d of %d entities into %d triples; %d unmapped",
+                    stats['converted'], stats['entities'], stats['triples'], stats['unmapped'])
+        return output, stats
+
+
+def convert_model(source, templates, output=None, brick_graph=None, batch_size=5000):
+    """Convert one Brick model, see ModelConverter.convert."""
+    return ModelConverter(templates, brick_graph=brick_graph, batch_size=batch_size).convert(source, output)
@@ -4,21 +4,69 @@ Script to generate S223 templates from Brick YAML files.
 """
 
 import os
+import json
+import hashlib
+import logging
 import yaml
 from pathlib import Path
 import rdflib
 from rdflib import Graph, Literal, URIRef
+from rdflib.compare import to_canonical_graph
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from .template_emitter import emit_template, verify_template
+from .instrumentation import stage, count
+from . import yaml_io
+from .yaml_io import FoldedString, folded_str_representer
 from .namespaces import (
     BRICK, S223, QUDT, PARAM, QK, UNIT, RDF, RDFS, XSD, OWL, SKOS, SH, 
     TAG, BSH, REF, BACNET, BM, CONSTRAINT, HPF, HPFS, bind_prefixes, get_prefixes
 )
 
-# TODO: correct namespace handling
-def create_template_for_entity(entity_name, entity_data):
+logger = logging.getLogger(__name__)
+
+# Bump when the generated output changes for the same input, so incremental
+# builds regenerate everything
+GENERATOR_VERSION = "2"
+
+# modules that shape the generated output; their source is part of the fingerprint
+# too, so a change to them rebuilds everything even if the version is not bumped
+GENERATOR_MODULES = ('create_223_templates.py', 'template_emitter.py', 'yaml_io.py')
+
+MANIFEST_NAME = ".template_manifest.json"
+
+def create_template_for_entity(entity_name, entity_data, verify=False):
     """
     Create an S223 template for a given entity based on its Brick YAML data.
     
+    Uses the direct Turtle emitter and falls back to the rdflib path for values it
+    cannot write as prefixed names.
+    
+    Args:
+        entity_name: The name of the entity (e.g., 'Temperature_Sensor')
+        entity_data: Dictionary containing the entity's properties from the YAML file
+        verify: Also build the template through rdflib and raise ValueError unless
+            both are isomorphic graphs
+    
+    Returns:
+        A string containing the template in Turtle format
+    """
+    try:
+        template = emit_template(entity_data)
+    except ValueError:
+        count('rdflib_fallbacks')
+        return create_template_for_entity_rdflib(entity_name, entity_data)
+    if verify:
+        reference = create_template_for_entity_rdflib(entity_name, entity_data)
+        if not verify_template(template, reference):
+            raise ValueError(f"Emitted template for {entity_name} differs from the rdflib template")
+    return template
+
+# TODO: correct namespace handling
+def create_template_for_entity_rdflib(entity_name, entity_data):
+    """
+    Create an S223 template for a given entity by building and serializing an rdflib graph.
+    
     Args:
         entity_name: The name of the entity (e.g., 'Temperature_Sensor')
         entity_data: Dictionary containing the entity's properties from the YAML file
@@ -65,72 +113,411 @@ def create_template_for_entity(entity_name, entity_data):
             aspect = aspect.strip()
             if aspect:
                 g.add((entity, S223.hasAspect, S223[aspect.split(':')[-1]]))
-    return g.serialize()
+    with stage('rdflib_serialize'):
+        return g.serialize()
 
-# Define a custom class for folded style text
-class FoldedString(str):
-    pass
+# the only keys of a Brick YAML entry that go into its template
+ENTITY_KEYS = ('s223_class', 'quantitykind', 'enumerationkind', 'medium', 'aspects')
 
-# Create a custom representer for the folded style
-def folded_str_representer(dumper, data):
-    return dumper.represent_scalar('tag:yaml.org,2002:str', data, style='>')
 
-# Register the representer
-yaml.add_representer(FoldedString, folded_str_representer)
+def render_entities(items, verify=False):
+    """
+    Render templates for (entity_name, entity_data) pairs.
+    
+    Errors are returned per entity instead of raised, so one bad entry does not
+    abort a whole run. Top-level so it can run in worker processes.
+    
+    Returns:
+        list: (entity_name, template or None, error message or None) in input order
+    """
+    rendered = []
+    with stage('render'):
+        for entity_name, entity_data in items:
+            try:
+                rendered.append((entity_name, create_template_for_entity(entity_name, entity_data, verify), None))
+            except Exception as e:
+                rendered.append((entity_name, None, f"{type(e).__name__}: {e}"))
+    return rendered
+
 
+def template_entries(yaml_path, rendered, errors):
+    """The (entity_name, entry) pairs of rendered templates, collecting failed entities in errors."""
+    for entity_name, template, error in rendered:
+        if error is not None:
+            logger.error("Error creating template for %s in %s: %s", entity_name, yaml_path, error)
+            errors.append({'file': yaml_path, 'entity': entity_name, 'error': error})
+            continue
+        # Create the YAML template file in the format requested
+        yield entity_name, {
+                'body': FoldedString(template),  # Use the custom class for folded style template
+            }
 
-def process_yaml_file(yaml_path, output_path):
+
+def write_templates(yaml_path, output_path, rendered, errors):
+    """Write rendered templates to output_path, collecting failed entities in errors."""
+    with stage('yaml_write'):
+        written = yaml_io.dump_entities(output_path, template_entries(yaml_path, rendered, errors))
+    count('files_written')
+    count('templates_written', written)
+
+
+def load_entities(yaml_path):
+    # only the keys the templates are built from are constructed
+    with stage('yaml_read'):
+        return list(yaml_io.iter_entities(yaml_path, ENTITY_KEYS))
+
+
+def yaml_files(input_dir):
+    """(path, path relative to input_dir) of every .yml file under input_dir, in sorted walk order."""
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith('.yml'):
+                yaml_path = os.path.join(root, file)
+                yield yaml_path, os.path.relpath(yaml_path, start=input_dir)
+
+
+def render_files(yaml_paths, workers=1, chunk_size=200, verify=False):
+    """
+    Render the templates of several Brick YAML files.
+    
+    With workers > 1 templates are rendered in a process pool, in chunks of at most
+    chunk_size entities so very large files are split across workers. Each file's
+    results are assembled in entity order, so they are identical to a serial run.
+    
+    Args:
+        yaml_paths: Brick YAML files to render
+        workers: Number of worker processes; None uses every core
+        chunk_size: Maximum entities per worker task
+        verify: Check every emitted template against the rdflib path
+    
+    Returns:
+        iterable: The render_entities result of every file, in input order. A serial
+            run renders each file as it is consumed.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or not yaml_paths:
+        return (render_entities(load_entities(yaml_path), verify) for yaml_path in yaml_paths)
+    loaded = [load_entities(yaml_path) for yaml_path in yaml_paths]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [[executor.submit(render_entities, items[i:i + chunk_size], verify) for i in range(0, len(items), chunk_size)]
+                   for items in loaded]
+        return [[entity for future in chunks for entity in future.result()] for chunks in futures]
+
+
+def process_yaml_file(yaml_path, output_path, errors=None, verify=False):
     """
     Process a YAML file and create templates for each entity in it.
     
     Args:
         yaml_path: Path to the YAML file
-        output_dir: Directory to write the templates to
+        output_path: Path of the template file to write
+        errors: Optional list collecting entities whose template could not be created
+        verify: Check every emitted template against the rdflib path
+    
+    Returns:
+        bool: False if the YAML file was empty and nothing was written
     """
-    with open(yaml_path, 'r') as f:
-        data = yaml.safe_load(f)
-    # print(data)
-    if not data:
-        return
+    items = load_entities(yaml_path)
+    if not items:
+        return False
     
     # Process each entity in the YAML file
-    template_dict = {}
-    for entity_name, entity_data in data.items():
-        # Generate the S223 template
-        template = create_template_for_entity(entity_name, entity_data)
-        # Create the YAML template file in the format requested
-        template_dict[entity_name] = {
-                'body': FoldedString(template),  # Use the custom class for folded style template
-            }
-    print(template_dict)
-    with open(output_path, 'w') as f:
-        yaml.dump(
-            template_dict,
-            f,
-            default_flow_style=False,
-            sort_keys=False
-)
-        
+    write_templates(yaml_path, output_path, render_entities(items, verify), errors if errors is not None else [])
+    return True
+
+
+def file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_fingerprint(dedup_min_shared=None):
+    """
+    Fingerprint of everything besides the input files that affects the output:
+    the generator version and source, the YAML backend, the bound namespaces and
+    the deduplication setting (min_shared of a deduplicated build, None without
+    deduplication).
+    """
+    source = hashlib.sha256()
+    for module in GENERATOR_MODULES:
+        source.update(Path(__file__).with_name(module).read_bytes())
+    g = Graph()
+    bind_prefixes(g)
+    namespaces = sorted((prefix, str(namespace)) for prefix, namespace in g.namespace_manager.namespaces())
+    payload = json.dumps({'generator_version': GENERATOR_VERSION, 'generator_source': source.hexdigest(),
+                          'libyaml': yaml_io.LIBYAML, 'namespaces': namespaces, 'dedup': dedup_min_shared},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {'fingerprint': None, 'files': {}}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def _remove_output(output_dir, rel_output):
+    output_path = os.path.join(output_dir, rel_output)
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    # prune directories left empty by the removal
+    parent = os.path.dirname(output_path)
+    while os.path.abspath(parent) != os.path.abspath(output_dir) and os.path.isdir(parent) and not os.listdir(parent):
+        os.rmdir(parent)
+        parent = os.path.dirname(parent)
+
+
+BASE_TEMPLATES_NAME = "base-templates.yml"
+BASE_PREFIX = "base-"
+
+
+def canonical_body_hash(body):
+    """
+    Hash of a template body that ignores prefix declarations, triple order and layout.
+    """
+    g = Graph()
+    with stage('parse_template'):
+        g.parse(data=body, format='turtle')
+    if any(isinstance(term, rdflib.BNode) for triple in g for term in triple):
+        g = to_canonical_graph(g)
+    lines = sorted(line for line in g.serialize(format='nt').splitlines() if line)
+    return hashlib.sha256("\n".join(lines).encode('utf-8')).hexdigest()
+
+
+def _body_parameters(body):
+    # the template parameters (P:... terms) a body uses
+    g = Graph()
+    g.parse(data=body, format='turtle')
+    return sorted({str(term)[len(str(PARAM)):] for triple in g for term in triple
+                   if isinstance(term, URIRef) and str(term).startswith(str(PARAM))})
 
 
-def process_directory(input_dir, output_dir):
+def _stub_body(base_body):
+    # the body of a template whose other triples come from its base template; it keeps
+    # the P:name type triples, so P:name stays a parameter before dependencies are inlined
+    g = Graph()
+    g.parse(data=base_body, format='turtle')
+    stub = Graph()
+    for prefix, namespace in g.namespaces():
+        stub.bind(prefix, namespace, override=False)
+    stub.bind('P', PARAM)
+    triples = sorted(g.triples((PARAM.name, RDF.type, None))) or sorted(g.triples((PARAM.name, None, None)))[:1]
+    if not triples:
+        return f"@prefix P: <{PARAM}> .\n"
+    for triple in triples:
+        stub.add(triple)
+    return stub.serialize(format='turtle')
+
+
+def deduplicate_directory(output_dir, min_shared=2):
+    """
+    Share identical template bodies through base templates.
+    
+    Bodies are compared after canonicalization (see canonical_body_hash). Every
+    body used by at least min_shared templates is written once, as
+    `base-<hash>` in base-templates.yml at the root of output_dir, and the
+    templates using it keep only a stub body (the P:name type triples) and a
+    dependency on it, the way reference-templates.yml composes templates. The
+    pass can be rerun on its own output: templates that already point to a base
+    are expanded first.
+    
+    Args:
+        output_dir: Template directory written by process_directory
+        min_shared: Minimum number of templates sharing a body for it to get a base
+    
+    Returns:
+        dict: Counts of templates, distinct and shared bodies, the output size
+            before and after in bytes, and their ratio
+    """
+    base_path = os.path.join(output_dir, BASE_TEMPLATES_NAME)
+    bases = {}
+    if os.path.exists(base_path):
+        with stage('yaml_read'):
+            bases = dict(yaml_io.iter_entities(base_path))
+
+    files = []
+    for root, dirs, names in os.walk(output_dir):
+        dirs.sort()
+        for file in sorted(names):
+            path = os.path.join(root, file)
+            if file.endswith('.yml') and path != base_path:
+                with stage('yaml_read'):
+                    entities = list(yaml_io.iter_entities(path))
+                expanded = []
+                for name, entry in entities:
+                    dependencies = entry.get('dependencies') or []
+                    if len(dependencies) == 1 and dependencies[0].get('template') in bases:
+                        entry = {'body': bases[dependencies[0]['template']]['body']}
+                    expanded.append((name, entry))
+                files.append((path, entities, expanded))
+
+    # identical text is parsed once; textually different bodies may still share a hash
+    hashes = {}
+    uses = {}
+    for _, _, expanded in files:
+        for _, entry in expanded:
+            body = entry.get('body')
+            if body is None or set(entry) != {'body'}:
+                continue
+            if body not in hashes:
+                hashes[body] = canonical_body_hash(body)
+            uses.setdefault(hashes[body], []).append(body)
+
+    new_bases = {}
+    stubs = {}
+    for digest, bodies in uses.items():
+        if len(bodies) >= min_shared:
+            new_bases[digest] = (f"{BASE_PREFIX}{digest[:12]}", bodies[0])
+            stubs[digest] = _stub_body(bodies[0])
+
+    bytes_before = 0
+    bytes_after = 0
+    templates = 0
+    for path, entities, expanded in files:
+        deduplicated = []
+        for name, entry in expanded:
+            templates += 1
+            body = entry.get('body')
+            digest = hashes.get(body) if set(entry) == {'body'} else None
+            if digest in new_bases:
+                base_name, base_body = new_bases[digest]
+                parameters = _body_parameters(base_body)
+                entry = {
+                    'body': FoldedString(stubs[digest]),
+                    'dependencies': [{'template': base_name, 'args': {p: p for p in parameters}}],
+                }
+            elif body is not None:
+                entry = dict(entry, body=FoldedString(body))
+            deduplicated.append((name, entry))
+        bytes_before += len(yaml_io.dumps({name: dict(entry, body=FoldedString(entry['body'])) if 'body' in entry else entry
+                                           for name, entry in expanded}))
+        if deduplicated != entities:
+            with stage('yaml_write'):
+                yaml_io.dump_entities(path, deduplicated)
+            count('files_written')
+        bytes_after += os.path.getsize(path)
+
+    if new_bases:
+        with stage('yaml_write'):
+            yaml_io.dump_entities(base_path, sorted(
+                (base_name, {'body': FoldedString(body)}) for base_name, body in new_bases.values()))
+        count('files_written')
+        bytes_after += os.path.getsize(base_path)
+    elif os.path.exists(base_path):
+        os.remove(base_path)
+
+    stats = {
+        'templates': templates,
+        'distinct_bodies': len(uses),
+        'shared_bodies': len(new_bases),
+        'bytes_before': bytes_before,
+        'bytes_after': bytes_after,
+        'compression_ratio': round(bytes_before / bytes_after, 3) if bytes_after else 1.0,
+    }
+    logger.info("Deduplicated %d templates: %d distinct bodies, %d shared; %d -> %d bytes (%.2fx)",
+                templates, stats['distinct_bodies'], stats['shared_bodies'], bytes_before, bytes_after,
+                stats['compression_ratio'])
+    return stats
+
+
+def process_directory(input_dir, output_dir, incremental=True, workers=1, chunk_size=200, verify=False, dedup=False,
+                      min_shared=2):
     """
     Recursively process all YAML files in a directory.
     
+    With incremental builds a manifest in output_dir records the content hash of
+    every input, the generator version, the namespace configuration and the
+    deduplication setting. Unchanged inputs are skipped and outputs whose input
+    disappeared are removed.
+    
+    With workers > 1 templates are rendered in a process pool (see render_files);
+    output is identical to a serial run.
+    
     Args:
-        dir_path: Path to the directory containing YAML files
+        input_dir: Path to the directory containing YAML files
         output_dir: Directory to write the templates to
+        incremental: Skip unchanged inputs; False rebuilds everything
+        workers: Number of worker processes; None uses every core
+        chunk_size: Maximum entities per worker task
+        verify: Check every emitted template against the rdflib path; mismatches are
+            reported as entity errors
+        dedup: Share identical bodies through base templates afterwards (see
+            deduplicate_directory)
+        min_shared: Minimum number of templates sharing a body for it to get a base
+    
+    Returns:
+        dict: Counts of rebuilt, skipped and removed files, the per-entity errors,
+            and the deduplication stats if dedup was set
     """
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            if file.endswith('.yml'):
-                yaml_path = os.path.join(root, file)
-                # Create the output directory structure
-                rel_path = os.path.relpath(yaml_path, start=os.path.join('brick_yaml_reviewed', 'brick_yaml'))
-                template_dir = os.path.join(output_dir, os.path.dirname(rel_path))
-                # print(template_dir)
-                os.makedirs(template_dir, exist_ok=True)
-                output_path = os.path.join(template_dir, file)
-                # print(output_path)
-                process_yaml_file(yaml_path, output_path)
+    os.makedirs(output_dir, exist_ok=True)
+    # switching dedup or min_shared changes the fingerprint, so every file is rebuilt
+    fingerprint = build_fingerprint(min_shared if dedup else None)
+    manifest = load_manifest(output_dir)
+    if not incremental or manifest.get('fingerprint') != fingerprint:
+        previous = manifest.get('files', {})
+        manifest = {'fingerprint': fingerprint, 'files': {}}
+    else:
+        previous = manifest['files']
+    counts = {'rebuilt': 0, 'skipped': 0, 'removed': 0}
+    errors = []
+    seen = set()
+    todo = []
+    for yaml_path, rel_path in yaml_files(input_dir):
+        seen.add(rel_path)
+        digest = file_sha256(yaml_path)
+        entry = previous.get(rel_path)
+        if entry and entry['sha256'] == digest and rel_path in manifest['files'] and not entry.get('failed') \
+                and (entry['output'] is None or os.path.exists(os.path.join(output_dir, entry['output']))):
+            counts['skipped'] += 1
+            continue
+        # Create the output directory structure
+        output_path = os.path.join(output_dir, rel_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        todo.append((yaml_path, rel_path, digest, output_path))
 
+    rendered_files = render_files([task[0] for task in todo], workers, chunk_size, verify)
+    for (yaml_path, rel_path, digest, output_path), rendered in zip(todo, rendered_files):
+        file_errors = []
+        if rendered:
+            write_templates(yaml_path, output_path, rendered, file_errors)
+        errors.extend(file_errors)
+        counts['rebuilt'] += 1
+        manifest['files'][rel_path] = {'sha256': digest, 'output': rel_path if rendered else None}
+        if file_errors:
+            # retried on the next build; the entry still lets the output be removed with its input
+            manifest['files'][rel_path]['failed'] = True
+    for rel_path, entry in list(previous.items()):
+        if rel_path not in seen:
+            if entry['output'] is not None:
+                _remove_output(output_dir, entry['output'])
+            manifest['files'].pop(rel_path, None)
+            counts['removed'] += 1
+    changed = counts['rebuilt'] or counts['removed']
+    if changed:
+        # the deduplication of the previous build no longer matches the output
+        manifest.pop('dedup', None)
+    save_manifest(output_dir, manifest)
+    logger.info("Templates: %d rebuilt, %d skipped, %d removed, %d errors", counts['rebuilt'], counts['skipped'], counts['removed'], len(errors))
+    counts['errors'] = errors
+    if dedup and not changed and 'dedup' in manifest:
+        # nothing changed since the last deduplicated build
+        counts['dedup'] = manifest['dedup']
+    elif dedup:
+        counts['dedup'] = manifest['dedup'] = deduplicate_directory(output_dir, min_shared)
+        save_manifest(output_dir, manifest)
+    elif os.path.exists(os.path.join(output_dir, BASE_TEMPLATES_NAME)):
+        # left by an earlier deduplicated build; nothing refers to it any more
+        os.remove(os.path.join(output_dir, BASE_TEMPLATES_NAME))
+    return counts
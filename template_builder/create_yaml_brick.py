@@ -9,6 +9,17 @@ import pandas as pd
 from string import Template
 import os
 import pathlib
+import shutil
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from rdflib import Literal
+import logging
+from template_builder.instrumentation import stage, count
+from template_builder import yaml_io
+
+logger = logging.getLogger(__name__)
+
 def strip_namespace(uri):
     """
     Strips namespace prefixes from URIs.
@@ -30,7 +41,7 @@ def strip_namespace(uri):
         return uri.split(':', 1)[1]
     return uri
 
-# Template for the SPARQL query
+# Template for the SPARQL query (ClassIndex.direct_subclasses answers the same question in Python)
 query_template = Template("""SELECT DISTINCT ?brick_class ?brick_definition ?brick_parent WHERE {
     ?brick_class rdfs:subClassOf $start_parent ;
         skos:definition ?brick_definition .
@@ -45,6 +56,85 @@ query_template = Template("""SELECT DISTINCT ?brick_class ?brick_definition ?bri
     BIND ($start_parent AS ?brick_parent).
 }""")
 
+SUBCLASS_COLUMNS = ["brick_class", "brick_definition", "brick_parent"]
+
+class ClassIndex:
+    """
+    In-memory index of the class hierarchy of an ontology, built in a single
+    pass over the rdfs:subClassOf, skos:definition and owl:deprecated triples.
+
+    `direct_subclasses_df` answers the same question as `query_template` (direct,
+    non-deprecated, defined subclasses of a parent) without running SPARQL.
+    """
+    EXCLUDED_PREFIX = "https://w3id.org/rec#"
+
+    def __init__(self, graph):
+        self.graph = graph
+        # insertion ordered, mirroring the order the store returns matches in
+        self.children = defaultdict(dict)
+        self.parents = defaultdict(set)
+        self.definitions = defaultdict(list)
+        self.deprecated = set()
+        self._names = {}
+
+        for s, _, o in graph.triples((None, RDFS.subClassOf, None)):
+            self.children[o][s] = None
+            self.parents[s].add(o)
+        for s, _, o in graph.triples((None, SKOS.definition, None)):
+            if o not in self.definitions[s]:
+                self.definitions[s].append(o)
+        true = Literal(True)
+        for s, _, o in graph.triples((None, OWL.deprecated, None)):
+            if o == true:
+                self.deprecated.add(s)
+
+    def resolve(self, class_name):
+        """Resolve a prefixed class name (e.g. 'brick:Sensor') to its URI."""
+        if class_name in self._names:
+            return self._names[class_name]
+        if isinstance(class_name, URIRef):
+            return class_name
+        return self.graph.namespace_manager.expand_curie(class_name)
+
+    def direct_subclasses(self, parent):
+        """
+        Direct subclasses of `parent`: classes asserted as rdfs:subClassOf parent
+        that are not also a subclass of another asserted subclass of parent
+        (the transitive reduction), skipping deprecated, undefined and REC classes.
+        """
+        siblings = self.children.get(parent, {})
+        direct = []
+        for child in siblings:
+            if child in self.deprecated or not self.definitions.get(child):
+                continue
+            if str(child).startswith(self.EXCLUDED_PREFIX):
+                continue
+            if any(parent in self.parents.get(other, ()) for other in self.parents[child]):
+                continue
+            direct.append(child)
+        return direct
+
+    def direct_subclass_rows(self, parent_class):
+        """
+        Rows of `direct_subclasses_df` as [brick_class, brick_definition, brick_parent] lists.
+        """
+        parent = self.resolve(parent_class)
+        value = result_converter(self.graph).value
+        parent_name = value(parent)
+        rows = []
+        for child in self.direct_subclasses(parent):
+            child_name = value(child)
+            self._names[child_name] = child
+            for definition in self.definitions[child]:
+                rows.append([child_name, value(definition), parent_name])
+        return rows
+
+    def direct_subclasses_df(self, parent_class):
+        """
+        Same columns and values as running `query_template` through `query_to_df`.
+        """
+        return pd.DataFrame(self.direct_subclass_rows(parent_class), columns=SUBCLASS_COLUMNS)
+
 def create_directory_structure(parent_class, parent_path=None):
     """
     Creates a directory named after the parent class within the parent path.
@@ -72,7 +162,7 @@ def create_directory_structure(parent_class, parent_path=None):
     # Create the directory if it doesn't exist
     dir_path = os.path.join(base_path, parent_class)
     os.makedirs(dir_path, exist_ok=True)
-    print(f"Created directory: {dir_path}")
+    logger.debug("Created directory: %s", dir_path)
     return dir_path
 
 def save_classes_to_yaml(parent_class, children_data, parent_dir):
@@ -97,10 +187,11 @@ def save_classes_to_yaml(parent_class, children_data, parent_dir):
     file_path = os.path.join(parent_dir, f"{parent_class}.yml")
     
     # Save to YAML
-    with open(file_path, 'w') as file:
-        yaml.dump(children_data, file, default_flow_style=False, sort_keys=False)
+    with stage('yaml_write'):
+        yaml_io.dump(file_path, children_data)
+    count('files_written')
     
-    print(f"Created YAML file: {file_path}")
+    logger.debug("Created YAML file: %s", file_path)
     return file_path
 
 def process_brick_classes(input_df, parent_dir):
@@ -156,7 +247,7 @@ def process_brick_classes(input_df, parent_dir):
     return parent_to_children_data
 
 # %%
-def process_class_hierarchy(parent_class, graph, parent_path=None, processed_classes=None):
+def process_class_hierarchy(parent_class, graph, parent_path=None, processed_classes=None, class_index=None):
     """
     Recursively processes a class hierarchy, creating directories and YAML files
     for each class and its subclasses.
@@ -171,6 +262,8 @@ def process_class_hierarchy(parent_class, graph, parent_path=None, processed_cla
         Path to the parent directory. If None, uses the templates directory.
     processed_classes : set, optional
         Set of classes that have already been processed to avoid cycles
+    class_index : ClassIndex, optional
+        Pre-built hierarchy index of the graph. Built on the first call if None.
     
     Returns:
     --------
@@ -179,6 +272,8 @@ def process_class_hierarchy(parent_class, graph, parent_path=None, processed_cla
     """
     if processed_classes is None:
         processed_classes = set()
+    if class_index is None:
+        class_index = ClassIndex(graph)
     
     # Strip namespace for directory/file naming
     parent_class_clean = strip_namespace(parent_class)
@@ -192,8 +287,7 @@ def process_class_hierarchy(parent_class, graph, parent_path=None, processed_cla
     
     
     # Get direct subclasses
-    query = query_template.substitute(start_parent=parent_class)
-    subclasses_df = query_to_df(query, graph)
+    subclasses_df = class_index.direct_subclasses_df(parent_class)
     
     # If no subclasses, return
     if not subclasses_df.empty:
@@ -203,12 +297,196 @@ def process_class_hierarchy(parent_class, graph, parent_path=None, processed_cla
         
         # Print summary for this level
         for parent, children_data in parent_to_children_data.items():
-            print(f"{parent}: {len(children_data)} direct subclasses")
+            logger.debug("%s: %d direct subclasses", parent, len(children_data))
         
         # Recursively process each subclass
         for _, row in subclasses_df.iterrows():
             subclass = row['brick_class']
-            process_class_hierarchy(subclass, graph, parent_dir, processed_classes)
+            process_class_hierarchy(subclass, graph, parent_dir, processed_classes, class_index)
     
     return processed_classes
 
+
+def plan_class_hierarchy(root_classes, graph, processed_classes=None, class_index=None):
+    """
+    Walk the hierarchies under several root classes the way consecutive
+    process_class_hierarchy calls with a shared processed set would, without
+    writing anything.
+    
+    A class reachable through several parents is expanded (gets its own
+    directory) only under the first parent the serial depth-first walk reaches
+    it from, but is still listed in every parent's YAML file.
+    
+    Parameters:
+    -----------
+    root_classes : list
+        Root class names with namespace (e.g. ['brick:Point', 'brick:Equipment'])
+    graph : rdflib.Graph
+        The RDF graph containing the ontology
+    processed_classes : set, optional
+        Classes already processed; updated in place
+    class_index : ClassIndex, optional
+        Pre-built hierarchy index of the graph
+    
+    Returns:
+    --------
+    tuple
+        (tasks, processed_classes). Tasks are in depth-first order, one per class
+        with subclasses: {'dir': directory relative to the output root,
+        'rows': direct subclass rows, 'parent': index of the parent task or None}
+    """
+    if processed_classes is None:
+        processed_classes = set()
+    if class_index is None:
+        class_index = ClassIndex(graph)
+    tasks = []
+    for root_class in root_classes:
+        # (class name, parent directory, parent task), popped in the serial recursion order
+        stack = [(root_class, "", None)]
+        while stack:
+            parent_class, parent_dir, parent_task = stack.pop()
+            parent_class_clean = strip_namespace(parent_class)
+            if parent_class_clean in processed_classes:
+                continue
+            processed_classes.add(parent_class_clean)
+            rows = class_index.direct_subclass_rows(parent_class)
+            if not rows:
+                continue
+            task_dir = os.path.join(parent_dir, parent_class_clean)
+            tasks.append({'dir': task_dir, 'rows': rows, 'parent': parent_task})
+            task_index = len(tasks) - 1
+            for row in reversed(rows):
+                stack.append((row[0], task_dir, task_index))
+    return tasks, processed_classes
+
+def shard_tasks(tasks, shards):
+    """
+    Split planned tasks into at most `shards` groups of similar size.
+    
+    Subtrees are kept whole where possible; the largest subtrees are split
+    into their top task and child subtrees until the pieces are small enough,
+    then pieces are assigned largest first to the lightest shard.
+    
+    Returns:
+    --------
+    list
+        Lists of task indexes in depth-first order, one per non-empty shard
+    """
+    children = defaultdict(list)
+    weight = [len(task['rows']) + 1 for task in tasks]
+    subtree = list(weight)
+    for index in range(len(tasks) - 1, -1, -1):
+        parent = tasks[index]['parent']
+        if parent is not None:
+            children[parent].append(index)
+            subtree[parent] += subtree[index]
+    total = sum(weight)
+    target = max(1, total // (shards * 4))
+    # a piece is (size, task index, whole subtree?)
+    pieces = [(subtree[i], i, True) for i, task in enumerate(tasks) if task['parent'] is None]
+    while True:
+        pieces.sort(key=lambda piece: (-piece[0], piece[1]))
+        size, index, whole = pieces[0]
+        if size <= target or not whole or not children[index]:
+            break
+        pieces[0] = (weight[index], index, False)
+        pieces.extend((subtree[child], child, True) for child in children[index])
+
+    def expand(index, whole):
+        if not whole:
+            return [index]
+        found, stack = [], [index]
+        while stack:
+            current = stack.pop()
+            found.append(current)
+            stack.extend(children[current])
+        return found
+
+    loads = [[0, []] for _ in range(shards)]
+    for size, index, whole in pieces:
+        lightest = min(loads, key=lambda load: load[0])
+        lightest[0] += size
+        lightest[1].extend(expand(index, whole))
+    return [sorted(indexes) for _, indexes in loads if indexes]
+
+def write_hierarchy_tasks(output_dir, tasks):
+    """
+    Create the directory and YAML file of each planned task under output_dir.
+    Top-level so it can run in worker processes.
+    
+    Returns:
+    --------
+    int
+        Number of YAML files written
+    """
+    for task in tasks:
+        parent_dir = os.path.join(output_dir, task['dir'])
+        os.makedirs(parent_dir, exist_ok=True)
+        process_brick_classes(pd.DataFrame(task['rows'], columns=SUBCLASS_COLUMNS), parent_dir)
+    return len(tasks)
+
+def _merge_tree(source_dir, output_dir):
+    # move every file of a shard's staging tree to the same place in output_dir
+    for root, dirs, files in os.walk(source_dir):
+        target_dir = os.path.join(output_dir, os.path.relpath(root, source_dir))
+        os.makedirs(target_dir, exist_ok=True)
+        for file in files:
+            os.replace(os.path.join(root, file), os.path.join(target_dir, file))
+
+def process_class_hierarchies(root_classes, graph, output_dir, workers=None, processed_classes=None, class_index=None):
+    """
+    Build the directory tree for several root classes in one run, with the work
+    split into balanced shards processed in parallel worker processes.
+    
+    The output is the same as calling process_class_hierarchy for each root in
+    turn with a shared processed set. Each shard is written to its own staging
+    directory inside output_dir and merged into the final tree once every shard
+    has finished.
+    
+    Parameters:
+    -----------
+    root_classes : list
+        Root class names with namespace (e.g. ['brick:Point', 'brick:Equipment'])
+    graph : rdflib.Graph
+        The RDF graph containing the ontology
+    output_dir : str
+        Directory the class tree is written under
+    workers : int, optional
+        Number of worker processes; None uses every core, 1 writes in-process
+    processed_classes : set, optional
+        Classes already processed; updated in place
+    class_index : ClassIndex, optional
+        Pre-built hierarchy index of the graph
+    
+    Returns:
+    --------
+    set
+        Set of processed classes
+    """
+    with stage('plan_hierarchy'):
+        tasks, processed_classes = plan_class_hierarchy(root_classes, graph, processed_classes, class_index)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    if workers <= 1 or len(tasks) < 2:
+        write_hierarchy_tasks(output_dir, tasks)
+        return processed_classes
+
+    shards = shard_tasks(tasks, workers)
+    logger.info("Writing %d class files in %d shards of %s tasks", len(tasks), len(shards),
+                ", ".join(str(len(shard)) for shard in shards))
+    staging = [tempfile.mkdtemp(prefix=".shard-", dir=output_dir) for _ in shards]
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+            futures = [
+                executor.submit(write_hierarchy_tasks, staging_dir, [tasks[i] for i in shard])
+                for staging_dir, shard in zip(staging, shards)
+            ]
+            for future in futures:
+                future.result()
+        for staging_dir in staging:
+            _merge_tree(staging_dir, output_dir)
+    finally:
+        for staging_dir in staging:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    return processed_classes
@@ -1,17 +1,42 @@
 MODEL = "openai/gpt-4o"
 # MODEL = "google/gemini-pro"
+import os
 import openai # CBORG API Proxy Server is OpenAI-compatible through the openai module
 import yaml
-with open('/Users/lazlopaul/Desktop/cborg/api_key.yaml', 'r') as file:
-    API_KEY= yaml.safe_load(file)['key']
-    BASE_URL = yaml.safe_load(file)['base_url']
+from .instrumentation import stage, count
 
-client = openai.OpenAI(
-    api_key=API_KEY,
-    base_url=BASE_URL
-)
+TEMPERATURE = 0.0
+API_KEY_FILE = os.environ.get('CBORG_API_KEY_FILE', '/Users/lazlopaul/Desktop/cborg/api_key.yaml')
 
-def get_completion(prompt, system_prompt = None):
+_client = None
+_cache = None
+
+def get_client():
+    # created on first use so importing the package does not require the key file
+    global _client
+    if _client is None:
+        with open(API_KEY_FILE, 'r') as file:
+            config = yaml.safe_load(file)
+        _client = openai.OpenAI(
+            api_key=config['key'],
+            base_url=config['base_url']
+        )
+    return _client
+
+def set_client(client):
+    # e.g. point the pipeline at a local OpenAI-compatible server
+    global _client
+    _client = client
+
+def set_completion_cache(cache):
+    # a CompletionCache consulted by every get_completion call, None to disable
+    global _cache
+    _cache = cache
+
+def get_completion_cache():
+    return _cache
+
+def build_messages(prompt, system_prompt = None):
     messages = [
         {
             "role": "user",
@@ -25,10 +50,48 @@ def get_completion(prompt, system_prompt = None):
                 "content":system_prompt
             }
         )
-    response = client.chat.completions.create(
-            model=MODEL, 
-            messages = messages,
-            temperature=0.0  
-        )
+    return messages
+
+def cached_completion(prompt, system_prompt = None, cache = None):
+    # the cached completion text, or None on a miss (or without a cache)
+    cache = cache or _cache
+    if cache is None:
+        return None
+    cached = cache.get(MODEL, build_messages(prompt, system_prompt), TEMPERATURE)
+    if cached is not None:
+        count('completion_cache_hits')
+        return cached
+    count('completion_cache_misses')
+    return None
+
+def get_completion(prompt, system_prompt = None, client = None, timeout = None, max_retries = None, cache = None, lookup = True):
+    # lookup=False skips the cache lookup (the caller already missed) but still stores the result
+    messages = build_messages(prompt, system_prompt)
+    cache = cache or _cache
+    if lookup:
+        cached = cached_completion(prompt, system_prompt, cache)
+        if cached is not None:
+            return cached
+    client = client or get_client()
+    options = {}
+    if timeout is not None:
+        options['timeout'] = timeout
+    if max_retries is not None:
+        options['max_retries'] = max_retries
+    if options:
+        client = client.with_options(**options)
+    count('llm_calls')
+    with stage('llm'):
+        response = client.chat.completions.create(
+                model=MODEL,
+                messages = messages,
+                temperature=TEMPERATURE
+            )
+    if response.usage is not None:
+        count('prompt_tokens', response.usage.prompt_tokens)
+        count('completion_tokens', response.usage.completion_tokens)
 
-    return response.choices[0].message.content
\ No newline at end of file
+    content = response.choices[0].message.content
+    if cache is not None:
+        cache.put(MODEL, messages, TEMPERATURE, content)
+    return content
@@ -7,134 +7,146 @@ import yaml
 import os
 import pandas as pd
 import csv
+import pickle
 from io import StringIO
 from importlib.resources import files
+from .ontology_cache import load_ontology, snapshot_path, offline_default, S223_URL
+from .instrumentation import stage
 
 quantityknds_file = str(files('template_builder').joinpath('data/quantitykinds.csv'))
 
-def get_s223_info():
-    s223 = Graph()
-    s223.parse("https://open223.info/223p.ttl", format="ttl")
-    bind_prefixes(s223)
-    # Get properties
-    prop_query = """ SELECT DISTINCT ?s223_class ?s223_definition WHERE {
-        ?s223_class rdfs:subClassOf* s223:Property ;
-        rdfs:comment ?s223_definition .
-        FILTER NOT EXISTS {
-            ?s223_class qudt:hasQuantityKind ?qk .
-        }
-    }
+VOCABULARY_SUFFIX = ".vocabularies.pickle"
+
+# bump when the extracted vocabularies change for the same ontology
+VOCABULARY_VERSION = 1
+
+VOCABULARY_COLUMNS = ['s223_class', 's223_definition']
+
+# every vocabulary except the properties excludes the descendants of these
+EXCLUDED_ENUMERATIONS = [
+    'EnumerationKind-Substance',
+    'EnumerationKind-Numerical',
+    'EnumerationKind-ElectricalPhaseIdentifier',
+    'EnumerationKind-ElectricalVoltagePhases',
+    'EnumerationKind-DayOfWeek',
+]
+# and the enumeration kinds also these
+EXCLUDED_ENUMERATION_KINDS = EXCLUDED_ENUMERATIONS + [
+    'EnumerationKind-Aspect',
+    'EnumerationKind-Role',
+    'EnumerationKind-Domain',
+]
+
+
+class SubclassClosure:
     """
-    prop_df = query_to_df(prop_query, s223)
-    s223_properties = prop_df.to_csv(index=False)
-    
-    # Get Media
-    med_query = """ SELECT DISTINCT ?s223_class ?s223_definition WHERE {
-        ?s223_class rdfs:subClassOf* s223:EnumerationKind-Substance ;
-        rdfs:comment ?s223_definition .
-        FILTER NOT EXISTS {
-            {
-                ?s223_class rdfs:subClassOf+ s223:Electricity-DC .
-            }
-            UNION
-            {
-                ?s223_class rdfs:subClassOf+ s223:Electricity-AC .
-            }
-        }
-    }
+    rdfs:subClassOf closure of a graph, computed from one pass over its
+    subClassOf triples. Descendant sets are memoized per class.
     """
-    media_df = query_to_df(med_query, s223)
-    s223_media = media_df.to_csv(index=False)
-    
-    # Get Aspects
-
-    # looking at everything that could be an aspect 
-    # asp_query = """ SELECT DISTINCT ?s223_class ?s223_definition WHERE {
-    #     ?s223_class rdfs:subClassOf* s223:EnumerationKind .
-    #     ?s223_class rdfs:comment ?s223_definition .
-      
-    #     FILTER NOT EXISTS {        
-    #         ?s223_class rdfs:subClassOf* s223:EnumerationKind-Substance .
-    #     }
-    #     # Excluding all the voltages
-    #     FILTER NOT EXISTS {        
-    #         ?s223_class rdfs:subClassOf* s223:EnumerationKind-Numerical .
-    #     }
-    #     FILTER NOT EXISTS {        
-    #         ?s223_class rdfs:subClassOf* s223:EnumerationKind-ElectricalPhaseIdentifier .
-    #     }
-    #     FILTER NOT EXISTS {        
-    #         ?s223_class rdfs:subClassOf* s223:EnumerationKind-ElectricalVoltagePhases .
-    #     }
-    #     FILTER NOT EXISTS {        
-    #         ?s223_class rdfs:subClassOf* s223:EnumerationKind-DayOfWeek .
-    #     }
-    # }
-    # """
-
-    # looking only at aspects
-    asp_query = """ SELECT DISTINCT ?s223_class ?s223_definition WHERE {
-        ?s223_class rdfs:subClassOf* s223:EnumerationKind-Aspect .
-        ?s223_class rdfs:comment ?s223_definition .
-      
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-Substance .
-        }
-        # Excluding all the voltages
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-Numerical .
-        }
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-ElectricalPhaseIdentifier .
-        }
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-ElectricalVoltagePhases .
-        }
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-DayOfWeek .
-        }
-    }
+
+    def __init__(self, graph):
+        self.children = {}
+        for child, _, parent in graph.triples((None, RDFS.subClassOf, None)):
+            self.children.setdefault(parent, set()).add(child)
+        self._descendants = {}
+
+    def descendants(self, cls, include_self=True):
+        """Classes C with `C rdfs:subClassOf* cls` (`+` without include_self)."""
+        if cls not in self._descendants:
+            found = set()
+            stack = [cls]
+            while stack:
+                for child in self.children.get(stack.pop(), ()):
+                    if child not in found:
+                        found.add(child)
+                        stack.append(child)
+            self._descendants[cls] = found
+        found = self._descendants[cls]
+        # cycles can make a class its own strict descendant, as with rdfs:subClassOf+
+        return found | {cls} if include_self else found
+
+    def descendants_of_any(self, classes):
+        found = set()
+        for cls in classes:
+            found |= self.descendants(cls)
+        return found
+
+
+def extract_vocabularies(s223):
     """
-    asp_df = query_to_df(asp_query, s223)
-    s223_aspects = asp_df.to_csv(index=False)
-    
-    # Get EnumerationKind
-    ek_query = """ SELECT DISTINCT ?s223_class ?s223_definition WHERE {
-        ?s223_class rdfs:subClassOf+ s223:EnumerationKind .
-        ?s223_class rdfs:comment ?s223_definition .
-      
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-Substance .
-        }
-        # Excluding all the voltages
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-Numerical .
-        }
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-ElectricalPhaseIdentifier .
-        }
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-ElectricalVoltagePhases .
-        }
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-DayOfWeek .
-        }
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-Aspect .
-        }
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-Role .
-        }
-        FILTER NOT EXISTS {        
-            ?s223_class rdfs:subClassOf* s223:EnumerationKind-Domain .
-        }
-    }
+    The property, media, aspect and enumeration kind vocabularies of a 223P graph.
+
+    Answers the same questions as the SPARQL queries these replaced
+    (`rdfs:subClassOf*` paths with `FILTER NOT EXISTS` exclusions) as set
+    operations on one subclass closure.
+
+    Returns:
+        tuple: prop_df, media_df, asp_df, ek_df with columns s223_class and
+            s223_definition, one row per class and comment, sorted
     """
-    ek_df = query_to_df(ek_query, s223)
+    closure = SubclassClosure(s223)
+    comments = {}
+    for cls, _, comment in s223.triples((None, RDFS.comment, None)):
+        comments.setdefault(cls, set()).add(comment)
+    with_quantitykind = set(s223.subjects(QUDT.hasQuantityKind, None))
+    value = result_converter(s223).value
+
+    def frame(classes):
+        rows = sorted({(value(cls), value(comment)) for cls in classes for comment in comments.get(cls, ())})
+        return pd.DataFrame(rows, columns=VOCABULARY_COLUMNS)
+
+    excluded = closure.descendants_of_any(S223[name] for name in EXCLUDED_ENUMERATIONS)
+    properties = closure.descendants(S223.Property) - with_quantitykind
+    media = closure.descendants(S223['EnumerationKind-Substance']) - (
+        closure.descendants(S223['Electricity-DC'], include_self=False)
+        | closure.descendants(S223['Electricity-AC'], include_self=False))
+    aspects = closure.descendants(S223['EnumerationKind-Aspect']) - excluded
+    enumeration_kinds = closure.descendants(S223.EnumerationKind, include_self=False) - \
+        closure.descendants_of_any(S223[name] for name in EXCLUDED_ENUMERATION_KINDS)
+    return frame(properties), frame(media), frame(aspects), frame(enumeration_kinds)
+
+
+def _load_cached_vocabularies(path):
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        cached = pickle.load(f)
+    if cached.get('version') != VOCABULARY_VERSION:
+        return None
+    return cached['frames']
+
+
+def _save_cached_vocabularies(path, frames):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'version': VOCABULARY_VERSION, 'frames': frames}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def get_s223_info(pin=None, offline=None, cache_dir=None):
+    # 223P is loaded through the snapshot cache, see ontology_cache.load_ontology.
+    # The extracted vocabularies are cached next to the snapshot, so a pinned or
+    # offline run with a cached result does not load the ontology at all.
+    offline = offline_default() if offline is None else offline
+    frames = None
+    if pin or offline:
+        frames = _load_cached_vocabularies(snapshot_path(S223_URL, cache_dir, pin, VOCABULARY_SUFFIX))
+    if frames is None:
+        s223 = load_ontology(S223_URL, cache_dir=cache_dir, pin=pin, offline=offline)
+        bind_prefixes(s223)
+        with stage('extract_vocabularies'):
+            frames = extract_vocabularies(s223)
+        path = snapshot_path(S223_URL, cache_dir, pin, VOCABULARY_SUFFIX)
+        if path is not None:
+            _save_cached_vocabularies(path, frames)
+    prop_df, media_df, asp_df, ek_df = frames
+    s223_properties = prop_df.to_csv(index=False)
+    s223_media = media_df.to_csv(index=False)
+    s223_aspects = asp_df.to_csv(index=False)
     s223_eks = ek_df.to_csv(index=False)
-    
+
     # Convert quantitykinds to dataframe for validation
     qk_df = pd.read_csv(quantityknds_file)
     quantitykinds = qk_df.to_csv(index=False)
-    
+
     return s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds,prop_df, media_df, asp_df, ek_df, qk_df
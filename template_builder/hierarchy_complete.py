@@ -0,0 +1,135 @@
+"""
+Hierarchy-aware autocomplete.
+
+The brick_yaml tree mirrors the Brick hierarchy, and subclasses mostly repeat
+their parent's s223 mapping. This processes the tree top-down and passes each
+parent's resolved mapping to its children as a default, so a child only needs a
+full four-field lookup when it actually differs from its parent.
+"""
+
+import logging
+import os
+from concurrent.futures import Future
+
+from .ai_complete_yaml import (
+    FIELDS, load_brick_template, build_prompts, apply_results, write_brick_template
+)
+from .get_completion import get_completion
+from .preclassify import mark_sources
+
+logger = logging.getLogger(__name__)
+
+# full: always run the full lookup; ask: ask whether the child differs first;
+# inherit: copy the parent's mapping without asking
+POLICIES = ('full', 'ask', 'inherit')
+
+def build_differs_prompt(brick_class, text_definition, parent_class, parent_results):
+    """Build the cheap yes/no prompt asking whether a child needs its own mapping."""
+    mapping = "\n".join(f"        {field}: {parent_results.get(field, 'None')}" for field in FIELDS)
+    return f"""
+        The brick_class {brick_class} is a subclass of {parent_class}, which is mapped to s223 as:
+{mapping}
+        Based on the name and definition of {brick_class}, does it need a different s223_class,
+        quantitykind or enumerationkind, medium or aspects than its parent?
+        Only answer Yes or No. Do not return any other information.
+
+        brick_class: {brick_class}
+        definition: {text_definition}
+        """
+
+def template_files_top_down(template_dir):
+    """YAML files of a brick_yaml tree grouped by depth, shallowest first."""
+    levels = {}
+    for root, dirs, files in os.walk(template_dir):
+        for file in files:
+            if file.endswith(".yml"):
+                path = os.path.join(root, file)
+                depth = os.path.relpath(path, template_dir).count(os.sep)
+                levels.setdefault(depth, []).append(path)
+    return [sorted(levels[depth]) for depth in sorted(levels)]
+
+def process_brick_tree(template_dir, new_dir, s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds, prop_df, media_df, asp_df, ek_df, qk_df, policy='ask', engine=None, retriever=None, preclassifier=None):
+    """
+    Process a brick_yaml tree top-down, using each parent's mapping as the default for its children.
+
+    Args:
+        template_dir (str): Root of the brick_yaml tree
+        policy (str): One of POLICIES
+        engine (CompletionEngine): Optional engine; each depth level runs concurrently
+        retriever (CandidateRetriever): Optional retriever narrowing the vocabularies in each prompt
+        preclassifier (PreClassifier): Optional rule engine; its decisions override inherited values
+
+    Returns:
+        dict: Counts of full lookups, differ questions and inherited classes
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown inheritance policy '{policy}', expected one of {POLICIES}")
+    system_prompt = """"""
+    resolved = {}
+    counts = {'full': 0, 'asked': 0, 'inherited': 0}
+
+    def submit(prompt):
+        if engine is not None:
+            return engine.submit(prompt, system_prompt)
+        future = Future()
+        future.set_result(get_completion(prompt, system_prompt))
+        return future
+
+    def vocab_for(brick_class, text_definition):
+        if retriever is not None:
+            return retriever.vocabularies([(brick_class, text_definition)])
+        return (s223_properties, s223_media, s223_aspects, s223_eks, quantitykinds)
+
+    def full_lookup(brick_class, text_definition, decided):
+        counts['full'] += 1
+        prompts = build_prompts(brick_class, text_definition, *vocab_for(brick_class, text_definition))
+        return {field: submit(prompt) for field, prompt in prompts.items() if field not in decided}
+
+    for level in template_files_top_down(template_dir):
+        jobs = []
+        for template_file in level:
+            for brick_class, updated_definition_data, text_definition in load_brick_template(template_file):
+                decided = preclassifier.classify(brick_class) if preclassifier is not None else {}
+                parent_class = updated_definition_data.get('brick_parent')
+                parent_results = resolved.get(parent_class)
+                job = {
+                    'file': template_file, 'class': brick_class, 'data': updated_definition_data,
+                    'definition': text_definition, 'decided': decided, 'parent': parent_results,
+                    'pending': None, 'differs': None,
+                }
+                if parent_results is None or policy == 'full':
+                    job['pending'] = full_lookup(brick_class, text_definition, decided)
+                elif policy == 'ask':
+                    counts['asked'] += 1
+                    job['differs'] = submit(build_differs_prompt(brick_class, text_definition, parent_class, parent_results))
+                jobs.append(job)
+
+        # children whose answer is not a clear "no" get the full lookup
+        for job in jobs:
+            if job['differs'] is not None and not job['differs'].result().strip().lower().startswith('no'):
+                job['pending'] = full_lookup(job['class'], job['definition'], job['decided'])
+
+        updated = {}
+        for job in jobs:
+            if job['pending'] is not None:
+                results = {field: future.result() for field, future in job['pending'].items()}
+                inherited = []
+            else:
+                counts['inherited'] += 1
+                results = {field: value for field, value in job['parent'].items() if field not in job['decided']}
+                inherited = list(results)
+            results.update(job['decided'])
+            results = {field: results[field] for field in FIELDS if field in results}
+            logger.debug("Processing brick_class: %s", job['class'])
+            apply_results(job['data'], results, prop_df, media_df, asp_df, ek_df, qk_df)
+            mark_sources(job['data'], job['decided'])
+            mark_sources(job['data'], inherited, source='inherited')
+            resolved[job['class']] = results
+            updated.setdefault(job['file'], {})[job['class']] = job['data']
+
+        for template_file in level:
+            logger.info("Processing template file: %s", template_file)
+            write_brick_template(template_file, new_dir, updated.get(template_file, {}))
+
+    logger.info("Full lookups: %d, asked: %d, inherited: %d", counts['full'], counts['asked'], counts['inherited'])
+    return counts
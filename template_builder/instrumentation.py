@@ -0,0 +1,222 @@
+"""
+Lightweight run instrumentation: hierarchical stage timers, counters and
+optional per-stage profiling, with a JSON and text report at the end of a run.
+
+Usage:
+    with stage("autocomplete", profile="cprofile"):
+        ...
+        with stage("llm"):
+            ...
+    count("llm_calls")
+    write_report("run_report")  # run_report.json and run_report.txt
+
+Stages opened on the main thread nest. Timers recorded from worker threads
+(e.g. CompletionEngine requests) are attached to the outermost stage the main
+thread has open, so their summed time can exceed wall time. Worker processes
+keep their own, unreported instrumentation.
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+PROFILERS = ('cprofile', 'sampling')
+
+
+class SamplingProfiler:
+    """
+    Samples the main thread's stack at a fixed interval from a background thread.
+
+    Args:
+        interval (float): Seconds between samples
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.leaf = Counter()
+        self.inclusive = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = threading.main_thread().ident
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            self.samples += 1
+            seen = set()
+            leaf = True
+            while frame is not None:
+                code = frame.f_code
+                name = f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+                if leaf:
+                    self.leaf[name] += 1
+                    leaf = False
+                if name not in seen:
+                    self.inclusive[name] += 1
+                    seen.add(name)
+                frame = frame.f_back
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self, limit=25):
+        def top(counter):
+            return [{'function': name, 'samples': n, 'fraction': round(n / self.samples, 4)}
+                    for name, n in counter.most_common(limit)]
+        return {'type': 'sampling', 'interval': self.interval, 'samples': self.samples,
+                'self': top(self.leaf), 'inclusive': top(self.inclusive)}
+
+
+def _cprofile_summary(profiler, limit=25):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+    return {'type': 'cprofile', 'text': out.getvalue()}
+
+
+def _new_node():
+    return {'seconds': 0.0, 'calls': 0, 'children': {}}
+
+
+class Instrumentation:
+    """Collects the timers, counters and profiles of one run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.root = _new_node()
+            self.counters = Counter()
+            self.profiles = {}
+            self._stack = [self.root]
+            self._path = []
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    @contextmanager
+    def stage(self, name, profile=None):
+        """
+        Time a block as a named stage, optionally under a profiler.
+
+        Args:
+            name (str): Stage name; repeated stages with the same path are aggregated
+            profile (str): None, 'cprofile' or 'sampling'
+        """
+        if profile is not None and profile not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{profile}', expected one of {PROFILERS}")
+        owner = threading.current_thread() is threading.main_thread()
+        with self._lock:
+            parent = self._stack[-1] if owner else self._stack[min(1, len(self._stack) - 1)]
+            node = parent['children'].setdefault(name, _new_node())
+            path = '/'.join((self._path if owner else self._path[:1]) + [name])
+            if owner:
+                self._stack.append(node)
+                self._path.append(name)
+        profiler = None
+        if profile == 'cprofile' and owner:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif profile == 'sampling' and owner:
+            profiler = SamplingProfiler()
+            profiler.start()
+        start = time.perf_counter()
+        try:
+            yield node
+        finally:
+            elapsed = time.perf_counter() - start
+            if isinstance(profiler, cProfile.Profile):
+                profiler.disable()
+                self.profiles[path] = _cprofile_summary(profiler)
+            elif profiler is not None:
+                profiler.stop()
+                self.profiles[path] = profiler.summary()
+            with self._lock:
+                node['seconds'] += elapsed
+                node['calls'] += 1
+                if owner:
+                    self._stack.pop()
+                    self._path.pop()
+
+    def report(self):
+        """The run report as a JSON-serializable dict."""
+        def export(node):
+            return {name: {'seconds': round(child['seconds'], 6), 'calls': child['calls'],
+                           'children': export(child)}
+                    for name, child in node['children'].items()}
+        with self._lock:
+            return {
+                'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                'elapsed': round(time.time() - self.started, 6),
+                'stages': export(self.root),
+                'counters': dict(sorted(self.counters.items())),
+                'profiles': dict(self.profiles),
+            }
+
+    def format_report(self, report=None):
+        """The run report as indented text."""
+        report = report or self.report()
+        lines = [f"Run started {report['started']}, {report['elapsed']:.3f}s elapsed", "", "Stages:"]
+
+        def walk(stages, depth):
+            for name, node in stages.items():
+                lines.append(f"{'  ' * depth}{name:<{max(1, 32 - 2 * depth)}} {node['seconds']:>10.3f}s  {node['calls']:>7} calls")
+                walk(node['children'], depth + 1)
+        walk(report['stages'], 1)
+        lines += ["", "Counters:"]
+        lines += [f"  {name:<32} {value:>10}" for name, value in report['counters'].items()]
+        for path, profile in report['profiles'].items():
+            lines += ["", f"Profile of {path} ({profile['type']}):"]
+            if profile['type'] == 'cprofile':
+                lines.append(profile['text'].rstrip())
+            else:
+                lines.append(f"  {profile['samples']} samples every {profile['interval']}s, self time:")
+                lines += [f"  {row['fraction']:>6.1%}  {row['function']}" for row in profile['self']]
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path):
+        """
+        Write `<path>.json` and `<path>.txt`.
+
+        Returns:
+            dict: The report
+        """
+        report = self.report()
+        with open(f"{path}.json", 'w') as f:
+            json.dump(report, f, indent=2)
+        with open(f"{path}.txt", 'w') as f:
+            f.write(self.format_report(report))
+        return report
+
+
+_instrumentation = Instrumentation()
+
+def get_instrumentation():
+    return _instrumentation
+
+def stage(name, profile=None):
+    return _instrumentation.stage(name, profile)
+
+def count(name, n=1):
+    _instrumentation.count(name, n)
+
+def write_report(path):
+    return _instrumentation.write_report(path)
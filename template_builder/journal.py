@@ -0,0 +1,146 @@
+"""
+Crash-safe checkpoint journal for the autocomplete stage.
+
+Every completed field of every class is appended to a JSONL journal as soon as
+its completion returns, and every template file is marked done once its YAML
+has been written (atomically, see ai_complete_yaml.write_brick_template).
+Writes are flushed and fsynced in batches. After a crash or Ctrl-C, a journal
+opened with resume=True replays what was already completed so only the
+unfinished classes and fields are sent to the LLM again. The fields of done
+files are kept as well, so a done file whose YAML has gone missing is rebuilt
+from the journal instead of being prompted again.
+
+Journal lines:
+    {"file": ..., "class": ..., "field": ..., "value": ...}   one completed field
+    {"file": ..., "done": true}                               YAML written
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL = ".autocomplete_journal.jsonl"
+
+
+def read_journal(path):
+    """
+    Replay a journal file.
+
+    A torn last line (from a crash mid-write) is ignored.
+
+    Returns:
+        tuple: ({file: {class: {field: value}}} for every journaled file, done or
+            not, set of done files)
+    """
+    completed = {}
+    done = set()
+    if not os.path.exists(path):
+        return completed, done
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning("Ignoring unreadable journal line in %s", path)
+                continue
+            if entry.get('done'):
+                done.add(entry['file'])
+            else:
+                completed.setdefault(entry['file'], {}).setdefault(entry['class'], {})[entry['field']] = entry['value']
+    return completed, done
+
+
+class CompletionJournal:
+    """
+    Append-only JSONL journal of completed classes and fields.
+
+    Args:
+        path (str): Journal file
+        resume (bool): Replay an existing journal; otherwise it is started afresh
+        sync_every (int): fsync after this many records
+        sync_interval (float): fsync at least this often (seconds) while records come in
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL, resume=False, sync_every=64, sync_interval=1.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        if resume:
+            self.completed, self.done = read_journal(path)
+            self.compact()
+            logger.info("Resuming from %s: %d files done, %d classes of other files partially or fully completed",
+                        path, len(self.done), sum(len(classes) for template_file, classes in self.completed.items()
+                                                  if template_file not in self.done))
+        else:
+            self.completed, self.done = {}, set()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a' if resume else 'w')
+
+    def results(self, template_file, brick_class):
+        """Fields of a class already completed in an earlier run."""
+        return dict(self.completed.get(template_file, {}).get(brick_class, {}))
+
+    def is_done(self, template_file):
+        return template_file in self.done
+
+    def _append(self, entry, sync=False):
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._pending += 1
+            if sync or self._pending >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def record(self, template_file, brick_class, field, value):
+        """Record one completed field (thread-safe)."""
+        self._append({'file': template_file, 'class': brick_class, 'field': field, 'value': value})
+
+    def mark_done(self, template_file):
+        """Record that a file's YAML has been written; synced immediately."""
+        self._append({'file': template_file, 'done': True}, sync=True)
+        self.done.add(template_file)
+
+    def compact(self):
+        """Atomically rewrite the journal with one line per done marker and journaled field."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for template_file in sorted(self.done):
+                f.write(json.dumps({'file': template_file, 'done': True}) + "\n")
+            for template_file, classes in self.completed.items():
+                for brick_class, fields in classes.items():
+                    for field, value in fields.items():
+                        f.write(json.dumps({'file': template_file, 'class': brick_class, 'field': field, 'value': value}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def finish(self):
+        """Close and remove the journal once every file has been written."""
+        self.close()
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,259 @@
+"""
+On-disk snapshot cache for the remote ontologies used by the pipeline
+(Brick.ttl and 223p.ttl).
+
+Snapshots are keyed on the source URL and the sha256 of the downloaded
+content. Next to the raw Turtle, each snapshot stores a pre-parsed binary
+form (a pickled term table plus integer triples) that loads much faster than
+re-parsing the Turtle. Snapshots can be pinned by hash and used fully offline.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import urllib.request
+from datetime import datetime, timezone
+
+from rdflib import Graph
+
+from .instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+BRICK_URL = "https://brickschema.org/schema/1.4.3/Brick.ttl"
+S223_URL = "https://open223.info/223p.ttl"
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "TEMPLATE_BUILDER_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "brick_223_templates", "ontologies"),
+)
+
+# bump when the layout of the pickled snapshot changes
+SNAPSHOT_FORMAT = 1
+
+
+def offline_default():
+    """True when $TEMPLATE_BUILDER_OFFLINE asks for offline runs; the default of every `offline` argument."""
+    return os.environ.get("TEMPLATE_BUILDER_OFFLINE", "").lower() in ("1", "true", "yes")
+
+
+def _url_dir(url, cache_dir):
+    url_key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, url_key)
+
+
+def _read_index(url_dir):
+    index_path = os.path.join(url_dir, "index.json")
+    if not os.path.exists(index_path):
+        return {"snapshots": {}, "latest": None}
+    with open(index_path, "r") as f:
+        return json.load(f)
+
+
+def _write_index(url_dir, index):
+    index_path = os.path.join(url_dir, "index.json")
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, index_path)
+
+
+def _resolve_pin(index, pin):
+    """Resolve a full or abbreviated content hash against the index."""
+    matches = [sha for sha in index["snapshots"] if sha.startswith(pin)]
+    if len(matches) > 1:
+        raise ValueError(f"Ambiguous snapshot pin '{pin}': matches {sorted(matches)}")
+    return matches[0] if matches else None
+
+
+def graph_to_snapshot(g):
+    """
+    Convert a graph into the binary snapshot form.
+
+    Every distinct term is stored once in a term table and triples are stored
+    as integer indexes into that table.
+    """
+    terms = {}
+    rows = []
+    for s, p, o in g:
+        row = []
+        for term in (s, p, o):
+            term_id = terms.get(term)
+            if term_id is None:
+                term_id = terms[term] = len(terms)
+            row.append(term_id)
+        rows.append(tuple(row))
+    namespaces = [(prefix, str(namespace)) for prefix, namespace in g.namespaces()]
+    payload = {
+        "format": SNAPSHOT_FORMAT,
+        "namespaces": namespaces,
+        "terms": list(terms),
+        "triples": rows,
+    }
+    return pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def snapshot_to_graph(data, g=None):
+    """Load the binary snapshot form into a (new) graph."""
+    payload = pickle.loads(data)
+    if payload.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format {payload.get('format')}")
+    if g is None:
+        g = Graph()
+    for prefix, namespace in payload["namespaces"]:
+        g.bind(prefix, namespace, override=False)
+    terms = payload["terms"]
+    g.addN((terms[s], terms[p], terms[o], g) for s, p, o in payload["triples"])
+    return g
+
+
+def _fetch(url):
+    request = urllib.request.Request(url, headers={"Accept": "text/turtle"})
+    with stage("fetch_ontology"), urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def _store_snapshot(url, url_dir, content, format):
+    sha = hashlib.sha256(content).hexdigest()
+    raw_path = os.path.join(url_dir, f"{sha}.ttl")
+    if not os.path.exists(raw_path):
+        with open(raw_path, "wb") as f:
+            f.write(content)
+    g = Graph()
+    with stage("parse_ontology"):
+        g.parse(data=content, format=format)
+    _write_binary(url_dir, sha, g)
+
+    index = _read_index(url_dir)
+    index["url"] = url
+    index["latest"] = sha
+    index["snapshots"].setdefault(sha, {})["fetched"] = datetime.now(timezone.utc).isoformat()
+    _write_index(url_dir, index)
+    return sha, g
+
+
+def _write_binary(url_dir, sha, g):
+    bin_path = os.path.join(url_dir, f"{sha}.pickle")
+    tmp_path = bin_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(graph_to_snapshot(g))
+    os.replace(tmp_path, bin_path)
+
+
+def _load_snapshot(url_dir, sha, format):
+    bin_path = os.path.join(url_dir, f"{sha}.pickle")
+    if os.path.exists(bin_path):
+        with open(bin_path, "rb") as f:
+            try:
+                with stage("load_snapshot"):
+                    return snapshot_to_graph(f.read())
+            except (ValueError, pickle.UnpicklingError, EOFError, KeyError, IndexError, TypeError, AttributeError) as e:
+                # stale binary format or a truncated/corrupt file, rebuild it from the raw Turtle below
+                logger.warning("Rebuilding snapshot %s: %s", bin_path, e)
+    raw_path = os.path.join(url_dir, f"{sha}.ttl")
+    if not os.path.exists(raw_path):
+        return None
+    g = Graph()
+    with stage("parse_ontology"):
+        g.parse(raw_path, format=format)
+    _write_binary(url_dir, sha, g)
+    return g
+
+
+def load_ontology(url, cache_dir=None, pin=None, offline=None, format="ttl"):
+    """
+    Load an ontology through the on-disk snapshot cache.
+
+    Args:
+        url (str): Source URL of the ontology
+        cache_dir (str): Cache directory. Defaults to $TEMPLATE_BUILDER_CACHE
+            or ~/.cache/brick_223_templates/ontologies
+        pin (str): Content sha256 (or a unique prefix of it) of the snapshot to use.
+            A pinned snapshot is never re-downloaded once it is cached.
+        offline (bool): Never touch the network; use the pinned or latest cached
+            snapshot. Defaults to $TEMPLATE_BUILDER_OFFLINE
+        format (str): rdflib parser format of the source
+
+    Returns:
+        rdflib.Graph: The parsed ontology
+    """
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    offline = offline_default() if offline is None else offline
+    url_dir = _url_dir(url, cache_dir)
+    os.makedirs(url_dir, exist_ok=True)
+    index = _read_index(url_dir)
+
+    if pin:
+        sha = _resolve_pin(index, pin)
+        if sha is not None:
+            g = _load_snapshot(url_dir, sha, format)
+            if g is not None:
+                return g
+        if offline:
+            raise FileNotFoundError(f"Pinned snapshot '{pin}' of {url} is not in the cache at {url_dir}")
+        content = _fetch(url)
+        sha = hashlib.sha256(content).hexdigest()
+        # checked before anything is stored, so the cache never moves to the wrong content
+        if not sha.startswith(pin):
+            raise ValueError(f"Content of {url} has sha256 {sha}, which does not match pin '{pin}'")
+        sha, g = _store_snapshot(url, url_dir, content, format)
+        return g
+
+    if not offline:
+        try:
+            content = _fetch(url)
+        except OSError as e:
+            logger.warning("Could not fetch %s (%s), falling back to the cached snapshot", url, e)
+        else:
+            sha = hashlib.sha256(content).hexdigest()
+            g = _load_snapshot(url_dir, sha, format)
+            if g is None:
+                sha, g = _store_snapshot(url, url_dir, content, format)
+            elif index.get("latest") != sha:
+                index["url"] = url
+                index["latest"] = sha
+                index["snapshots"].setdefault(sha, {})["fetched"] = datetime.now(timezone.utc).isoformat()
+                _write_index(url_dir, index)
+            return g
+
+    latest = index.get("latest")
+    g = _load_snapshot(url_dir, latest, format) if latest else None
+    if g is None:
+        raise FileNotFoundError(f"No cached snapshot of {url} in {url_dir}")
+    return g
+
+
+def snapshot_path(url, cache_dir=None, pin=None, suffix=""):
+    """
+    Path of a file stored next to the snapshot load_ontology uses offline (the
+    pinned one, or the latest), e.g. data derived from it. None if there is none.
+    """
+    url_dir = _url_dir(url, cache_dir or DEFAULT_CACHE_DIR)
+    index = _read_index(url_dir)
+    sha = _resolve_pin(index, pin) if pin else index.get("latest")
+    if sha is None:
+        return None
+    return os.path.join(url_dir, f"{sha}{suffix}")
+
+
+def import_snapshot(url, path, cache_dir=None, format="ttl"):
+    """
+    Seed the cache for `url` from a local file, e.g. on offline build hosts.
+
+    Returns:
+        str: The content sha256 of the stored snapshot, usable as a pin
+    """
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    url_dir = _url_dir(url, cache_dir)
+    os.makedirs(url_dir, exist_ok=True)
+    with open(path, "rb") as f:
+        content = f.read()
+    sha, _ = _store_snapshot(url, url_dir, content, format)
+    return sha
+
+
+def list_snapshots(url, cache_dir=None):
+    """Return the cache index for `url` (latest hash and known snapshots)."""
+    return _read_index(_url_dir(url, cache_dir or DEFAULT_CACHE_DIR))
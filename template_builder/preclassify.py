@@ -0,0 +1,205 @@
+"""
+Deterministic, lexicon-based pre-classifier for the autocomplete stage.
+
+Many Brick class names decide some s223 fields on their own: *_Air_* is
+s223:Fluid-Air, *Temperature_Sensor has quantitykind Temperature, and so on.
+The pre-classifier fills in every field it can decide unambiguously from the
+class name, so only the remaining fields are sent to the LLM. The lexicon is a
+maintainable token table, optionally extended with rules learned from the
+reviewed YAML files.
+"""
+
+import logging
+import os
+import re
+from collections import defaultdict
+
+from . import yaml_io
+from .get_s223_data import get_s223_info
+
+logger = logging.getLogger(__name__)
+
+# Field keys follow ai_complete_yaml.FIELDS. Keys are Brick name tokens or
+# underscore-joined phrases; the longest matching phrase wins. Values are checked
+# against the 223P vocabularies when a PreClassifier is built.
+DEFAULT_LEXICON = {
+    'medium': {
+        'Air': 's223:Fluid-Air',
+        'Water': 's223:Fluid-Water',
+        'Steam': 's223:Water-Steam',
+        'Refrigerant': 's223:Fluid-Refrigerant',
+        'Oil': 's223:Fluid-Oil',
+        'Natural_Gas': 's223:Fluid-NaturalGas',
+    },
+    'qk_ek': {
+        'Temperature': 'Temperature',
+        'Illuminance': 'Illuminance',
+        'Torque': 'Torque',
+        'Energy': 'Energy',
+        'Azimuth': 'Azimuth',
+        'Tilt': 'Tilt',
+    },
+}
+
+# s223_class is only decided together with a quantitykind, from the class suffix
+QUANTIFIABLE_SUFFIXES = {
+    'Sensor': 's223:QuantifiableObservableProperty',
+}
+
+# where the source of a decided field is recorded in the class entry
+SOURCE_KEYS = {
+    's223_class': 's223_class_source',
+    'qk_ek': 'quantitykind_source',
+    'medium': 'medium_source',
+    'aspects': 'aspects_source',
+}
+
+# fields of the reviewed YAML that rules can be learned for
+LEARNABLE_FIELDS = {
+    'medium': 'medium',
+    'quantitykind': 'qk_ek',
+}
+
+
+def _value_tokens(value):
+    value = str(value).split(':')[-1]
+    value = re.sub(r"([a-z])([A-Z])", r"\1 \2", value)
+    return {token.lower() for token in re.findall(r"[A-Za-z]+", value)}
+
+
+def learn_lexicon(reviewed_dir, min_support=2):
+    """
+    Learn token rules from reviewed YAML files.
+
+    A rule token -> value is kept when the token also appears in the value's name
+    (e.g. Air -> s223:Fluid-Air), every reviewed class containing the token agrees
+    on the value, and at least `min_support` classes back it up.
+    """
+    observed = {field: defaultdict(lambda: defaultdict(int)) for field in LEARNABLE_FIELDS.values()}
+    for root, _, files in os.walk(reviewed_dir):
+        for file in files:
+            if not file.endswith('.yml'):
+                continue
+            keys = list(LEARNABLE_FIELDS) + [f'{key}_valid' for key in LEARNABLE_FIELDS]
+            for brick_class, entry in yaml_io.iter_entities(os.path.join(root, file), keys):
+                if not isinstance(entry, dict):
+                    continue
+                tokens = brick_class.split('_')
+                for yaml_key, field in LEARNABLE_FIELDS.items():
+                    value = entry.get(yaml_key)
+                    if not value or value == 'None' or entry.get(f'{yaml_key}_valid') is False:
+                        continue
+                    for token in tokens:
+                        observed[field][token][value] += 1
+    lexicon = {}
+    for field, tokens in observed.items():
+        for token, values in tokens.items():
+            if len(values) != 1:
+                continue
+            value, support = next(iter(values.items()))
+            if support >= min_support and token.lower() in _value_tokens(value):
+                lexicon.setdefault(field, {})[token] = value
+    return lexicon
+
+
+class PreClassifier:
+    """
+    Args:
+        lexicon (dict): field -> {token or phrase: value}; defaults to DEFAULT_LEXICON
+        reviewed_dir (str): Optional directory of reviewed YAML to learn extra rules from
+        prop_df, media_df, ek_df, qk_df, asp_df (DataFrame): Vocabularies (see get_s223_info);
+            rules whose value is not in the vocabulary are dropped. Without them the
+            vocabularies are loaded with get_s223_info; if that fails, every rule is
+            dropped, since none can be verified.
+    """
+
+    def __init__(self, lexicon=None, reviewed_dir=None, prop_df=None, media_df=None, ek_df=None, qk_df=None,
+                 asp_df=None):
+        merged = {field: dict(rules) for field, rules in (lexicon or DEFAULT_LEXICON).items()}
+        if reviewed_dir is not None:
+            for field, rules in learn_lexicon(reviewed_dir).items():
+                for token, value in rules.items():
+                    merged.setdefault(field, {}).setdefault(token, value)
+        if any(df is None for df in (prop_df, media_df, ek_df, qk_df, asp_df)):
+            try:
+                _, _, _, _, _, loaded_prop, loaded_media, loaded_asp, loaded_ek, loaded_qk = get_s223_info()
+            except (OSError, ValueError) as e:
+                logger.warning("Could not load the 223P vocabularies (%s); lexicon rules are not used", e)
+            else:
+                prop_df = loaded_prop if prop_df is None else prop_df
+                media_df = loaded_media if media_df is None else media_df
+                asp_df = loaded_asp if asp_df is None else asp_df
+                ek_df = loaded_ek if ek_df is None else ek_df
+                qk_df = loaded_qk if qk_df is None else qk_df
+        self.lexicon = self._restrict(merged, prop_df, media_df, ek_df, qk_df, asp_df)
+        allowed = set(prop_df['s223_class'].values) if prop_df is not None else set()
+        self.suffixes = {k: v for k, v in QUANTIFIABLE_SUFFIXES.items() if v in allowed}
+        self.decided = defaultdict(int)
+        self.classes = 0
+
+    @staticmethod
+    def _restrict(lexicon, prop_df, media_df, ek_df, qk_df, asp_df):
+        # a rule is kept only if its value is in the vocabulary of its field
+        allowed = defaultdict(set)
+        if prop_df is not None:
+            allowed['s223_class'] = set(prop_df['s223_class'].values)
+        if media_df is not None:
+            allowed['medium'] = set(media_df['s223_class'].values)
+        if qk_df is not None:
+            allowed['qk_ek'] |= set(qk_df['quantitykinds'].values)
+        if ek_df is not None:
+            allowed['qk_ek'] |= set(ek_df['s223_class'].values)
+        if asp_df is not None:
+            allowed['aspects'] = set(asp_df['s223_class'].values)
+        restricted = {}
+        for field, rules in lexicon.items():
+            restricted[field] = {token: value for token, value in rules.items() if value in allowed[field]}
+            dropped = sorted(set(rules) - set(restricted[field]))
+            if dropped:
+                logger.info("Dropped %s lexicon rules not in the 223P vocabulary: %s", field, ", ".join(dropped))
+        return restricted
+
+    def _match(self, tokens, rules):
+        # longest phrases first; a token consumed by a phrase is not matched again
+        values = set()
+        used = [False] * len(tokens)
+        for length in range(len(tokens), 0, -1):
+            for start in range(len(tokens) - length + 1):
+                if any(used[start:start + length]):
+                    continue
+                value = rules.get('_'.join(tokens[start:start + length]))
+                if value is not None:
+                    values.add(value)
+                    used[start:start + length] = [True] * length
+        return values
+
+    def classify(self, brick_class):
+        """
+        Decide the fields that follow unambiguously from the class name.
+
+        Returns:
+            dict: Raw results keyed like ai_complete_yaml.FIELDS, for the decided fields only
+        """
+        tokens = brick_class.split('_')
+        decided = {}
+        for field, rules in self.lexicon.items():
+            values = self._match(tokens, rules)
+            if len(values) == 1:
+                decided[field] = values.pop()
+        if 'qk_ek' in decided:
+            suffix = self.suffixes.get(tokens[-1])
+            if suffix:
+                decided['s223_class'] = suffix
+        self.classes += 1
+        for field in decided:
+            self.decided[field] += 1
+        return decided
+
+    def report(self):
+        return {'classes': self.classes, 'decided': dict(self.decided)}
+
+
+def mark_sources(definition_data, fields, source='lexicon'):
+    """Record which fields of a class entry were decided without the LLM."""
+    for field in fields:
+        definition_data[SOURCE_KEYS[field]] = source
@@ -0,0 +1,126 @@
+"""
+Local OpenAI-compatible chat completion server for testing and benchmarking
+the autocomplete stage without network access or API costs.
+
+Usage:
+    with StubLLMServer(latency=0.05, error_rate=0.1) as server:
+        client = openai.OpenAI(api_key="stub", base_url=server.base_url)
+        set_client(client)
+        ...
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def default_responder(messages):
+    # a fixed, always-valid-looking answer; replace with something smarter if needed
+    return "None"
+
+
+class StubLLMServer:
+    """
+    Threaded HTTP server answering POST /chat/completions (and /v1/chat/completions).
+
+    Args:
+        responder (callable): Maps the request's messages to the completion text
+        latency (float): Seconds to sleep before answering each request
+        error_rate (float): Fraction of requests answered with an error status
+        error_status (int): Status code used for injected errors (429 or 5xx)
+        seed (int): Seed for the error injection, for reproducible runs
+        host (str), port (int): Bind address; port 0 picks a free port
+    """
+
+    def __init__(self, responder=None, latency=0.0, error_rate=0.0, error_status=429,
+                 seed=0, host="127.0.0.1", port=0):
+        self.responder = responder or default_responder
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _should_fail(self):
+        with self._lock:
+            self.requests += 1
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+            return fail
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if server.latency:
+                    time.sleep(server.latency)
+                if server._should_fail():
+                    self._send(server.error_status, {"error": {"message": "injected error", "type": "stub_error"}})
+                    return
+                messages = request.get("messages", [])
+                content = server.responder(messages)
+                prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in messages)
+                completion_tokens = len(content) // 4
+                self._send(200, {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "stub"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                })
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
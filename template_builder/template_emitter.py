@@ -0,0 +1,102 @@
+"""
+Direct Turtle emitter for entity templates.
+
+create_template_for_entity used to build an rdflib Graph, bind ~18 prefixes,
+add 3-6 triples and run the Turtle serializer for every entity. The emitter
+renders the same text straight from the YAML mapping record: it keeps a
+precomputed prefix header per namespace, writes only the prefixes that are
+used, and lays out the `P:name a ... ;` body the way rdflib's Turtle
+serializer does, so the output is byte-for-byte identical.
+"""
+
+import re
+
+from rdflib import Graph
+from rdflib.compare import isomorphic
+
+from .namespaces import S223, QUDT, QK, PARAM, bind_prefixes
+
+# local names that are safe to write as prefixed names; anything else is left to rdflib
+_SAFE_LOCAL = re.compile(r"^[A-Za-z_](?:[A-Za-z0-9_.-]*[A-Za-z0-9_-])?$")
+
+
+def _prefix_table():
+    # ask rdflib which prefix bind_prefixes ends up using for each namespace
+    g = Graph()
+    bind_prefixes(g)
+    prefixes = {str(namespace): prefix for prefix, namespace in g.namespace_manager.namespaces()}
+    return {
+        namespace: (prefixes[str(namespace)], f"@prefix {prefixes[str(namespace)]}: <{namespace}> .\n")
+        for namespace in (S223, QUDT, QK, PARAM)
+    }
+
+
+PREFIXES = _prefix_table()
+
+
+def _pname(namespace, local):
+    return f"{PREFIXES[namespace][0]}:{local}"
+
+
+def _local(value):
+    local = value.split(':')[-1]
+    if not _SAFE_LOCAL.match(local):
+        raise ValueError(f"Cannot emit local name {local!r} directly")
+    return local
+
+
+def emit_template(entity_data):
+    """
+    Render the Turtle template for one entity's YAML mapping.
+
+    Raises:
+        ValueError: If a value cannot be written as a prefixed name; callers fall back to rdflib
+    """
+    used = {PARAM}
+    types = []
+    properties = {}
+
+    def add(predicate, namespace, local):
+        used.add(predicate[0])
+        used.add(namespace)
+        properties.setdefault(predicate, set()).add((str(namespace) + local, _pname(namespace, local)))
+
+    s223_class = entity_data.get('s223_class')
+    if s223_class:
+        local = _local(s223_class)
+        used.add(S223)
+        types.append(_pname(S223, local))
+    if entity_data.get('quantitykind'):
+        add((QUDT, 'hasQuantityKind'), QK, _local(entity_data.get('quantitykind')))
+    if entity_data.get('enumerationkind'):
+        add((S223, 'hasEnumerationKind'), S223, _local(entity_data.get('enumerationkind')))
+    if entity_data.get('medium') and entity_data.get('medium') != 'None':
+        add((S223, 'ofMedium'), S223, _local(entity_data.get('medium')))
+    if entity_data.get('aspects') and entity_data.get('aspects') != 'None':
+        for aspect in entity_data.get('aspects').split(','):
+            aspect = aspect.strip()
+            if aspect:
+                add((S223, 'hasAspect'), S223, _local(aspect))
+
+    # rdflib writes rdf:type first, then predicates and objects sorted by full URI
+    predicate_list = []
+    if types:
+        predicate_list.append(f"a {types[0]}")
+    for namespace, local in sorted(properties, key=lambda p: str(p[0]) + p[1]):
+        objects = [pname for _, pname in sorted(properties[(namespace, local)])]
+        if len(objects) == 1:
+            predicate_list.append(f"{_pname(namespace, local)} {objects[0]}")
+        else:
+            predicate_list.append(f"{_pname(namespace, local)} " + ",\n        ".join(objects))
+
+    if not predicate_list:
+        # nothing but the entity itself: rdflib writes an empty document
+        return "\n"
+    header = "".join(PREFIXES[namespace][1] for namespace in sorted(used, key=lambda n: PREFIXES[n][0]))
+    body = " ;\n    ".join(predicate_list)
+    return f"{header}\n{_pname(PARAM, 'name')} {body} .\n\n"
+
+
+def verify_template(text, reference):
+    """True if two Turtle documents describe isomorphic graphs."""
+    return isomorphic(Graph().parse(data=text, format="turtle"), Graph().parse(data=reference, format="turtle"))
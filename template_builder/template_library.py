@@ -0,0 +1,233 @@
+"""
+Single-file template library.
+
+An alternative to the nested s223_templates/ directory layout: every template
+goes into one SQLite file, with an index by Brick class and by parent (the
+class the template file is named after). A library is written in a single
+transaction and read back in a single query, and converts losslessly to and
+from the directory layout.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+from . import yaml_io
+from .yaml_io import FoldedString
+from .create_223_templates import build_fingerprint, render_files, template_entries, yaml_files
+from .instrumentation import stage, count
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_FORMAT = 1
+
+SCHEMA = """
+CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE files (file TEXT PRIMARY KEY);
+CREATE TABLE templates (
+    file TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    body TEXT,
+    extra TEXT,
+    PRIMARY KEY (file, name)
+);
+CREATE INDEX templates_name ON templates (name);
+CREATE INDEX templates_parent ON templates (parent);
+"""
+
+
+def _parent_of(rel_file):
+    # template files are named after the parent class of the templates they hold
+    return os.path.splitext(os.path.basename(rel_file))[0]
+
+
+def _row(rel_file, position, name, entry):
+    extra = {key: value for key, value in entry.items() if key != 'body'}
+    body = entry.get('body')
+    return (rel_file, position, name, _parent_of(rel_file), None if body is None else str(body),
+            json.dumps(extra) if extra else None)
+
+
+def _entry(body, extra):
+    entry = {} if body is None else {'body': FoldedString(body)}
+    if extra:
+        entry.update(json.loads(extra))
+    return entry
+
+
+def write_library(library_path, files, metadata=None):
+    """
+    Write a library in one transaction; the file is replaced atomically.
+
+    Args:
+        library_path (str): SQLite file to write
+        files (iterable): (relative template file, [(name, entry dict), ...]) pairs
+        metadata (dict): Extra metadata to store (e.g. the generator fingerprint)
+
+    Returns:
+        int: Number of templates written
+    """
+    tmp_path = f"{library_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    directory = os.path.dirname(library_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(tmp_path)
+    written = 0
+    try:
+        connection.executescript(SCHEMA)
+        with connection:
+            for rel_file, entities in files:
+                connection.execute("INSERT INTO files VALUES (?)", (rel_file,))
+                rows = [_row(rel_file, position, name, entry) for position, (name, entry) in enumerate(entities)]
+                connection.executemany("INSERT INTO templates VALUES (?, ?, ?, ?, ?, ?)", rows)
+                written += len(rows)
+            info = {'format': LIBRARY_FORMAT, 'created': datetime.now(timezone.utc).isoformat()}
+            info.update(metadata or {})
+            connection.executemany("INSERT INTO metadata VALUES (?, ?)", [(k, json.dumps(v)) for k, v in info.items()])
+    finally:
+        connection.close()
+    os.replace(tmp_path, library_path)
+    count('files_written')
+    return written
+
+
+def _connect(library_path):
+    if not os.path.exists(library_path):
+        raise FileNotFoundError(f"No template library at {library_path}")
+    connection = sqlite3.connect(f"file:{library_path}?mode=ro", uri=True)
+    format = connection.execute("SELECT value FROM metadata WHERE key = 'format'").fetchone()
+    if format is None or json.loads(format[0]) != LIBRARY_FORMAT:
+        connection.close()
+        raise ValueError(f"{library_path} is not a format {LIBRARY_FORMAT} template library")
+    return connection
+
+
+def read_library(library_path):
+    """
+    Read a whole library in one pass.
+
+    Returns:
+        list: (relative template file, [(name, entry dict), ...]) pairs in file order
+    """
+    connection = _connect(library_path)
+    try:
+        # files whose entities all failed to render are kept, like the directory layout keeps them
+        files = {rel_file: [] for rel_file, in connection.execute("SELECT file FROM files ORDER BY file")}
+        for rel_file, name, body, extra in connection.execute(
+                "SELECT file, name, body, extra FROM templates ORDER BY file, position"):
+            files[rel_file].append((name, _entry(body, extra)))
+    finally:
+        connection.close()
+    return list(files.items())
+
+
+def library_metadata(library_path):
+    connection = _connect(library_path)
+    try:
+        return {key: json.loads(value) for key, value in connection.execute("SELECT key, value FROM metadata")}
+    finally:
+        connection.close()
+
+
+def lookup_templates(library_path, names=None, parent=None):
+    """
+    Look up templates through the library's indexes.
+
+    Args:
+        names (iterable): Brick class names to fetch
+        parent (str): Fetch every template in the file named after this parent class
+
+    Returns:
+        dict: name -> entry dict. A class listed under several parents resolves
+            to its first entry in file order.
+    """
+    connection = _connect(library_path)
+    try:
+        if parent is not None:
+            rows = connection.execute(
+                "SELECT name, body, extra FROM templates WHERE parent = ? ORDER BY file, position", (parent,))
+        else:
+            names = list(names or [])
+            rows = []
+            # stay below SQLite's limit on bound parameters
+            for start in range(0, len(names), 500):
+                chunk = names[start:start + 500]
+                rows.extend(connection.execute(
+                    f"SELECT name, body, extra FROM templates WHERE name IN ({','.join('?' * len(chunk))}) "
+                    "ORDER BY file, position", chunk))
+        found = {}
+        for name, body, extra in rows:
+            found.setdefault(name, _entry(body, extra))
+        return found
+    finally:
+        connection.close()
+
+
+def directory_to_library(template_dir, library_path):
+    """
+    Convert an s223_templates/ directory into a library.
+
+    Returns:
+        int: Number of templates written
+    """
+    files = []
+    for root, dirs, names in os.walk(template_dir):
+        dirs.sort()
+        for file in sorted(names):
+            if file.endswith('.yml'):
+                path = os.path.join(root, file)
+                files.append((os.path.relpath(path, template_dir), list(yaml_io.iter_entities(path))))
+    return write_library(library_path, files, {'source': 'directory'})
+
+
+def library_to_directory(library_path, output_dir):
+    """
+    Write a library back out as the nested directory layout, byte-identical to
+    the layout process_directory writes.
+
+    Returns:
+        int: Number of template files written
+    """
+    files = read_library(library_path)
+    for rel_file, entities in files:
+        output_path = os.path.join(output_dir, rel_file)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with stage('yaml_write'):
+            yaml_io.dump_entities(output_path, entities)
+        count('files_written')
+    return len(files)
+
+
+def process_directory_to_library(input_dir, library_path, workers=1, chunk_size=200, verify=False):
+    """
+    Render every Brick YAML file under input_dir straight into a library,
+    instead of a directory tree (see create_223_templates.process_directory).
+
+    Args:
+        input_dir: Path to the directory containing YAML files
+        library_path: SQLite file to write
+        workers: Number of worker processes; None uses every core
+        chunk_size: Maximum entities per worker task
+        verify: Check every emitted template against the rdflib path
+
+    Returns:
+        dict: Counts of files and templates written, and the per-entity errors
+    """
+    todo = list(yaml_files(input_dir))
+    rendered_files = render_files([yaml_path for yaml_path, _ in todo], workers, chunk_size, verify)
+    errors = []
+    library_files = []
+    for (yaml_path, rel_path), rendered in zip(todo, rendered_files):
+        entities = list(template_entries(yaml_path, rendered, errors))
+        if rendered:
+            library_files.append((rel_path, entities))
+    written = write_library(library_path, library_files, {'fingerprint': build_fingerprint(), 'source': input_dir})
+    count('templates_written', written)
+    logger.info("Template library %s: %d files, %d templates, %d errors", library_path, len(library_files), written, len(errors))
+    return {'files': len(library_files), 'templates': written, 'errors': errors}
@@ -0,0 +1,278 @@
+"""
+Lookup of s223 templates by Brick class.
+
+Templates live in parent-named files of the s223_templates/ tree, so finding the
+template of one class means knowing its parent or parsing the whole tree. The
+registry keeps a persistent index (`.template_index.json` in the template
+directory) from every class to the file and byte range of its entry. Only files
+that changed since the index was written are rescanned, entries are parsed when
+first requested, and parsed rdflib graphs are kept in an LRU cache.
+"""
+
+import json
+import logging
+import os
+from collections import OrderedDict
+
+import yaml
+from rdflib import Graph
+from yaml.events import MappingEndEvent, MappingStartEvent, ScalarEvent
+
+from . import yaml_io
+from .create_yaml_brick import ClassIndex, strip_namespace
+from .instrumentation import stage
+from .namespaces import BRICK, PARAM
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = ".template_index.json"
+INDEX_VERSION = 1
+
+
+def class_name(brick_class):
+    """Template name of a class given as a name, 'brick:Name' or a full URI."""
+    if '#' in brick_class:
+        return brick_class.rsplit('#', 1)[1]
+    return strip_namespace(brick_class)
+
+
+def scan_template_file(path):
+    """
+    Locate the entries of a template file.
+
+    Returns:
+        list: [name, byte offset, byte length] of every top-level entry, in file order
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    text = data.decode('utf-8')
+    ascii_only = len(text) == len(data)
+    loader = yaml_io.Loader(text)
+    starts = []
+    try:
+        loader.get_event()  # StreamStart
+        if loader.check_event(yaml.StreamEndEvent):
+            return []
+        loader.get_event()  # DocumentStart
+        if not loader.check_event(MappingStartEvent):
+            return []
+        loader.get_event()
+        while not loader.check_event(MappingEndEvent):
+            event = loader.get_event()
+            if not isinstance(event, ScalarEvent):
+                raise ValueError(f"{path}: template names must be scalars")
+            starts.append((event.value, event.start_mark.index))
+            yaml_io._skip(loader, loader.get_event())
+        end = loader.get_event().start_mark.index
+    finally:
+        loader.dispose()
+
+    # marks count characters; the index stores byte offsets so entries can be read with a seek
+    bounds = [index for _, index in starts] + [end]
+    if not ascii_only:
+        offsets = [0]
+        for start, stop in zip([0] + bounds, bounds):
+            offsets.append(offsets[-1] + len(text[start:stop].encode('utf-8')))
+        bounds = offsets[1:]
+    return [[name, start, stop - start] for (name, _), start, stop in zip(starts, bounds, bounds[1:])]
+
+
+class TemplateRegistry:
+    """
+    Lazy, indexed access to an s223_templates/ directory.
+
+    Args:
+        template_dir (str): Root of the template tree (the output of process_directory)
+        graph (rdflib.Graph): Optional Brick ontology; gives the ancestors of classes
+            that are not in the tree, and of the tree's root classes
+        cache_size (int): Number of parsed rdflib graphs kept in the LRU cache
+        persist (bool): Save the index in the template directory so later
+            registries only rescan changed files
+    """
+
+    def __init__(self, template_dir, graph=None, cache_size=256, persist=True):
+        self.template_dir = template_dir
+        self.cache_size = cache_size
+        self.persist = persist
+        self._graph = graph
+        self._class_index = None
+        self._graphs = OrderedDict()
+        self._entries = {}
+        self.reindex()
+
+    def reindex(self):
+        """Bring the index up to date with the files on disk."""
+        index_path = os.path.join(self.template_dir, INDEX_FILE)
+        previous = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r') as f:
+                    saved = json.load(f)
+                if saved.get('version') == INDEX_VERSION:
+                    previous = saved['files']
+            except ValueError:
+                logger.warning("Ignoring unreadable template index %s", index_path)
+        files = {}
+        rescanned = 0
+        with stage('index_templates'):
+            for root, dirs, names in os.walk(self.template_dir):
+                dirs.sort()
+                for name in sorted(names):
+                    if not name.endswith('.yml'):
+                        continue
+                    path = os.path.join(root, name)
+                    rel_path = os.path.relpath(path, self.template_dir)
+                    info = os.stat(path)
+                    entry = previous.get(rel_path)
+                    if entry is None or entry['mtime_ns'] != info.st_mtime_ns or entry['size'] != info.st_size:
+                        entry = {'mtime_ns': info.st_mtime_ns, 'size': info.st_size,
+                                 'entries': scan_template_file(path)}
+                        rescanned += 1
+                    files[rel_path] = entry
+        if self.persist and (rescanned or files.keys() != previous.keys()):
+            tmp_path = f"{index_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'files': files}, f)
+            os.replace(tmp_path, index_path)
+        logger.info("Template index: %d files, %d rescanned", len(files), rescanned)
+
+        self.files = files
+        self.locations = {}
+        for rel_path, entry in files.items():
+            for name, offset, length in entry['entries']:
+                self.locations.setdefault(name, []).append((rel_path, offset, length))
+        self._entries.clear()
+        self._graphs.clear()
+
+    def __contains__(self, brick_class):
+        return class_name(brick_class) in self.locations
+
+    def __len__(self):
+        return len(self.locations)
+
+    def classes(self):
+        return list(self.locations)
+
+    def files_of(self, brick_class):
+        """Template files a class is listed in (more than one for classes with several parents)."""
+        return [rel_path for rel_path, _, _ in self.locations.get(class_name(brick_class), [])]
+
+    def _read(self, f, brick_class, offset, length):
+        f.seek(offset)
+        data = yaml.load(f.read(length), Loader=yaml_io.Loader) or {}
+        return data.get(brick_class, {})
+
+    def get(self, brick_class, default=None):
+        """
+        The template entry (body and optional dependencies) of a class.
+
+        A class listed under several parents resolves to its first entry in the tree.
+        """
+        return self.get_many([brick_class]).get(class_name(brick_class), default)
+
+    def get_many(self, brick_classes):
+        """
+        Template entries of several classes, reading each file at most once.
+
+        Returns:
+            dict: class name -> entry, for the classes that have a template
+        """
+        found = {}
+        by_file = {}
+        for brick_class in brick_classes:
+            name = class_name(brick_class)
+            if name in self._entries:
+                found[name] = self._entries[name]
+            elif name in self.locations:
+                rel_path, offset, length = self.locations[name][0]
+                by_file.setdefault(rel_path, []).append((offset, length, name))
+        with stage('yaml_read'):
+            for rel_path, wanted in by_file.items():
+                with open(os.path.join(self.template_dir, rel_path), 'rb') as f:
+                    for offset, length, name in sorted(wanted):
+                        found[name] = self._entries[name] = self._read(f, name, offset, length)
+        return found
+
+    def graph(self, brick_class):
+        """
+        The parsed template body of a class, or None if it has no template.
+
+        Bodies of dependencies found in the registry (e.g. the base templates of a
+        deduplicated tree) are merged in, with their parameters renamed by `args`.
+        Graphs are shared through the LRU cache; copy one before changing it.
+        """
+        name = class_name(brick_class)
+        if name in self._graphs:
+            self._graphs.move_to_end(name)
+            return self._graphs[name]
+        entry = self.get(name)
+        if not entry or 'body' not in entry:
+            return None
+        graph = Graph()
+        with stage('parse_template'):
+            graph.parse(data=entry['body'], format='turtle')
+        for dependency in entry.get('dependencies') or []:
+            dependency_graph = self.graph(dependency['template']) if dependency.get('template') in self else None
+            if dependency_graph is None:
+                continue
+            rename = {PARAM[key]: PARAM[value] for key, value in (dependency.get('args') or {}).items()}
+            graph.addN((rename.get(s, s), rename.get(p, p), rename.get(o, o), graph)
+                       for s, p, o in dependency_graph)
+        self._graphs[name] = graph
+        if len(self._graphs) > self.cache_size:
+            self._graphs.popitem(last=False)
+        return graph
+
+    def ancestors(self, brick_class):
+        """
+        Brick ancestors of a class, nearest first.
+
+        Parents come from the directories the class's template files sit in; above
+        the tree's root classes, or for classes with no template, they come from
+        the Brick graph if one was given.
+        """
+        name = class_name(brick_class)
+        ancestors = []
+        for rel_path in self.files_of(name):
+            parts = os.path.dirname(rel_path).split(os.sep) if os.path.dirname(rel_path) else []
+            for parent in reversed(parts):
+                if parent not in ancestors:
+                    ancestors.append(parent)
+        if self._graph is not None:
+            frontier = [ancestors[-1]] if ancestors else [name]
+            for parent in self._graph_ancestors(frontier):
+                if parent not in ancestors and parent != name:
+                    ancestors.append(parent)
+        return ancestors
+
+    def _graph_ancestors(self, names):
+        if self._class_index is None:
+            self._class_index = ClassIndex(self._graph)
+        parents = self._class_index.parents
+        seen = set()
+        queue = [BRICK[name] for name in names]
+        ancestors = []
+        while queue:
+            next_queue = []
+            for uri in queue:
+                for parent in sorted(parents.get(uri, ())):
+                    if parent not in seen and parent.startswith(str(BRICK)):
+                        seen.add(parent)
+                        ancestors.append(class_name(parent))
+                        next_queue.append(parent)
+            queue = next_queue
+        return ancestors
+
+    def resolve(self, brick_class):
+        """
+        The template for a class, falling back to its nearest ancestor that has one.
+
+        Returns:
+            tuple: (class name the template belongs to, entry), or (None, None)
+        """
+        name = class_name(brick_class)
+        for candidate in [name] + self.ancestors(name):
+            entry = self.get(candidate)
+            if entry is not None:
+                return candidate, entry
+        return None, None
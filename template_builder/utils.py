@@ -1,7 +1,14 @@
 from buildingmotif.namespaces import * 
+import re
+import weakref
 from rdflib import Graph, URIRef, Literal
+from rdflib.store import TripleAddedEvent, TripleRemovedEvent
 import pandas as pd
 from typing import Optional
+import logging
+from .instrumentation import stage, count
+
+logger = logging.getLogger(__name__)
 
 
 def get_prefixes(g: Graph):
@@ -12,52 +19,274 @@ def convert_to_prefixed(uri, g: Graph):
         prefix, uri_ref, local_name = g.compute_qname(uri)
         return f"{prefix}:{local_name}"
     except Exception as e:
-        print(e)
+        logger.debug("Could not shorten %s: %s", uri, e)
         return uri
 
-def query_to_df(query, g: Graph, remove_prefixes=False):
-    results = g.query(query)
-    formatted_results = [
-        [convert_to_prefixed(value, g) if isinstance(value, (str, bytes)) and value.startswith("http") else str(value) for value in row]
-        for row in results
-    ]
-    df = pd.DataFrame(formatted_results, columns=[str(var) for var in results.vars])
-    return df
+def format_value(value, g: Graph):
+    # URIs are shortened to prefixed names, everything else becomes a plain string
+    if isinstance(value, (str, bytes)) and value.startswith("http"):
+        return convert_to_prefixed(value, g)
+    return str(value)
+
+# local names the fast path writes itself; anything else goes through compute_qname
+_SAFE_LOCAL_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_\-]*")
+
+QUERY_OUTPUTS = ('dataframe', 'tuples', 'columns')
+
+
+class ResultConverter:
+    """
+    Formats query result values the way format_value does, for many values.
+
+    URIs are shortened with a table of the graph's bound namespaces, longest
+    namespace first, and every value's result is memoized. URIs the table cannot
+    shorten to a plain local name fall back to convert_to_prefixed, so results
+    match format_value.
+
+    Only a weak reference to the graph is kept, so a cached converter does not
+    keep its graph alive.
+
+    Args:
+        g (Graph): Graph whose namespace bindings are used
+    """
+
+    def __init__(self, g):
+        self._graph = weakref.ref(g)
+        self.namespaces = tuple(g.namespace_manager.namespaces())
+        self._table = sorted(((str(namespace), prefix) for prefix, namespace in self.namespaces),
+                             key=lambda item: -len(item[0]))
+        self._memo = {}
+
+    @property
+    def graph(self):
+        return self._graph()
+
+    def is_current(self):
+        return tuple(self.graph.namespace_manager.namespaces()) == self.namespaces
+
+    def _shorten(self, uri):
+        for namespace, prefix in self._table:
+            if uri.startswith(namespace):
+                local_name = uri[len(namespace):]
+                if _SAFE_LOCAL_NAME.fullmatch(local_name):
+                    return f"{prefix}:{local_name}"
+                break
+        return convert_to_prefixed(uri, self.graph)
+
+    def value(self, value):
+        """format_value(value, g), memoized."""
+        try:
+            return self._memo[value]
+        except KeyError:
+            pass
+        except TypeError:
+            return format_value(value, self.graph)
+        if isinstance(value, (str, bytes)) and value.startswith("http"):
+            formatted = self._shorten(value) if isinstance(value, str) else convert_to_prefixed(value, self.graph)
+        else:
+            formatted = str(value)
+        self._memo[value] = formatted
+        return formatted
+
+    def columns(self, results, names):
+        """Result rows as one list of formatted values per column."""
+        columns = [[] for _ in names]
+        value = self.value
+        for row in results:
+            for column, cell in zip(columns, row):
+                column.append(value(cell))
+        return dict(zip(names, columns))
+
+
+# keyed by id(): graphs compare and hash by their identifier, which distinct graphs may share
+_converters = {}
+
+def result_converter(g: Graph):
+    """The ResultConverter of a graph, rebuilt when its namespace bindings change."""
+    converter = _converters.get(id(g))
+    if converter is None:
+        # dropped with the graph, so neither the graph nor the memo outlive it
+        weakref.finalize(g, _converters.pop, id(g), None)
+    if converter is None or not converter.is_current():
+        converter = _converters[id(g)] = ResultConverter(g)
+    return converter
+
+def query_to_df(query, g: Graph, remove_prefixes=False, output='dataframe'):
+    """
+    Run a SPARQL query and format its values with format_value.
+
+    Args:
+        output (str): 'dataframe', 'tuples' (a list of row tuples) or 'columns'
+            (a dict of column name -> list of values)
+    """
+    if output not in QUERY_OUTPUTS:
+        raise ValueError(f"Unknown output '{output}', expected one of {QUERY_OUTPUTS}")
+    count('sparql_queries')
+    with stage('sparql'):
+        results = g.query(query)
+        names = [str(var) for var in results.vars]
+        columns = result_converter(g).columns(results, names)
+    if output == 'columns':
+        return columns
+    if output == 'tuples':
+        return list(zip(*columns.values())) if names else []
+    return pd.DataFrame(columns, columns=names)
+
+# Brick relationships and their inverses
+INVERSE_PAIRS = {
+    BRICK.isFedBy: BRICK.feeds,
+    BRICK.feeds: BRICK.isFedBy,
+    BRICK.hasPart: BRICK.isPartOf,
+    BRICK.isPartOf: BRICK.hasPart,
+    BRICK.hasPoint: BRICK.isPointOf,
+    BRICK.isPointOf: BRICK.hasPoint,
+    BRICK.hasLocation: BRICK.isLocationOf,
+    BRICK.isLocationOf: BRICK.hasLocation,
+    BRICK.controls: BRICK.isControlledBy,
+    BRICK.isControlledBy: BRICK.controls,
+    BRICK.affects: BRICK.isAffectedBy,
+    BRICK.isAffectedBy: BRICK.affects,
+    BRICK.hasInput: BRICK.isInputOf,
+    BRICK.isInputOf: BRICK.hasInput,
+    BRICK.hasOutput: BRICK.isOutputOf,
+    BRICK.isOutputOf: BRICK.hasOutput,
+    BRICK.measures: BRICK.isMeasuredBy,
+    BRICK.isMeasuredBy: BRICK.measures,
+    BRICK.regulates: BRICK.isRegulatedBy,
+    BRICK.isRegulatedBy: BRICK.regulates,
+    BRICK.hasSubject: BRICK.isSubjectOf,
+    BRICK.isSubjectOf: BRICK.hasSubject
+}
+
+def materialize_inverse_relations(g, triples=None):
+    """
+    Add the missing inverses of Brick relationships to g with a single addN.
+
+    Args:
+        g (Graph): Graph to complete
+        triples (iterable): Relationship triples to invert; by default every
+            triple of the INVERSE_PAIRS predicates, found through the predicate index
+
+    Returns:
+        int: Number of triples added
+    """
+    if triples is None:
+        triples = (triple for p in INVERSE_PAIRS for triple in g.triples((None, p, None)))
+    with stage('inverse_relations'):
+        # collected before anything is added, so no index is changed while it is read
+        inverses = {(o, INVERSE_PAIRS[p], s) for s, p, o in triples
+                    if p in INVERSE_PAIRS and not isinstance(o, Literal)}
+        missing = [(s, p, o, g) for s, p, o in inverses if (s, p, o) not in g]
+        g.addN(missing)
+    count('inverse_triples', len(missing))
+    return len(missing)
 
 def add_brick_inverse_relations(g):
-    # Dictionary of relationships and their inverses
-    inverse_pairs = {
-        BRICK.isFedBy: BRICK.feeds,
-        BRICK.feeds: BRICK.isFedBy,
-        BRICK.hasPart: BRICK.isPartOf,
-        BRICK.isPartOf: BRICK.hasPart,
-        BRICK.hasPoint: BRICK.isPointOf,
-        BRICK.isPointOf: BRICK.hasPoint,
-        BRICK.hasLocation: BRICK.isLocationOf,
-        BRICK.isLocationOf: BRICK.hasLocation,
-        BRICK.controls: BRICK.isControlledBy,
-        BRICK.isControlledBy: BRICK.controls,
-        BRICK.affects: BRICK.isAffectedBy,
-        BRICK.isAffectedBy: BRICK.affects,
-        BRICK.hasInput: BRICK.isInputOf,
-        BRICK.isInputOf: BRICK.hasInput,
-        BRICK.hasOutput: BRICK.isOutputOf,
-        BRICK.isOutputOf: BRICK.hasOutput,
-        BRICK.measures: BRICK.isMeasuredBy,
-        BRICK.isMeasuredBy: BRICK.measures,
-        BRICK.regulates: BRICK.isRegulatedBy,
-        BRICK.isRegulatedBy: BRICK.regulates,
-        BRICK.hasSubject: BRICK.isSubjectOf,
-        BRICK.isSubjectOf: BRICK.hasSubject
-    }
     # For each relationship in the graph, add its inverse
-    for s, p, o in g:
-        if p in inverse_pairs:
-            g.add((o, inverse_pairs[p], s))
-
+    added = materialize_inverse_relations(g)
+    logger.debug("Added %d inverse relations", added)
     return g
 
 
+class InverseMaterializer:
+    """
+    Keeps the inverse relations of a graph materialized as it grows.
+
+    The first `materialize` call completes the whole graph; later calls only
+    invert the relationship triples added since the previous call, which the
+    materializer learns of through the store's events. Calling it again without
+    changes adds nothing.
+
+    Args:
+        g (Graph): Graph to keep complete; its store must dispatch triple events
+            (rdflib's in-memory store does)
+    """
+
+    def __init__(self, g):
+        self.graph = g
+        self.pending = []
+        self._initialized = False
+        self._paused = False
+        g.store.dispatcher.subscribe(TripleAddedEvent, self._on_added)
+        # once a map exists every dispatched event type needs a subscriber
+        g.store.dispatcher.subscribe(TripleRemovedEvent, self._on_removed)
+
+    def _on_added(self, event):
+        if not self._paused and event.triple[1] in INVERSE_PAIRS:
+            self.pending.append(event.triple)
+
+    def _on_removed(self, event):
+        pass
+
+    def materialize(self):
+        """
+        Returns:
+            int: Number of inverse triples added
+        """
+        if self._initialized:
+            # triples removed again since they were added are not inverted
+            triples = [triple for triple in self.pending if triple in self.graph]
+        else:
+            triples = None
+        self.pending = []
+        self._paused = True
+        try:
+            added = materialize_inverse_relations(self.graph, triples)
+        finally:
+            self._paused = False
+        self._initialized = True
+        return added
+
+    def close(self):
+        """Stop following the graph."""
+        # rdflib's Dispatcher has no unsubscribe
+        dispatch_map = self.graph.store.dispatcher.get_map()
+        dispatch_map[TripleAddedEvent].remove(self._on_added)
+        dispatch_map[TripleRemovedEvent].remove(self._on_removed)
+
+
+class InverseView:
+    """
+    Read-only view of a graph that answers lookups of inverse Brick relations
+    without materializing them.
+
+    A pattern on one of the INVERSE_PAIRS predicates matches the asserted triples
+    and the turned-around triples of its inverse predicate; other patterns go
+    straight to the graph.
+
+    Args:
+        g (Graph): The underlying graph
+    """
+
+    def __init__(self, g):
+        self.graph = g
+
+    def triples(self, pattern):
+        s, p, o = pattern
+        if p not in INVERSE_PAIRS:
+            yield from self.graph.triples(pattern)
+            return
+        seen = set()
+        for triple in self.graph.triples(pattern):
+            seen.add(triple)
+            yield triple
+        for inverse_s, _, inverse_o in self.graph.triples((o, INVERSE_PAIRS[p], s)):
+            triple = (inverse_o, p, inverse_s)
+            if triple not in seen and not isinstance(inverse_o, Literal):
+                yield triple
+
+    def __contains__(self, triple):
+        return next(self.triples(triple), None) is not None
+
+    def objects(self, subject=None, predicate=None):
+        for _, _, o in self.triples((subject, predicate, None)):
+            yield o
+
+    def subjects(self, predicate=None, object=None):
+        for s, _, _ in self.triples((None, predicate, object)):
+            yield s
+
+
 def get_unique_uri(graph, uri):
     base_uri = str(uri)
     count = 1
@@ -69,21 +298,138 @@ def get_unique_uri(graph, uri):
         count += 1
     return new_uri
 
-def get_uri_name(graph, uri):
+
+class UriAllocator:
+    """
+    Mints unique URIs for a graph without searching the graph for every candidate.
+
+    The URIs used as subject or object are indexed once. Candidates follow
+    get_unique_uri (`base`, `base-1`, `base-2`, ...), but each base name keeps a
+    counter so the suffixes already taken are never tried again, which keeps bulk
+    minting linear. Allocated URIs are reserved right away, even before any triple
+    uses them.
+
+    The index stays correct while the graph is only changed through `add` and
+    `addN`; call `refresh` after changing it any other way. A following allocator
+    (see uri_allocator) indexes triples added in any way through the store's
+    events, and rebuilds its index before the next allocation when the graph has
+    shrunk (rdflib's in-memory store dispatches no removal events).
+
+    Args:
+        graph (Graph): The graph the URIs are minted for
+        follow (bool): Follow the graph's store events
+    """
+
+    def __init__(self, graph, follow=False):
+        self.graph = graph
+        self._names = {}
+        self.follow = follow
+        self.excluded = set()
+        self.refresh()
+        if follow:
+            graph.store.dispatcher.subscribe(TripleAddedEvent, self._on_added)
+            # once a map exists every dispatched event type needs a subscriber
+            graph.store.dispatcher.subscribe(TripleRemovedEvent, self._on_removed)
+
+    def _on_added(self, event):
+        # dispatched before the store adds the triple, so repeated triples can be told apart
+        if event.triple not in self.graph:
+            self._size += 1
+        s, _, o = event.triple
+        self.used.add(s)
+        self.used.add(o)
+
+    def _on_removed(self, event):
+        pass
+
+    def refresh(self):
+        """Rebuild the index from the graph."""
+        self.used = set(self.excluded)
+        for s, _, o in self.graph:
+            self.used.add(s)
+            self.used.add(o)
+        self.counters = {}
+        self._size = len(self.graph)
+
+    def allocate(self, uri):
+        """The first free URI for `uri`, reserved for the caller."""
+        if self.follow and len(self.graph) != self._size:
+            # triples were removed; the names they used may be free again
+            self.refresh()
+        base_uri = str(uri)
+        new_uri = URIRef(base_uri)
+        if new_uri in self.used:
+            suffix = self.counters.get(base_uri, 1)
+            new_uri = URIRef(f"{base_uri}-{suffix}")
+            while new_uri in self.used:
+                suffix += 1
+                new_uri = URIRef(f"{base_uri}-{suffix}")
+            self.counters[base_uri] = suffix + 1
+        self.used.add(new_uri)
+        return new_uri
+
+    def reserve(self, uris):
+        """Allocate a batch of URIs; repeated bases get distinct suffixes."""
+        return [self.allocate(uri) for uri in uris]
+
+    def exclude(self, uris):
+        """Never hand out these URIs, e.g. names taken outside the graph; kept across refresh."""
+        self.excluded.update(uris)
+        self.used.update(uris)
+
+    def add(self, triple):
+        s, _, o = triple
+        self.used.add(s)
+        self.used.add(o)
+        self.graph.add(triple)
+
+    def addN(self, quads):
+        """Add (s, p, o, graph) quads to the graph in one call."""
+        quads = list(quads)
+        for s, _, o, _ in quads:
+            self.used.add(s)
+            self.used.add(o)
+        self.graph.addN(quads)
+
+    def name(self, uri):
+        """The local name of a URI, as get_uri_name computes it, memoized."""
+        if uri not in self._names:
+            self._names[uri] = self.graph.compute_qname(uri)[-1]
+        return self._names[uri]
+
+
+# keyed by id(): graphs compare and hash by their identifier, which distinct graphs may share.
+# The store's dispatcher keeps a following allocator alive as long as its graph.
+_allocators = {}
+
+def uri_allocator(graph):
+    """The following UriAllocator of a graph, created on first use."""
+    allocator = _allocators.get(id(graph))
+    allocator = allocator() if allocator is not None else None
+    if allocator is None or allocator.graph is not graph:
+        if allocator is None:
+            weakref.finalize(graph, _allocators.pop, id(graph), None)
+        allocator = UriAllocator(graph, follow=True)
+        _allocators[id(graph)] = weakref.ref(allocator)
+    return allocator
+
+def get_uri_name(graph, uri, allocator=None):
     if isinstance(uri, URIRef):
-        return graph.compute_qname(uri)[-1]
+        return (allocator or uri_allocator(graph)).name(uri)
     else:
         return uri
 
-def create_uri_name_from_uris(graph,ns, uri_lst, suffix: Optional[str] = ""):
+def create_uri_name_from_uris(graph,ns, uri_lst, suffix: Optional[str] = "", allocator=None):
     # append uri names in namespace and check uniqueness against graph
     # URI list may not be all uris
+    # uniqueness comes from the graph's allocator (or the one passed in) instead of graph lookups
+    allocator = allocator or uri_allocator(graph)
     node_names = []
     for uri in uri_lst:
         if isinstance(uri, URIRef):
-            node_names.append(get_uri_name(graph, uri))
+            node_names.append(get_uri_name(graph, uri, allocator))
         else:
             node_names.append(uri)
-    new_uri = get_unique_uri(graph, ns[f"{'_'.join(node_names)}{suffix}"])
-    graph.add((new_uri, RDFS.label, Literal(get_uri_name(graph, new_uri))))
+    new_uri = allocator.allocate(ns[f"{'_'.join(node_names)}{suffix}"])
+    allocator.add((new_uri, RDFS.label, Literal(get_uri_name(graph, new_uri, allocator))))
     return new_uri
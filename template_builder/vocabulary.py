@@ -0,0 +1,112 @@
+"""
+Indexed vocabulary validation with nearest-match auto-repair.
+
+A VocabularyIndex is built once per vocabulary column and gives O(1) exact and
+normalized (case, whitespace, trailing punctuation and prefix insensitive)
+lookups, plus a trigram-candidate, edit-distance nearest-neighbour search used
+to repair near-miss LLM answers such as `Fluid-Air` for `s223:Fluid-Air`.
+"""
+
+import re
+import weakref
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+DEFAULT_REPAIR_THRESHOLD = 0.85
+
+
+def normalize(value):
+    """Normalize a vocabulary term for prefix- and punctuation-insensitive matching."""
+    value = str(value).strip().strip('`"\'').strip()
+    value = value.rstrip('.').strip()
+    if ':' in value:
+        value = value.split(':', 1)[1]
+    return re.sub(r"\s+", "", value).lower()
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class VocabularyIndex:
+    """
+    Args:
+        values (iterable): Canonical vocabulary terms, e.g. df['s223_class'].values
+        repair_threshold (float): Minimum similarity for an automatic repair
+    """
+
+    def __init__(self, values, repair_threshold=DEFAULT_REPAIR_THRESHOLD):
+        self.repair_threshold = repair_threshold
+        self.values = set()
+        self.normalized = {}
+        self.trigrams = defaultdict(set)
+        for value in values:
+            value = str(value)
+            self.values.add(value)
+            key = normalize(value)
+            self.normalized.setdefault(key, value)
+            for trigram in _trigrams(key):
+                self.trigrams[trigram].add(key)
+
+    def __contains__(self, value):
+        return str(value).strip() in self.values
+
+    def nearest(self, value, candidates=10):
+        """
+        Closest canonical term and its similarity in [0, 1], or (None, 0.0).
+        """
+        key = normalize(value)
+        if key in self.normalized:
+            return self.normalized[key], 1.0
+        shared = Counter()
+        for trigram in _trigrams(key):
+            for candidate in self.trigrams.get(trigram, ()):
+                shared[candidate] += 1
+        best, best_score = None, 0.0
+        # ties are broken by the term itself, not by set order, which varies with PYTHONHASHSEED
+        ranked = sorted(shared.items(), key=lambda item: (-item[1], item[0]))
+        for candidate, _ in ranked[:candidates]:
+            score = SequenceMatcher(None, key, candidate).ratio()
+            if score > best_score or (score == best_score and best is not None and candidate < best):
+                best, best_score = candidate, score
+        if best is None:
+            return None, 0.0
+        return self.normalized[best], best_score
+
+    def validate(self, value):
+        """
+        Validate and, if possible, repair a single value.
+
+        Returns:
+            tuple: (value_to_store, is_valid, confidence, repaired)
+        """
+        stripped = str(value).strip()
+        if stripped in self.values:
+            return stripped, True, 1.0, False
+        match, score = self.nearest(stripped)
+        if match is not None and score >= self.repair_threshold:
+            return match, True, score, True
+        return stripped, False, score, False
+
+    def validate_many(self, values):
+        """Validate a batch of values, e.g. the comma separated aspects of one class."""
+        return [self.validate(value) for value in values]
+
+
+# id(df) -> {(column_name, repair_threshold): VocabularyIndex}; dropped with the DataFrame
+_indexes = {}
+
+def vocabulary_index(df, column_name, repair_threshold=DEFAULT_REPAIR_THRESHOLD):
+    """
+    Index for a vocabulary DataFrame column, built on first use and reused while
+    the DataFrame is alive.
+    """
+    indexes = _indexes.get(id(df))
+    if indexes is None:
+        indexes = _indexes[id(df)] = {}
+        weakref.finalize(df, _indexes.pop, id(df), None)
+    key = (column_name, repair_threshold)
+    if key not in indexes:
+        indexes[key] = VocabularyIndex(df[column_name].values, repair_threshold)
+    return indexes[key]
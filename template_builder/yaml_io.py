@@ -0,0 +1,185 @@
+"""
+Shared YAML I/O for every pipeline stage.
+
+Uses the libyaml C loader and dumper when PyYAML was built with them and falls
+back to the pure-Python classes otherwise. Both read the same data, but the two
+emitters can wrap and escape double-quoted scalars differently (e.g. text with
+escapes or non-ASCII characters), so files written by one backend are not always
+byte-identical to the other's; LIBYAML records which one is in use.
+Files are a top-level mapping of entity name -> entity data. They are written
+one entity at a time, atomically, and can be read back either whole or as a
+stream of entities restricted to the keys a stage needs.
+"""
+
+import os
+
+import yaml
+from yaml.events import (
+    AliasEvent, MappingEndEvent, MappingStartEvent, ScalarEvent, SequenceEndEvent, SequenceStartEvent,
+)
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+try:
+    from yaml import CSafeLoader as _BaseLoader, CSafeDumper as _BaseDumper
+    LIBYAML = True
+except ImportError:
+    from yaml import SafeLoader as _BaseLoader, SafeDumper as _BaseDumper
+    LIBYAML = False
+
+
+class Loader(_BaseLoader):
+    pass
+
+
+class Dumper(_BaseDumper):
+    pass
+
+
+# Define a custom class for folded style text
+class FoldedString(str):
+    pass
+
+# Create a custom representer for the folded style
+def folded_str_representer(dumper, data):
+    # the C emitter only accepts plain str values
+    return dumper.represent_scalar('tag:yaml.org,2002:str', str(data), style='>')
+
+# Registered on our dumper (safe dumpers reject unknown str subclasses) and on the default one
+Dumper.add_representer(FoldedString, folded_str_representer)
+yaml.add_representer(FoldedString, folded_str_representer)
+
+DUMP_OPTIONS = {'Dumper': Dumper, 'default_flow_style': False, 'sort_keys': False}
+
+
+def dumps(data):
+    """Serialize data the way every stage writes its YAML."""
+    return yaml.dump(data, **DUMP_OPTIONS)
+
+
+def load(path):
+    """Load a whole YAML file; an empty file gives an empty dict."""
+    with open(path, 'r') as f:
+        return yaml.load(f, Loader=Loader) or {}
+
+
+def dump_entities(path, entities):
+    """
+    Write (name, data) pairs as one top-level mapping, entity by entity.
+
+    The file is written to a temporary name and renamed into place, so readers
+    never see a partial file. The result is identical to dumping the whole dict.
+
+    Returns:
+        int: The number of entities written
+    """
+    tmp_path = f"{path}.tmp"
+    written = 0
+    open_ended = False
+    with open(tmp_path, 'w') as f:
+        for name, data in entities:
+            text = dumps({name: data})
+            # a document ending in a folded scalar is closed with '...'; only the
+            # last entity of the file may keep it, elsewhere it would end the document
+            open_ended = text.endswith("\n...\n")
+            f.write(text[:-4] if open_ended else text)
+            written += 1
+        if open_ended:
+            f.write("...\n")
+        if not written:
+            f.write(dumps({}))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return written
+
+
+def dump(path, data):
+    """Write a dict of entities, see dump_entities."""
+    return dump_entities(path, data.items())
+
+
+def _compose(loader, event, anchors):
+    # build a node from the events of one value; only the needed values are composed
+    if isinstance(event, AliasEvent):
+        return anchors[event.anchor]
+    if isinstance(event, ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(ScalarNode, event.value, event.implicit)
+        node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+    elif isinstance(event, SequenceStartEvent):
+        tag = event.tag if event.tag not in (None, '!') else loader.resolve(SequenceNode, None, event.implicit)
+        node = SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        while not loader.check_event(SequenceEndEvent):
+            node.value.append(_compose(loader, loader.get_event(), anchors))
+        loader.get_event()
+    else:
+        tag = event.tag if event.tag not in (None, '!') else loader.resolve(MappingNode, None, event.implicit)
+        node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        while not loader.check_event(MappingEndEvent):
+            key = _compose(loader, loader.get_event(), anchors)
+            node.value.append((key, _compose(loader, loader.get_event(), anchors)))
+        loader.get_event()
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+def _skip(loader, event):
+    # consume the events of a value that is not needed
+    depth = 1 if isinstance(event, (SequenceStartEvent, MappingStartEvent)) else 0
+    while depth:
+        event = loader.get_event()
+        if isinstance(event, (SequenceStartEvent, MappingStartEvent)):
+            depth += 1
+        elif isinstance(event, (SequenceEndEvent, MappingEndEvent)):
+            depth -= 1
+
+
+def iter_entities(path, keys=None):
+    """
+    Stream the (name, data) pairs of an entity file without loading it whole.
+
+    Args:
+        path (str): YAML file with a top-level mapping
+        keys (iterable): Entity keys to keep; None keeps every key. Values of other
+            keys are skipped at the event level and never constructed.
+
+    Yields:
+        tuple: (entity name, entity data); data is a dict, or the raw value for
+            entities that are not mappings
+    """
+    keys = None if keys is None else set(keys)
+    with open(path, 'r') as f:
+        loader = Loader(f)
+        try:
+            loader.get_event()  # StreamStart
+            if loader.check_event(yaml.StreamEndEvent):
+                return
+            loader.get_event()  # DocumentStart
+            if not loader.check_event(MappingStartEvent):
+                # empty document or a bare scalar: nothing to stream
+                return
+            loader.get_event()
+            anchors = {}
+            while not loader.check_event(MappingEndEvent):
+                name = loader.construct_object(_compose(loader, loader.get_event(), anchors))
+                event = loader.get_event()
+                if keys is None or not isinstance(event, MappingStartEvent):
+                    yield name, loader.construct_object(_compose(loader, event, anchors), deep=True)
+                    loader.constructed_objects = {}
+                    continue
+                data = {}
+                while not loader.check_event(MappingEndEvent):
+                    key = loader.construct_object(_compose(loader, loader.get_event(), anchors))
+                    event = loader.get_event()
+                    if key in keys:
+                        data[key] = loader.construct_object(_compose(loader, event, anchors), deep=True)
+                    else:
+                        _skip(loader, event)
+                loader.get_event()
+                yield name, data
+                # constructed values are not needed again; keep memory flat on large files
+                loader.constructed_objects = {}
+        finally:
+            loader.dispose()
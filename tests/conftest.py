@@ -0,0 +1,29 @@
+import os
+import shutil
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the reviewed Brick YAML shipped with the repo, and the templates generated from it
+BRICK_YAML_DIR = os.path.join(REPO_ROOT, 'brick_yaml_reviewed', 'brick_yaml')
+TEMPLATES_DIR = os.path.join(REPO_ROOT, 's223_templates')
+
+
+def template_files(directory):
+    """{relative path: bytes} of the template files under directory, without the build's bookkeeping files."""
+    found = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith('.yml'):
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    found[os.path.relpath(path, directory)] = f.read()
+    return found
+
+
+@pytest.fixture
+def brick_yaml_dir(tmp_path):
+    """A writable copy of the reviewed Brick YAML tree."""
+    directory = tmp_path / 'brick_yaml'
+    shutil.copytree(BRICK_YAML_DIR, directory)
+    return str(directory)
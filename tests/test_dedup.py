@@ -0,0 +1,82 @@
+import os
+
+from rdflib import Graph
+from rdflib.compare import isomorphic
+
+from template_builder import create_223_templates, yaml_io
+from template_builder.create_223_templates import (
+    BASE_TEMPLATES_NAME, canonical_body_hash, deduplicate_directory, process_directory
+)
+from template_builder.namespaces import PARAM, RDF
+
+from conftest import TEMPLATES_DIR, template_files
+
+BODY = """@prefix P: <urn:___param___#> .
+@prefix qudt: <http://qudt.org/schema/qudt/> .
+@prefix s223: <http://data.ashrae.org/standard223#> .
+
+P:name a s223:QuantifiableObservableProperty ;
+    qudt:hasQuantityKind <http://qudt.org/vocab/quantitykind/Temperature> .
+"""
+
+
+def load_templates(directory):
+    templates = {}
+    for rel_path in template_files(directory):
+        templates.update(yaml_io.iter_entities(os.path.join(directory, rel_path)))
+    return templates
+
+
+def parse(body):
+    return Graph().parse(data=str(body), format='turtle')
+
+
+def test_canonical_hash_ignores_layout_and_triple_order():
+    reordered = """@prefix s223: <http://data.ashrae.org/standard223#> .
+<urn:___param___#name> <http://qudt.org/schema/qudt/hasQuantityKind> <http://qudt.org/vocab/quantitykind/Temperature> ;
+    a s223:QuantifiableObservableProperty .
+"""
+    assert canonical_body_hash(reordered) == canonical_body_hash(BODY)
+    assert canonical_body_hash(BODY.replace('Temperature', 'Pressure')) != canonical_body_hash(BODY)
+
+
+def test_deduplicated_templates_expand_to_their_bodies(brick_yaml_dir, tmp_path):
+    output_dir = str(tmp_path / 'templates')
+    counts = process_directory(brick_yaml_dir, output_dir, dedup=True)
+    assert counts['dedup']['shared_bodies'] > 0
+    bases = dict(yaml_io.iter_entities(os.path.join(output_dir, BASE_TEMPLATES_NAME)))
+    original = load_templates(TEMPLATES_DIR)
+    deduplicated = load_templates(output_dir)
+    shared = 0
+    for name, entry in deduplicated.items():
+        if name in bases:
+            continue
+        if 'dependencies' not in entry:
+            assert entry['body'] == original[name]['body']
+            continue
+        shared += 1
+        [dependency] = entry['dependencies']
+        stub = parse(entry['body'])
+        # the stub keeps P:name a parameter of the template itself
+        assert list(stub.triples((PARAM.name, RDF.type, None)))
+        assert isomorphic(stub + parse(bases[dependency['template']]['body']), parse(original[name]['body']))
+    assert shared >= 2 * counts['dedup']['shared_bodies']
+
+
+def test_deduplication_is_stable_on_its_own_output(brick_yaml_dir, tmp_path, monkeypatch):
+    output_dir = str(tmp_path / 'templates')
+    first = process_directory(brick_yaml_dir, output_dir, dedup=True)['dedup']
+    files = template_files(output_dir)
+    assert deduplicate_directory(output_dir) == first
+    assert template_files(output_dir) == files
+    # an unchanged build reuses the recorded stats instead of another pass
+    monkeypatch.setattr(create_223_templates, 'deduplicate_directory', None)
+    assert process_directory(brick_yaml_dir, output_dir, dedup=True)['dedup'] == first
+    assert template_files(output_dir) == files
+
+
+def test_build_without_dedup_removes_base_templates(brick_yaml_dir, tmp_path):
+    output_dir = str(tmp_path / 'templates')
+    process_directory(brick_yaml_dir, output_dir, dedup=True)
+    process_directory(brick_yaml_dir, output_dir)
+    assert template_files(output_dir) == template_files(TEMPLATES_DIR)
@@ -0,0 +1,76 @@
+import pytest
+from rdflib import Graph, Literal, Namespace
+
+from template_builder.namespaces import BRICK, RDF
+from template_builder.utils import INVERSE_PAIRS, InverseMaterializer, InverseView, materialize_inverse_relations
+
+EX = Namespace('urn:ex/')
+
+
+def model():
+    g = Graph()
+    g.add((EX.ahu, RDF.type, BRICK.AHU))
+    g.add((EX.ahu, BRICK.feeds, EX.vav))
+    g.add((EX.vav, BRICK.isFedBy, EX.ahu))
+    g.add((EX.vav, BRICK.hasPoint, EX.temp))
+    g.add((EX.pressure, BRICK.isPointOf, EX.vav))
+    g.add((EX.vav, BRICK.hasLocation, EX.room))
+    g.add((EX.temp, BRICK.isMeasuredBy, Literal('sensor 1')))
+    return g
+
+
+PATTERNS = [
+    (None, BRICK.isPointOf, None),
+    (None, BRICK.hasPoint, EX.pressure),
+    (EX.vav, BRICK.hasPoint, None),
+    (EX.room, BRICK.isLocationOf, EX.vav),
+    (None, BRICK.feeds, None),
+    (None, BRICK.measures, None),
+    (None, RDF.type, None),
+]
+
+
+@pytest.mark.parametrize('pattern', PATTERNS)
+def test_view_answers_like_the_materialized_graph(pattern):
+    materialized = model()
+    materialize_inverse_relations(materialized)
+    view = InverseView(model())
+    assert sorted(view.triples(pattern)) == sorted(materialized.triples(pattern))
+
+
+def test_view_lookups():
+    view = InverseView(model())
+    assert (EX.temp, BRICK.isPointOf, EX.vav) in view
+    assert (EX.vav, BRICK.hasPoint, EX.room) not in view
+    assert set(view.objects(EX.vav, BRICK.hasPoint)) == {EX.temp, EX.pressure}
+    assert list(view.subjects(BRICK.isLocationOf, EX.vav)) == [EX.room]
+    # a literal object cannot become a subject
+    assert list(view.triples((None, BRICK.measures, None))) == []
+
+
+def test_materialize_adds_missing_inverses_once():
+    g = model()
+    before = len(g)
+    # temp/pressure points and the room location; the ahu/vav pair is already complete
+    assert materialize_inverse_relations(g) == 3
+    assert len(g) == before + 3
+    assert materialize_inverse_relations(g) == 0
+    for s, p, o in g:
+        if p in INVERSE_PAIRS and not isinstance(o, Literal):
+            assert (o, INVERSE_PAIRS[p], s) in g
+
+
+def test_materializer_inverts_only_new_triples():
+    g = model()
+    materializer = InverseMaterializer(g)
+    assert materializer.materialize() == 3
+    assert materializer.materialize() == 0
+    g.add((EX.vav, BRICK.hasPart, EX.damper))
+    g.add((EX.ahu, BRICK.hasPart, EX.fan))
+    g.remove((EX.ahu, BRICK.hasPart, EX.fan))
+    assert materializer.materialize() == 1
+    assert (EX.damper, BRICK.isPartOf, EX.vav) in g
+    assert (EX.fan, BRICK.isPartOf, EX.ahu) not in g
+    materializer.close()
+    g.add((EX.vav, BRICK.hasPart, EX.coil))
+    assert materializer.pending == []
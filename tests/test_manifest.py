@@ -0,0 +1,82 @@
+import json
+import os
+
+from template_builder import create_223_templates
+from template_builder.create_223_templates import MANIFEST_NAME, process_directory
+
+from conftest import TEMPLATES_DIR, template_files
+
+EMBEDDED = os.path.join('Temperature_Sensor', 'Radiant_Panel_Temperature_Sensor', 'Embedded_Temperature_Sensor',
+                        'Embedded_Temperature_Sensor.yml')
+
+
+def read_manifest(output_dir):
+    with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def test_first_build_matches_checked_in_templates(brick_yaml_dir, tmp_path):
+    output_dir = str(tmp_path / 'templates')
+    counts = process_directory(brick_yaml_dir, output_dir)
+    assert (counts['rebuilt'], counts['skipped'], counts['removed'], counts['errors']) == (3, 0, 0, [])
+    assert template_files(output_dir) == template_files(TEMPLATES_DIR)
+
+
+def test_unchanged_inputs_are_skipped(brick_yaml_dir, tmp_path):
+    output_dir = str(tmp_path / 'templates')
+    process_directory(brick_yaml_dir, output_dir)
+    counts = process_directory(brick_yaml_dir, output_dir)
+    assert (counts['rebuilt'], counts['skipped'], counts['removed']) == (0, 3, 0)
+
+
+def test_only_changed_and_missing_outputs_are_rebuilt(brick_yaml_dir, tmp_path):
+    output_dir = str(tmp_path / 'templates')
+    process_directory(brick_yaml_dir, output_dir)
+    with open(os.path.join(brick_yaml_dir, EMBEDDED), 'a') as f:
+        f.write("\n")
+    os.remove(os.path.join(output_dir, 'Temperature_Sensor', 'Temperature_Sensor.yml'))
+    counts = process_directory(brick_yaml_dir, output_dir)
+    assert (counts['rebuilt'], counts['skipped']) == (2, 1)
+    assert template_files(output_dir) == template_files(TEMPLATES_DIR)
+
+
+def test_removed_input_removes_its_output(brick_yaml_dir, tmp_path):
+    output_dir = str(tmp_path / 'templates')
+    process_directory(brick_yaml_dir, output_dir)
+    os.remove(os.path.join(brick_yaml_dir, EMBEDDED))
+    counts = process_directory(brick_yaml_dir, output_dir)
+    assert counts['removed'] == 1
+    assert EMBEDDED not in read_manifest(output_dir)['files']
+    # the directory left empty is pruned too
+    assert not os.path.exists(os.path.join(output_dir, os.path.dirname(EMBEDDED)))
+
+
+def test_fingerprint_change_rebuilds_everything(brick_yaml_dir, tmp_path):
+    output_dir = str(tmp_path / 'templates')
+    process_directory(brick_yaml_dir, output_dir)
+    counts = process_directory(brick_yaml_dir, output_dir, dedup=True)
+    assert counts['rebuilt'] == 3
+    counts = process_directory(brick_yaml_dir, output_dir)
+    assert counts['rebuilt'] == 3
+    assert template_files(output_dir) == template_files(TEMPLATES_DIR)
+
+
+def test_failed_inputs_keep_their_entry_and_are_retried(brick_yaml_dir, tmp_path, monkeypatch):
+    output_dir = str(tmp_path / 'templates')
+    create_template = create_223_templates.create_template_for_entity
+
+    def failing(entity_name, entity_data, verify=False):
+        if entity_name == 'Core_Temperature_Sensor':
+            raise ValueError("broken entity")
+        return create_template(entity_name, entity_data, verify)
+
+    monkeypatch.setattr(create_223_templates, 'create_template_for_entity', failing)
+    counts = process_directory(brick_yaml_dir, output_dir)
+    assert [error['entity'] for error in counts['errors']] == ['Core_Temperature_Sensor']
+    assert read_manifest(output_dir)['files'][EMBEDDED]['failed'] is True
+
+    monkeypatch.setattr(create_223_templates, 'create_template_for_entity', create_template)
+    counts = process_directory(brick_yaml_dir, output_dir)
+    assert (counts['rebuilt'], counts['skipped'], counts['errors']) == (1, 2, [])
+    assert 'failed' not in read_manifest(output_dir)['files'][EMBEDDED]
+    assert template_files(output_dir) == template_files(TEMPLATES_DIR)
@@ -0,0 +1,17 @@
+from template_builder.create_223_templates import process_directory, render_files, yaml_files
+
+from conftest import TEMPLATES_DIR, template_files
+
+
+def test_parallel_render_matches_serial(brick_yaml_dir):
+    paths = [path for path, _ in yaml_files(brick_yaml_dir)]
+    serial = list(render_files(paths))
+    # chunks smaller than a file, so files are split across workers
+    assert render_files(paths, workers=2, chunk_size=2) == serial
+
+
+def test_parallel_build_matches_checked_in_templates(brick_yaml_dir, tmp_path):
+    output_dir = str(tmp_path / 'templates')
+    counts = process_directory(brick_yaml_dir, output_dir, workers=2, chunk_size=2)
+    assert (counts['rebuilt'], counts['errors']) == (3, [])
+    assert template_files(output_dir) == template_files(TEMPLATES_DIR)
@@ -0,0 +1,69 @@
+import gc
+import weakref
+
+import pandas as pd
+import pytest
+from rdflib import Graph, Literal, Namespace, URIRef
+
+from template_builder import utils
+from template_builder.namespaces import BRICK, RDF, RDFS
+from template_builder.utils import format_value, query_to_df, result_converter
+
+EX = Namespace('http://example.org/building#')
+
+QUERY = """SELECT ?s ?label ?parent WHERE {
+    ?s rdfs:label ?label .
+    OPTIONAL { ?s rdfs:subClassOf ?parent }
+} ORDER BY ?s"""
+
+
+def graph():
+    g = Graph()
+    g.bind('ex', EX)
+    g.bind('brick', BRICK)
+    g.add((EX.ahu, RDFS.label, Literal('AHU 1')))
+    g.add((EX.ahu, RDFS.subClassOf, BRICK.Equipment))
+    g.add((EX['1st-floor'], RDFS.label, Literal('first floor', lang='en')))
+    g.add((EX['zone/a'], RDFS.label, Literal(3)))
+    g.add((URIRef('http://unbound.example/thing'), RDFS.label, Literal('x')))
+    g.add((EX.vav, RDFS.label, Literal('http://not-a-uri.example')))
+    g.add((EX.vav, RDFS.subClassOf, RDF.Property))
+    return g
+
+
+def expected(g):
+    # the per-value path query_to_df used before the converter
+    rows = [[format_value(value, g) for value in row] for row in g.query(QUERY)]
+    return pd.DataFrame(rows, columns=['s', 'label', 'parent'])
+
+
+def test_query_to_df_matches_format_value():
+    g = graph()
+    reference = expected(g)
+    pd.testing.assert_frame_equal(query_to_df(QUERY, g), reference)
+    assert query_to_df(QUERY, g, output='tuples') == list(reference.itertuples(index=False, name=None))
+    assert query_to_df(QUERY, g, output='columns') == reference.to_dict(orient='list')
+
+
+def test_converter_follows_namespace_changes():
+    g = graph()
+    assert result_converter(g).value(str(EX.ahu)) == 'ex:ahu'
+    g.bind('bldg', EX, override=True, replace=True)
+    assert result_converter(g).value(str(EX.ahu)) == format_value(str(EX.ahu), g) == 'bldg:ahu'
+
+
+def test_unknown_output_raises():
+    with pytest.raises(ValueError):
+        query_to_df(QUERY, graph(), output='rows')
+
+
+def test_cached_converter_does_not_keep_its_graph_alive():
+    g = graph()
+    key = id(g)
+    query_to_df(QUERY, g)
+    assert key in utils._converters
+    ref = weakref.ref(g)
+    del g
+    gc.collect()
+    assert ref() is None
+    assert key not in utils._converters
@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+from rdflib import Graph, Literal, Namespace
+
+from benchmarks.synthetic import s223_like_graph
+from template_builder.get_s223_data import (
+    EXCLUDED_ENUMERATION_KINDS, EXCLUDED_ENUMERATIONS, VOCABULARY_COLUMNS, SubclassClosure, extract_vocabularies
+)
+from template_builder.namespaces import QK, QUDT, RDFS, S223, bind_prefixes
+from template_builder.utils import query_to_df
+
+EX = Namespace('urn:ex/')
+
+
+def hierarchy():
+    g = Graph()
+    for child, parent in [('b', 'a'), ('c', 'a'), ('d', 'b'), ('d', 'c'), ('e', 'd'), ('f', 'e'), ('e', 'f')]:
+        g.add((EX[child], RDFS.subClassOf, EX[parent]))
+    return g
+
+
+@pytest.mark.parametrize('cls', ['a', 'b', 'd', 'e', 'g'])
+@pytest.mark.parametrize('include_self', [True, False])
+def test_descendants_match_property_paths(cls, include_self):
+    g = hierarchy()
+    path = '*' if include_self else '+'
+    expected = {row[0] for row in g.query(f"SELECT ?c WHERE {{ ?c rdfs:subClassOf{path} <{EX[cls]}> }}")}
+    assert SubclassClosure(g).descendants(EX[cls], include_self) == expected
+
+
+def _not_under(classes, path='*'):
+    return "\n".join(f"FILTER NOT EXISTS {{ ?s223_class rdfs:subClassOf{path} s223:{name} . }}" for name in classes)
+
+
+# the SPARQL queries extract_vocabularies replaced
+QUERIES = [
+    f"""SELECT DISTINCT ?s223_class ?s223_definition WHERE {{
+        ?s223_class rdfs:subClassOf* s223:Property ; rdfs:comment ?s223_definition .
+        FILTER NOT EXISTS {{ ?s223_class qudt:hasQuantityKind ?qk . }}
+    }}""",
+    f"""SELECT DISTINCT ?s223_class ?s223_definition WHERE {{
+        ?s223_class rdfs:subClassOf* s223:EnumerationKind-Substance ; rdfs:comment ?s223_definition .
+        {_not_under(['Electricity-DC', 'Electricity-AC'], '+')}
+    }}""",
+    f"""SELECT DISTINCT ?s223_class ?s223_definition WHERE {{
+        ?s223_class rdfs:subClassOf* s223:EnumerationKind-Aspect ; rdfs:comment ?s223_definition .
+        {_not_under(EXCLUDED_ENUMERATIONS)}
+    }}""",
+    f"""SELECT DISTINCT ?s223_class ?s223_definition WHERE {{
+        ?s223_class rdfs:subClassOf+ s223:EnumerationKind ; rdfs:comment ?s223_definition .
+        {_not_under(EXCLUDED_ENUMERATION_KINDS)}
+    }}""",
+]
+
+
+def test_vocabularies_match_the_sparql_queries():
+    s223 = s223_like_graph(per_root=8, seed=3)
+    # the cases the exclusions are for, which the synthetic vocabulary lacks
+    for child, parent in [('Electricity-DC', 'EnumerationKind-Substance'), ('DC-24V', 'Electricity-DC'),
+                          ('Aspect-Voltage', 'EnumerationKind-Aspect'), ('Aspect-Voltage', 'EnumerationKind-Numerical'),
+                          ('Role-Loop', 'EnumerationKind-Role'), ('Role-Loop', 'Role-Loop-Child'),
+                          ('Role-Loop-Child', 'Role-Loop'), ('QuantifiableProperty', 'Property')]:
+        s223.add((S223[child], RDFS.subClassOf, S223[parent]))
+        s223.add((S223[child], RDFS.comment, Literal(f"The {child} class")))
+    s223.add((S223.QuantifiableProperty, QUDT.hasQuantityKind, QK.Temperature))
+    bind_prefixes(s223)
+    frames = extract_vocabularies(s223)
+    for frame, query in zip(frames, QUERIES):
+        expected = query_to_df(query, s223).sort_values(VOCABULARY_COLUMNS).reset_index(drop=True)
+        assert len(expected)
+        pd.testing.assert_frame_equal(frame, expected)
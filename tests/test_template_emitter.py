@@ -0,0 +1,44 @@
+import pytest
+
+from template_builder.create_223_templates import (
+    create_template_for_entity, create_template_for_entity_rdflib, load_entities, yaml_files
+)
+from template_builder.template_emitter import emit_template, verify_template
+
+from conftest import BRICK_YAML_DIR
+
+ENTITIES = [
+    {},
+    {'s223_class': 's223:QuantifiableObservableProperty'},
+    {'s223_class': 's223:QuantifiableObservableProperty', 'quantitykind': 'Temperature',
+     'medium': 's223:Fluid-Air', 'aspects': 's223:Aspect-DryBulb'},
+    {'s223_class': 's223:EnumeratedObservableProperty', 'enumerationkind': 's223:EnumerationKind-RunStatus'},
+    {'s223_class': 's223:QuantifiableObservableProperty', 'quantitykind': 'Pressure', 'medium': 'None',
+     'aspects': 's223:Role-Supply, s223:Aspect-Setpoint,s223:Aspect-Deadband'},
+    {'quantitykind': 'Temperature', 'aspects': 'None'},
+]
+
+
+@pytest.mark.parametrize('entity_data', ENTITIES)
+def test_emitter_matches_rdflib_serializer(entity_data):
+    assert emit_template(entity_data) == create_template_for_entity_rdflib('X', entity_data)
+
+
+def test_reviewed_entities_match_rdflib_serializer():
+    for yaml_path, _ in yaml_files(BRICK_YAML_DIR):
+        for entity_name, entity_data in load_entities(yaml_path):
+            assert emit_template(entity_data) == create_template_for_entity_rdflib(entity_name, entity_data)
+
+
+def test_unsafe_local_name_falls_back_to_rdflib():
+    entity_data = {'s223_class': 's223:QuantifiableObservableProperty', 'medium': 's223:Fluid/Air'}
+    with pytest.raises(ValueError):
+        emit_template(entity_data)
+    assert create_template_for_entity('X', entity_data) == create_template_for_entity_rdflib('X', entity_data)
+
+
+def test_verify_template():
+    entity_data = ENTITIES[2]
+    assert verify_template(emit_template(entity_data), create_template_for_entity_rdflib('X', entity_data))
+    assert not verify_template(emit_template(entity_data), create_template_for_entity_rdflib('X', ENTITIES[1]))
+    assert create_template_for_entity('X', entity_data, verify=True) == emit_template(entity_data)
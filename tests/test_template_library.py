@@ -0,0 +1,47 @@
+import pytest
+
+from template_builder.create_223_templates import process_directory
+from template_builder.template_library import (
+    directory_to_library, library_metadata, library_to_directory, lookup_templates,
+    process_directory_to_library, read_library
+)
+
+from conftest import TEMPLATES_DIR, template_files
+
+
+def test_rendered_library_writes_back_byte_identical(brick_yaml_dir, tmp_path):
+    library_path = str(tmp_path / 'templates.sqlite')
+    counts = process_directory_to_library(brick_yaml_dir, library_path)
+    assert (counts['files'], counts['errors']) == (3, [])
+    output_dir = str(tmp_path / 'templates')
+    assert library_to_directory(library_path, output_dir) == 3
+    assert template_files(output_dir) == template_files(TEMPLATES_DIR)
+
+
+def test_directory_round_trip_is_byte_identical(brick_yaml_dir, tmp_path):
+    built = str(tmp_path / 'built')
+    process_directory(brick_yaml_dir, built, dedup=True)
+    library_path = str(tmp_path / 'templates.sqlite')
+    directory_to_library(built, library_path)
+    output_dir = str(tmp_path / 'templates')
+    library_to_directory(library_path, output_dir)
+    # dependencies of deduplicated templates survive too
+    assert template_files(output_dir) == template_files(built)
+
+
+def test_lookup_by_name_and_parent(tmp_path):
+    library_path = str(tmp_path / 'templates.sqlite')
+    directory_to_library(TEMPLATES_DIR, library_path)
+    files = dict(read_library(library_path))
+    by_parent = lookup_templates(library_path, parent='Embedded_Temperature_Sensor')
+    assert list(by_parent) == [name for name, _ in files[
+        'Temperature_Sensor/Radiant_Panel_Temperature_Sensor/Embedded_Temperature_Sensor/Embedded_Temperature_Sensor.yml']]
+    found = lookup_templates(library_path, names=['Core_Temperature_Sensor', 'No_Such_Class'])
+    assert list(found) == ['Core_Temperature_Sensor']
+    assert 'qudt:hasQuantityKind' in found['Core_Temperature_Sensor']['body']
+    assert library_metadata(library_path)['source'] == 'directory'
+
+
+def test_missing_library_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        read_library(str(tmp_path / 'missing.sqlite'))
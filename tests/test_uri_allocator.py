@@ -0,0 +1,89 @@
+import gc
+
+from rdflib import Graph, Literal, Namespace, URIRef
+
+from template_builder import utils
+from template_builder.namespaces import BRICK, RDF, RDFS
+from template_builder.utils import UriAllocator, create_uri_name_from_uris, get_unique_uri, uri_allocator
+
+EX = Namespace('urn:ex/')
+
+
+def model():
+    g = Graph()
+    g.bind('ex', EX)
+    for name in ('ahu', 'ahu-1', 'ahu-3', 'sensor'):
+        g.add((EX[name], RDF.type, BRICK.Equipment))
+    g.add((EX.vav, BRICK.isFedBy, EX['sensor-1']))
+    return g
+
+
+def mint_with_lookups(g, names):
+    # the graph-searching reference: mint one URI, then use it
+    minted = []
+    for name in names:
+        uri = get_unique_uri(g, EX[name])
+        g.add((uri, RDFS.label, Literal(name)))
+        minted.append(uri)
+    return minted
+
+
+NAMES = ['ahu', 'ahu', 'sensor', 'ahu', 'vav', 'sensor', 'new', 'ahu-1', 'new', 'ahu']
+
+
+def test_allocator_mints_the_same_names_as_get_unique_uri():
+    expected = mint_with_lookups(model(), NAMES)
+    g = model()
+    allocator = UriAllocator(g)
+    minted = []
+    for name in NAMES:
+        uri = allocator.allocate(EX[name])
+        allocator.add((uri, RDFS.label, Literal(name)))
+        minted.append(uri)
+    assert minted == expected
+
+
+def test_reserved_names_are_not_handed_out_twice():
+    allocator = UriAllocator(model())
+    assert allocator.reserve([EX.ahu, EX.ahu, EX.fan, EX.fan]) == [EX['ahu-2'], EX['ahu-4'], EX.fan, EX['fan-1']]
+    allocator.exclude([EX.pump])
+    allocator.refresh()
+    assert allocator.allocate(EX.pump) == EX['pump-1']
+
+
+def test_create_uri_name_from_uris_matches_get_unique_uri():
+    def reference(g, uri_lst, suffix=""):
+        node_names = [g.compute_qname(uri)[-1] if isinstance(uri, URIRef) else uri for uri in uri_lst]
+        new_uri = get_unique_uri(g, EX[f"{'_'.join(node_names)}{suffix}"])
+        g.add((new_uri, RDFS.label, Literal(g.compute_qname(new_uri)[-1])))
+        return new_uri
+
+    calls = [([EX.ahu, EX.sensor], ""), ([EX.ahu, EX.sensor], ""), (["ahu"], "-1"), ([EX.vav, 'supply'], "_prop"),
+             (["ahu"], ""), ([EX.ahu, EX.sensor], "")]
+    expected_graph = model()
+    expected = [reference(expected_graph, uri_lst, suffix) for uri_lst, suffix in calls]
+    g = model()
+    assert [create_uri_name_from_uris(g, EX, uri_lst, suffix) for uri_lst, suffix in calls] == expected
+    assert set(g) == set(expected_graph)
+
+
+def test_following_allocator_sees_direct_changes():
+    g = model()
+    allocator = uri_allocator(g)
+    assert uri_allocator(g) is allocator
+    g.add((EX.fan, RDF.type, BRICK.Fan))
+    g.addN([(EX['fan-1'], RDF.type, BRICK.Fan, g)])
+    assert allocator.allocate(EX.fan) == get_unique_uri(g, EX.fan) == EX['fan-2']
+    # removals dispatch no events; the shrunk graph is reindexed instead
+    g.remove((EX.ahu, None, None))
+    assert allocator.allocate(EX.ahu) == get_unique_uri(g, EX.ahu) == EX.ahu
+
+
+def test_graph_allocator_is_dropped_with_its_graph():
+    g = model()
+    key = id(g)
+    uri_allocator(g)
+    assert key in utils._allocators
+    del g
+    gc.collect()
+    assert key not in utils._allocators